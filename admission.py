@@ -0,0 +1,265 @@
+# admission.py
+import os
+import time
+import random
+import asyncio
+import weakref
+import email.utils
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+
+T = TypeVar("T")
+
+# Лимиты вызовов DeepSeek (через .env)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))  # одновременно в upstream
+LLM_MAX_PER_USER = int(os.getenv("LLM_MAX_PER_USER", "2"))         # одновременно от одного игрока
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "200"))           # ждущих слота, дальше — 503
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))    # сколько ждать слот, секунд
+LLM_RATE = float(os.getenv("LLM_RATE", "0"))                       # запросов/с по квоте провайдера (0 — без лимита)
+LLM_BURST = int(os.getenv("LLM_BURST", "10"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "3"))                   # повторов после первой попытки
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))     # сбоев подряд до размыкания (0 — выключен)
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "15"))  # секунд без upstream до пробного запроса
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class Overloaded(Exception):
+    """Очередь к LLM переполнена или слот не дождались — отвечаем 503 сразу"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Ведро токенов: rate запросов в секунду, не больше burst подряд"""
+
+    def __init__(self, rate: float, burst: int, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.clock = clock
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:  # очередь честная: кто раньше пришёл, тот раньше получит токен
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+def retry_after_seconds(response: Optional[httpx.Response]) -> Optional[float]:
+    """Retry-After из ответа: число секунд или HTTP-дата"""
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRYABLE_STATUS
+    return isinstance(exc, (httpx.TransportError, httpx.TimeoutException))
+
+
+def backoff_delay(attempt: int, exc: Optional[BaseException] = None,
+                  base: float = LLM_BACKOFF_BASE, cap: float = LLM_BACKOFF_MAX) -> float:
+    """Экспоненциальная задержка с полным джиттером; Retry-After от провайдера важнее"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        hinted = retry_after_seconds(exc.response)
+        if hinted is not None:
+            return min(hinted, cap) + random.uniform(0, base)
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Размыкатель цепи к upstream: после failures сбоев подряд (ошибки связи,
+    5xx/429 после повторов, пропущенный дедлайн хода) запросы в DeepSeek не идут
+    cooldown секунд — ходы сразу получают запасное повествование. Потом один
+    пробный запрос: успех замыкает цепь, сбой — ещё cooldown. Пробный запрос,
+    который так и не закончился (отбит допуском), не держит цепь: через
+    cooldown пропускается следующий.
+    """
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN,
+                 clock: Callable[[], float] = time.monotonic):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.clock = clock
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+
+        self.opened = 0
+        self.short_circuited = 0
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if self.clock() - self._opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        """Можно ли идти в upstream; в разомкнутом состоянии — только пробный запрос раз в cooldown"""
+        if self._opened_at is None:
+            return True
+        now = self.clock()
+        if now - self._opened_at >= self.cooldown:
+            self._opened_at = now  # следующий пробный — не раньше, чем через cooldown
+            return True
+        self.short_circuited += 1
+        return False
+
+    def success(self):
+        self._failures = 0
+        self._opened_at = None
+
+    def failure(self):
+        if self.threshold <= 0:
+            return
+        self._failures += 1
+        if self._opened_at is not None or self._failures >= self.threshold:
+            if self._opened_at is None:
+                self.opened += 1
+            self._opened_at = self.clock()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "state": self.state,
+            "failures": self._failures,
+            "opened": self.opened,
+            "short_circuited": self.short_circuited,
+        }
+
+
+class AdmissionController:
+    """
+    Допуск запросов к LLM: общий и поигроковый лимит одновременных вызовов,
+    ограниченная очередь с таймаутом, ведро токенов под квоту провайдера
+    и повторы с джиттером. Лишние запросы отбиваются сразу (Overloaded → 503),
+    а не копятся корутинами.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_per_user: int = LLM_MAX_PER_USER,
+        max_queue: int = LLM_QUEUE_SIZE,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT,
+        rate: float = LLM_RATE,
+        burst: int = LLM_BURST,
+        retries: int = LLM_RETRIES,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retries = retries
+        self.bucket = TokenBucket(rate, burst)
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._users: "weakref.WeakValueDictionary[str, asyncio.Semaphore]" = weakref.WeakValueDictionary()
+
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.retried = 0
+
+    def saturated(self) -> bool:
+        """Все слоты заняты и очередь полна — новый запрос сразу получит отказ"""
+        return self.active + self.waiting >= self.max_concurrency + self.max_queue
+
+    def _user_semaphore(self, user_id: str) -> asyncio.Semaphore:
+        sem = self._users.get(user_id)
+        if sem is None:
+            sem = asyncio.Semaphore(self.max_per_user)
+            self._users[user_id] = sem
+        return sem
+
+    async def _acquire(self, user_sem: Optional[asyncio.Semaphore]):
+        if user_sem is not None:
+            await user_sem.acquire()
+        try:
+            await self._global.acquire()
+        except BaseException:
+            if user_sem is not None:
+                user_sem.release()
+            raise
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[str] = None):
+        if self.saturated():
+            self.rejected += 1
+            raise Overloaded("LLM queue is full")
+
+        user_sem = self._user_semaphore(user_id) if user_id is not None else None
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._acquire(user_sem), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise Overloaded("LLM queue wait timed out")
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._global.release()
+            if user_sem is not None:
+                user_sem.release()
+
+    async def call(self, fn: Callable[[], Awaitable[T]], user_id: Optional[str] = None) -> T:
+        """Вызов fn в слоте: каждая попытка берёт токен, повторяем только то, что имеет смысл"""
+        async with self.slot(user_id):
+            attempt = 0
+            while True:
+                await self.bucket.acquire()
+                try:
+                    return await fn()
+                except Exception as e:
+                    if attempt >= self.retries or not is_retryable(e):
+                        raise
+                    self.retried += 1
+                    await asyncio.sleep(backoff_delay(attempt, e))
+                    attempt += 1
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "retried": self.retried,
+        }
@@ -1,52 +0,0 @@
-# ai_client.py
-import os
-import requests
-from typing import Optional
-
-# Загружаем API-ключ (если используете DeepSeek через HTTP-эндпоинт)
-DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
-
-# Пример для гипотетического DeepSeek API (если у вас свой сервер — замените URL)
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"  # ← ПРИМЕР! Уточните реальный URL
-
-async def get_ai_response(user_prompt: str, context: str = "") -> str:
-    """
-    Отправляет запрос в DeepSeek и возвращает ответ.
-    Пока — заглушка для тестов.
-    """
-    # 🔁 ЗАМЕНИТЕ ЭТО на реальный вызов DeepSeek!
-    if not DEEPSEEK_API_KEY:
-        return (
-            "🧙‍♂️ *Голос древнего мудреца звучит эхом:*\n"
-            "\"Приключение начинается... Туман клубится вокруг тебя. "
-            "Перед тобой — три пути: в лес, в пещеру или к старому мосту. "
-            "Куда ступишь?\""
-        )
-
-    # 🔜 Пример реализации (если у вас есть API):
-    # headers = {
-    #     "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-    #     "Content-Type": "application/json"
-    # }
-    # data = {
-    #     "model": "deepseek-chat",
-    #     "messages": [
-    #         {"role": "system", "content": "Ты — повествователь в фэнтези-мире. Описывай мир, реагируй на действия игрока живо, детально, с драматизмом."},
-    #         {"role": "user", "content": f"Контекст: {context}\nДействие игрока: {user_prompt}"}
-    #     ],
-    #     "temperature": 0.8
-    # }
-    # try:
-    #     response = requests.post(DEEPSEEK_API_URL, headers=headers, json=data, timeout=30)
-    #     response.raise_for_status()
-    #     return response.json()["choices"][0]["message"]["content"].strip()
-    # except Exception as e:
-    #     return f"🧙‍♂️ *Ошибка вызова ИИ:* {str(e)}"
-
-    # Пока возвращаем заглушку:
-    return (
-        f"🧙‍♂️ *Голос повествователя:*\n"
-        f"«{user_prompt}» — эхом прокатилось по земле.\n"
-        "В ответ на твои действия земля дрогнула... Из-за холма появился волк с глазами, как угли. "
-        "Он рычит, но не нападает. Что сделаешь?"
-    )
\ No newline at end of file
@@ -0,0 +1,194 @@
+# assets.py
+import os
+import re
+import gzip
+import hashlib
+import logging
+import mimetypes
+from typing import Dict, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli  # pip install brotli — необязателен, без него отдаём gzip
+except ImportError:
+    brotli = None
+
+# Фронтенд Mini App целиком в памяти: index.html и ассеты читаются один раз,
+# сжимаются при старте (gzip + brotli), ассеты получают адреса с хэшем содержимого
+# (static/style.3f2a9c1e.css) и кэшируются браузером навсегда (immutable).
+# index.html не кэшируется надолго, но отдаётся с ETag → повторный заход — 304 без тела.
+
+STATIC_DIR = os.getenv("STATIC_DIR", "static")
+# Как часто проверять файлы фронтенда на изменения (0 — только при старте)
+STATIC_RELOAD_INTERVAL = float(os.getenv("STATIC_RELOAD_INTERVAL", "5"))
+STATIC_GZIP_LEVEL = int(os.getenv("STATIC_GZIP_LEVEL", "9"))
+# Мелочь не сжимаем — заголовки дороже выигрыша
+STATIC_COMPRESS_MIN_BYTES = 256
+
+INDEX = "index.html"
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"  # можно хранить, но каждый раз сверять ETag
+# src="static/x.js" / href="/static/x.css" в index.html → адрес с хэшем
+_ASSET_REF = re.compile(r'(?P<attr>(?:src|href)=")(?P<prefix>/?static/)(?P<name>[^"?#]+)"')
+
+
+class Asset:
+    """Один файл: исходник + сжатые варианты, у каждого свой сильный ETag"""
+
+    __slots__ = ("name", "url_name", "media_type", "digest", "variants")
+
+    def __init__(self, name: str, body: bytes):
+        self.name = name
+        self.media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if self.media_type.startswith("text/") or self.media_type in ("application/javascript", "image/svg+xml"):
+            self.media_type += "; charset=utf-8"
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        stem, ext = os.path.splitext(name)
+        self.url_name = f"{stem}.{self.digest[:8]}{ext}"
+        # кодировка → (тело, ETag); сжатый вариант хранится, только если он меньше
+        self.variants: Dict[str, Tuple[bytes, str]] = {"identity": (body, f'"{self.digest}"')}
+        if len(body) >= STATIC_COMPRESS_MIN_BYTES:
+            self._add("gzip", gzip.compress(body, compresslevel=STATIC_GZIP_LEVEL, mtime=0))
+            if brotli is not None:
+                self._add("br", brotli.compress(body, quality=11))
+
+    def _add(self, encoding: str, body: bytes):
+        if len(body) < len(self.variants["identity"][0]):
+            self.variants[encoding] = (body, f'"{self.digest}-{encoding}"')
+
+    def pick(self, accept_encoding: str) -> str:
+        """Лучший вариант, который понимает клиент: br → gzip → без сжатия"""
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and encoding in accepted:
+                return encoding
+        return "identity"
+
+
+def _accepted_encodings(header: str) -> set:
+    accepted = set()
+    for part in header.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000"):
+            continue
+        accepted.add(name.strip())
+    if "*" in accepted:
+        accepted.update(("br", "gzip"))
+    return accepted
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # W/ — слабое сравнение допустимо для If-None-Match
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class AssetStore:
+    """
+    Снимок каталога static/ в памяти. refresh_if_changed() сверяет mtime файлов
+    и пересобирает снимок целиком (новые хэши → новые адреса в index.html).
+    """
+
+    def __init__(self, root: str = STATIC_DIR):
+        self.root = root
+        self.version = 0
+        self.assets: Dict[str, Asset] = {}     # имя и адрес с хэшем → ассет
+        self.index: Optional[Asset] = None
+        self._mtimes: Dict[str, float] = {}
+        self.not_modified = 0
+        self.served = 0
+        self.load()
+
+    def _scan(self) -> Dict[str, float]:
+        mtimes = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                mtimes[os.path.relpath(path, self.root).replace(os.sep, "/")] = os.stat(path).st_mtime
+        return mtimes
+
+    def load(self):
+        if not os.path.isdir(self.root):
+            logging.warning(f"Каталог фронтенда {self.root} не найден")
+            return
+        mtimes = self._scan()
+        assets: Dict[str, Asset] = {}
+        for name in mtimes:
+            if name == INDEX:
+                continue
+            with open(os.path.join(self.root, name), "rb") as f:
+                asset = Asset(name, f.read())
+            assets[name] = assets[asset.url_name] = asset
+        # адреса прошлой версии живут до следующей: у открытых вкладок ещё старый index.html
+        for key, asset in self.assets.items():
+            if key == asset.url_name and self.assets.get(asset.name) is asset:
+                assets.setdefault(key, asset)
+
+        index = None
+        if INDEX in mtimes:
+            with open(os.path.join(self.root, INDEX), "r", encoding="utf-8") as f:
+                html = f.read()
+
+            def fingerprint(match: re.Match) -> str:
+                asset = assets.get(match["name"])
+                if asset is None:
+                    return match[0]
+                return f'{match["attr"]}{match["prefix"]}{asset.url_name}"'
+
+            index = Asset(INDEX, _ASSET_REF.sub(fingerprint, html).encode("utf-8"))
+
+        # подмена целиком — запросы в полёте дочитают старый снимок
+        self.assets, self.index, self._mtimes = assets, index, mtimes
+        self.version += 1
+        logging.info(f"Фронтенд загружен (v{self.version}), файлов: {len(mtimes)}"
+                     f"{', brotli' if brotli is not None else ''}")
+
+    def refresh_if_changed(self) -> bool:
+        if not os.path.isdir(self.root) or self._scan() == self._mtimes:
+            return False
+        self.load()
+        return True
+
+    def response(self, asset: Asset, request: Request, cache_control: str) -> Response:
+        encoding = asset.pick(request.headers.get("accept-encoding", ""))
+        body, etag = asset.variants[encoding]
+        headers = {"ETag": etag, "Cache-Control": cache_control}
+        if len(asset.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        self.served += 1
+        return Response(body, media_type=asset.media_type, headers=headers)
+
+    def serve(self, path: str, request: Request) -> Response:
+        asset = self.index if path == INDEX else self.assets.get(path)
+        if asset is None:
+            return Response("Not Found", status_code=404, media_type="text/plain")
+        # по адресу с хэшем содержимое не меняется никогда; по старому имени — сверяем ETag
+        return self.response(asset, request, IMMUTABLE if path == asset.url_name else REVALIDATE)
+
+    def serve_index(self, request: Request) -> Optional[Response]:
+        if self.index is None:
+            return None
+        return self.response(self.index, request, REVALIDATE)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "version": self.version,
+            "files": len(self._mtimes),
+            "brotli": brotli is not None,
+            "served": self.served,
+            "not_modified": self.not_modified,
+        }
+
+
+static_assets = AssetStore()
@@ -0,0 +1,152 @@
+# batching.py
+import json
+import time
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+# Элемент пачки — что угодно, что понимает dispatch (у повествователя: (messages, user_id))
+Item = Any
+
+
+class MicroBatcher:
+    """
+    Микропачки запросов с общим префиксом (регион + системный промпт).
+
+    Первый запрос по ключу открывает окно `window` секунд; всё, что пришло
+    с тем же ключом за окно (или до `max_batch` штук), уходит одной пачкой:
+    одинаковые запросы склеиваются в один вызов, остальные идут параллельно
+    по общим соединениям. Если префикс «холодный» (давно не отправлялся),
+    сначала уходит лидер, а остальные — через `leader_delay`: к этому времени
+    провайдер уже посчитал префикс, и они попадают в его кэш.
+    Кто перестал ждать (дедлайн хода, разрыв), из пачки выпадает; вызов, который
+    больше никто не ждёт, отменяется и освобождает слот допуска.
+    """
+
+    def __init__(
+        self,
+        dispatch: Callable[[Item], Awaitable[Any]],
+        identity: Optional[Callable[[Item], str]] = None,
+        window: float = 0.02,
+        max_batch: int = 16,
+        leader_delay: float = 0.0,
+        warm_ttl: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.dispatch = dispatch
+        self.identity = identity or self.fingerprint
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.leader_delay = leader_delay
+        self.warm_ttl = warm_ttl
+        self.clock = clock
+        self._open: Dict[str, List[Tuple[Item, asyncio.Future]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._warm: Dict[str, float] = {}  # ключ префикса → когда последний раз отправляли
+        self._running: Set[asyncio.Task] = set()  # ссылки на задачи пачек, чтобы их не собрал GC
+
+        self.submitted = 0
+        self.batches = 0
+        self.dispatched = 0   # реальных вызовов upstream
+        self.coalesced = 0    # одинаковых запросов, склеенных внутри пачек
+        self.cold_leaders = 0
+
+    @staticmethod
+    def fingerprint(item: Item) -> str:
+        """Одинаковые элементы пачки отправляются один раз"""
+        return hashlib.sha1(json.dumps(item, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+
+    async def submit(self, key: str, item: Item) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.submitted += 1
+        batch = self._open.setdefault(key, [])
+        batch.append((item, future))
+        if len(batch) >= self.max_batch:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            future.cancel()  # этого ответа больше никто не ждёт — _run и _call это увидят
+            raise
+
+    def _flush(self, key: str):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._open.pop(key, None)
+        if batch:
+            self.batches += 1
+            task = asyncio.create_task(self._run(key, batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, key: str, batch: List[Tuple[Item, asyncio.Future]]):
+        batch = [(item, future) for item, future in batch if not future.done()]
+        if not batch:
+            return
+        # одинаковые запросы → один вызов
+        groups: Dict[str, Tuple[Item, List[asyncio.Future]]] = {}
+        for item, future in batch:
+            ident = self.identity(item)
+            if ident in groups:
+                groups[ident][1].append(future)
+                self.coalesced += 1
+            else:
+                groups[ident] = (item, [future])
+
+        calls = list(groups.values())
+        now = self.clock()
+        cold = now - self._warm.get(key, float("-inf")) > self.warm_ttl
+        self._warm[key] = now
+        if len(self._warm) > 10000:
+            self._expire_warm(now)
+
+        if cold and self.leader_delay > 0 and len(calls) > 1:
+            self.cold_leaders += 1
+            leader = asyncio.create_task(self._call(*calls[0]))
+            await asyncio.sleep(self.leader_delay)
+            await asyncio.gather(leader, *(self._call(item, futures) for item, futures in calls[1:]))
+        else:
+            await asyncio.gather(*(self._call(item, futures) for item, futures in calls))
+
+    async def _call(self, item: Item, futures: List[asyncio.Future]):
+        self.dispatched += 1
+        call = asyncio.ensure_future(self.dispatch(item))
+
+        def abandon(_):
+            if all(future.cancelled() for future in futures):
+                call.cancel()
+
+        for future in futures:
+            future.add_done_callback(abandon)
+        try:
+            result = await call
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                e = RuntimeError("batched request cancelled")
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+                    future.exception()  # ошибка уйдёт тому, кто ждёт; без «never retrieved»
+            return
+        for future in futures:
+            if not future.done():
+                future.set_result(result)
+
+    def _expire_warm(self, now: float):
+        for key in [k for k, t in self._warm.items() if now - t > self.warm_ttl]:
+            del self._warm[key]
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "submitted": self.submitted,
+            "batches": self.batches,
+            "dispatched": self.dispatched,
+            "coalesced": self.coalesced,
+            "cold_leaders": self.cold_leaders,
+            "avg_batch": round(self.submitted / self.batches, 2) if self.batches else 0.0,
+            "open": sum(len(b) for b in self._open.values()),
+        }
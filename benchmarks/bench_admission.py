@@ -0,0 +1,98 @@
+# benchmarks/bench_admission.py
+"""
+Контроль допуска к LLM под нагрузкой: фейковый сервер отдаёт долю 429
+(с Retry-After) и случайную задержку, на вход — всплеск одновременных
+запросов. Проверяем, что в upstream одновременно не больше лимита,
+429 отрабатываются повторами, а лишнее отбивается быстрым Overloaded (503).
+
+    python benchmarks/bench_admission.py --requests 500 --concurrency 16 --queue 100
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_llm import FakeLLMConfig, create_app, serve_in_thread
+
+
+async def _run(args):
+    import storyteller
+    from admission import AdmissionController, Overloaded
+
+    storyteller.admission = AdmissionController(
+        max_concurrency=args.concurrency,
+        max_queue=args.queue,
+        queue_timeout=args.queue_timeout,
+        rate=args.rate,
+        burst=args.concurrency,
+        retries=args.retries,
+    )
+    messages = [{"role": "user", "content": "Действие игрока: осмотреться"}]
+    outcomes = {"ok": 0, "error": 0, "overloaded": 0}
+    ok_latency, rejected_latency = [], []
+
+    async def one(i):
+        started = time.perf_counter()
+        try:
+            text = await storyteller.get_deepseek_response(messages, user_id=f"u{i}")
+        except Overloaded:
+            outcomes["overloaded"] += 1
+            rejected_latency.append(time.perf_counter() - started)
+            return
+        if text.startswith(("⏳", "💥", "🔒")):
+            outcomes["error"] += 1
+        else:
+            outcomes["ok"] += 1
+            ok_latency.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(args.requests)])
+    return time.perf_counter() - started, outcomes, ok_latency, rejected_latency, storyteller.admission.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--queue", type=int, default=100)
+    parser.add_argument("--queue-timeout", type=float, default=5)
+    parser.add_argument("--rate", type=float, default=0)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--error-rate", type=float, default=0.2)
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--llm-port", type=int, default=8951)
+    args = parser.parse_args()
+
+    config = FakeLLMConfig(args.latency_ms, 0, error_rate=args.error_rate,
+                           retry_after=args.retry_after, jitter_ms=args.jitter_ms)
+    server = serve_in_thread(create_app(config), args.llm_port)
+    os.environ["DEEPSEEK_API_KEY"] = "fake"
+    os.environ["DEEPSEEK_API_URL"] = f"http://127.0.0.1:{args.llm_port}/v1/chat/completions"
+    try:
+        elapsed, outcomes, ok_latency, rejected_latency, stats = asyncio.run(_run(args))
+    finally:
+        server.should_exit = True
+
+    print(f"{args.requests} запросов за {elapsed:.2f} с: {outcomes}")
+    print(f"upstream: {config.requests} запросов, {config.errors} ошибок {config.error_status}, "
+          f"пик одновременных {config.max_active} (лимит {args.concurrency})")
+    if ok_latency:
+        ok_latency.sort()
+        print(f"успешные: p50={statistics.median(ok_latency) * 1000:.0f}ms "
+              f"p99={ok_latency[int(len(ok_latency) * 0.99) - 1] * 1000:.0f}ms")
+    if rejected_latency:
+        print(f"отказы 503: max={max(rejected_latency) * 1000:.1f}ms")
+    print(f"admission: {stats}")
+    assert config.max_active <= args.concurrency, "превышен лимит одновременных вызовов"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# benchmarks/bench_batching.py
+"""
+Микропачки повествователя (storyteller.narration_batcher) на групповых сценах:
+в каждом регионе игроки ходят почти одновременно (раунд = всплеск с джиттером),
+часть из них — одинаковым ходом из одинакового состояния. Сравниваем окна
+сбора пачки: пропускная способность, задержка, вызовы upstream и попадания
+в кэш префиксов фейкового провайдера.
+
+    python benchmarks/bench_batching.py --players 200 --regions 4 --rounds 5
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_llm import FakeLLMConfig, create_app, percentile, serve_in_thread
+
+GROUP_ACTION = "осматриваюсь"
+SOLO_ACTIONS = ["говорю с Саней о ведьме", "сажусь у окна", "спрашиваю незнакомца, кто он",
+                "иду к стойке", "прислушиваюсь к разговорам", "проверяю кошелёк"]
+
+
+async def _run(args, window_ms: float, leader_ms: float, llm: FakeLLMConfig):
+    import storyteller
+    from admission import AdmissionController
+    from batching import MicroBatcher
+    from llm_client import close_http_client, create_http_client
+
+    create_http_client()
+    storyteller.admission = AdmissionController(max_concurrency=args.concurrency, max_queue=args.players * 2,
+                                                queue_timeout=120)
+    storyteller.narration_batcher = MicroBatcher(
+        storyteller._dispatch_narration, identity=storyteller._prompt_identity,
+        window=window_ms / 1000, max_batch=args.max_batch, leader_delay=leader_ms / 1000,
+    ) if window_ms > 0 else None
+    llm._prefixes.clear()
+    llm.requests = llm.prefix_hits = llm.prefix_misses = 0
+
+    rnd = random.Random(args.seed)
+    regions = [f"Регион {i}" for i in range(args.regions)]
+    latencies = []
+
+    async def player(i):
+        region = regions[i % len(regions)]
+        # контекст региона — общий префикс; состояние у игроков в сцене одинаковое
+        context = {"role": "system", "content": f"=== КОНТЕКСТ ===\nМесто: {region}\nОписание: Туман и сырость."}
+        for _ in range(args.rounds):
+            action = GROUP_ACTION if rnd.random() < args.group_share else rnd.choice(SOLO_ACTIONS)
+            messages = [context, {"role": "user", "content": f"Действие игрока: {action}"}]
+            await asyncio.sleep(rnd.uniform(0, args.jitter_ms / 1000))
+            started = time.perf_counter()
+            await storyteller.get_deepseek_response(messages, user_id=f"u{i}")
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(args.round_ms / 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[player(i) for i in range(args.players)])
+    elapsed = time.perf_counter() - started
+    await close_http_client()
+    lookups = llm.prefix_hits + llm.prefix_misses
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50": percentile(latencies, 0.5) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "upstream": llm.requests,
+        "prefix_hit": llm.prefix_hits / lookups if lookups else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--players", type=int, default=200)
+    parser.add_argument("--regions", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--round-ms", type=float, default=200, help="пауза игрока между ходами")
+    parser.add_argument("--jitter-ms", type=float, default=30, help="разброс прихода ходов внутри раунда")
+    parser.add_argument("--group-share", type=float, default=0.5, help="доля одинаковых ходов в сцене")
+    parser.add_argument("--concurrency", type=int, default=32, help="LLM_MAX_CONCURRENCY")
+    parser.add_argument("--max-batch", type=int, default=16)
+    parser.add_argument("--windows", default="0,10,20,50", help="окна сбора пачки, мс")
+    parser.add_argument("--leader-ms", type=float, default=150, help="задержка остальных после лидера на холодном префиксе")
+    parser.add_argument("--first-token-ms", type=float, default=300)
+    parser.add_argument("--token-ms", type=float, default=5)
+    parser.add_argument("--prefix-hit-speedup", type=float, default=0.5)
+    parser.add_argument("--llm-port", type=int, default=8951)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    llm = FakeLLMConfig(args.first_token_ms, args.token_ms, prefix_hit_speedup=args.prefix_hit_speedup)
+    server = serve_in_thread(create_app(llm), args.llm_port)
+    os.environ["DEEPSEEK_API_KEY"] = "fake"
+    os.environ["DEEPSEEK_API_URL"] = f"http://127.0.0.1:{args.llm_port}/v1/chat/completions"
+
+    print(f"{'окно, мс':>9} {'лидер, мс':>10} {'ходов/с':>8} {'p50, мс':>8} {'p99, мс':>8} {'upstream':>9} {'префикс':>8}")
+    try:
+        for window in [float(w) for w in args.windows.split(",")]:
+            for leader in ([0.0, args.leader_ms] if window > 0 and args.leader_ms > 0 else [0.0]):
+                r = asyncio.run(_run(args, window, leader, llm))
+                print(f"{window:>9.0f} {leader:>10.0f} {r['rps']:>8.1f} {r['p50']:>8.0f} {r['p99']:>8.0f} "
+                      f"{r['upstream']:>9} {r['prefix_hit']:>8.0%}")
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
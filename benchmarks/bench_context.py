@@ -0,0 +1,55 @@
+# benchmarks/bench_context.py
+"""
+Микробенчмарк сборки контекста промпта (storyteller._build_context):
+с прогретым кэшем фрагментов и с очисткой кэша перед каждым вызовом.
+
+    python benchmarks/bench_context.py --iterations 100000
+"""
+import os
+import sys
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storyteller
+from storyteller import PlayerState, _build_context, _build_messages
+from world import WorldSnapshot, current_world
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=100_000)
+    args = parser.parse_args()
+
+    player = PlayerState(
+        inventory={"Бутерброд": 2, "Кофе": 1},
+        active_quests=["kill_ryzhaya_witch"],
+    )
+
+    world = current_world()
+    regions = [world.get_region(name) for name in world.region_names()]
+
+    def cold():
+        # свежий снимок (без чтения файлов) — фрагменты регионов строятся заново
+        storyteller._player_fragment.cache_clear()
+        _build_context(player, WorldSnapshot.from_regions(regions))
+
+    n = args.iterations
+    warm_us = timeit.timeit(lambda: _build_context(player), number=n) / n * 1e6
+    cold_us = timeit.timeit(cold, number=max(1, n // 10)) / max(1, n // 10) * 1e6
+    print(f"_build_context, кэш прогрет:         {warm_us:.2f} мкс")
+    print(f"_build_context, всё пересобирается: {cold_us:.2f} мкс")
+
+    # Префикс промпта должен быть побайтово одинаковым для разных игроков в регионе
+    other = PlayerState(inventory={"Кофе": 3})
+    a = _build_messages(player, "осмотреться")
+    b = _build_messages(other, "иду в таверну")
+    region_part = storyteller._cached_region_fragment(world, player.current_region)
+    assert a[0]["content"].startswith("=== КОНТЕКСТ ===\n" + region_part)
+    assert b[0]["content"].startswith("=== КОНТЕКСТ ===\n" + region_part)
+    print("префикс системного сообщения стабилен: ✅")
+
+
+if __name__ == "__main__":
+    main()
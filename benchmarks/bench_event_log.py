@@ -0,0 +1,109 @@
+# benchmarks/bench_event_log.py
+"""
+Пропускная способность журнала ходов (event_log.EventLog): игроки делают ходы
+пачками (как приходят запросы), путь запроса только зовёт record(), писатель
+кодирует дельты, пишет сегменты и делает fsync пачкой. Сравниваем интервалы
+fsync; в конце — скорость replay по получившемуся журналу.
+
+    python benchmarks/bench_event_log.py --events 200000 --users 5000
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from event_log import EventLog, read_log, replay
+from fake_llm import percentile
+from storyteller import PlayerState
+
+ACTIONS = [("куплю бутер", "Бутерброд"), ("закажу кофе", "Кофе"), ("осматриваюсь", None)]
+REPLY = "🌲 Ветер гонит туман по болоту. Саня протирает кружку и кивает тебе."
+
+
+async def run(root: str, args, fsync_ms: float) -> dict:
+    rnd = random.Random(args.seed)
+    log = EventLog(root, segment_bytes=args.segment_mb * 1024 * 1024, max_queue=args.queue,
+                   batch=args.batch, fsync_ms=fsync_ms)
+    await log.start()
+    states = {}
+    record_us = []
+
+    started = time.perf_counter()
+    for i in range(args.events):
+        user_id = f"u{rnd.randrange(args.users)}"
+        before = states.get(user_id) or PlayerState().model_dump()
+        action, item = rnd.choice(ACTIONS)
+        after = {**before, "history": (before["history"] + [[action, REPLY]])[-6:]}
+        if item:
+            after["inventory"] = {**before["inventory"], item: before["inventory"].get(item, 0) + 1}
+        states[user_id] = after
+
+        t = time.perf_counter()
+        log.record(user_id, action, [f"Игрок купил {item}."] if item else [], before, after, llm_ms=850.0)
+        record_us.append((time.perf_counter() - t) * 1e6)
+        if i % args.burst == 0:
+            await asyncio.sleep(0)  # между пачками запросов писатель получает цикл
+    produced = time.perf_counter() - started
+    await log.stop()
+    elapsed = time.perf_counter() - started
+    stats = log.stats()
+    return {
+        "produce_s": args.events / produced,
+        "write_s": stats["written"] / elapsed,
+        "record_p50": percentile(record_us, 0.5),
+        "record_p99": percentile(record_us, 0.99),
+        "dropped": stats["dropped"],
+        "fsyncs": stats["fsyncs"],
+        "segments": stats["segments"],
+        "bytes_event": stats["bytes"] / max(1, stats["written"]),
+        "states": states,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--burst", type=int, default=200, help="ходов между передачами цикла писателю")
+    parser.add_argument("--queue", type=int, default=100000, help="EVENT_LOG_QUEUE")
+    parser.add_argument("--batch", type=int, default=2048, help="EVENT_LOG_BATCH")
+    parser.add_argument("--segment-mb", type=int, default=8)
+    parser.add_argument("--fsync-ms", default="0,50,200", help="интервалы fsync через запятую (0 — на каждую пачку)")
+    parser.add_argument("--dir", help="каталог для сегментов (по умолчанию — временный)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'fsync, мс':>9} {'record/с':>10} {'запись/с':>10} {'record p50, мкс':>16} {'p99, мкс':>9} "
+          f"{'отброшено':>10} {'fsync':>6} {'сегментов':>10} {'Б/запись':>9}")
+    for fsync_ms in [float(v) for v in args.fsync_ms.split(",")]:
+        root = tempfile.mkdtemp(prefix="events-", dir=args.dir)
+        try:
+            r = asyncio.run(run(root, args, fsync_ms))
+            print(f"{fsync_ms:>9.0f} {r['produce_s']:>10.0f} {r['write_s']:>10.0f} {r['record_p50']:>16.1f} "
+                  f"{r['record_p99']:>9.1f} {r['dropped']:>10} {r['fsyncs']:>6} {r['segments']:>10} "
+                  f"{r['bytes_event']:>9.0f}")
+
+            # replay: полный проход по журналу + восстановление одного игрока
+            started = time.perf_counter()
+            count = sum(1 for _ in read_log(root))
+            scan_s = count / (time.perf_counter() - started)
+            user_id = next(iter(r["states"]))
+            started = time.perf_counter()
+            state, applied = replay(user_id, root)
+            replay_ms = (time.perf_counter() - started) * 1000
+            assert r["dropped"] or state == r["states"][user_id], "replay разошёлся с состоянием"
+            print(f"{'':>9} чтение журнала: {scan_s:.0f} записей/с; replay игрока {user_id}: "
+                  f"{replay_ms:.0f} мс ({applied} записей)")
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# benchmarks/bench_fallback.py
+"""
+Ход игрока при зависании DeepSeek: фейковый сервер отвечает нормально, потом
+на время --stall «зависает» (первый токен через --stall-ms), потом оживает.
+Игроки ходят всё это время (engine.run_step в этом же процессе). Сравниваем:
+
+  без бюджета   — как было: ход ждёт повествователя сколько угодно;
+  дедлайн       — LLM_STEP_DEADLINE_MS: не успел — заготовка из fallback.py;
+  + размыкатель — после серии сбоев DeepSeek не зовётся вовсе до пробного запроса.
+
+По фазам — p50/p99/max хода, доля заготовок и сколько запросов ушло в upstream.
+С --stream ходы идут через stream_step: время до первого куска и сколько
+опоздавших ответов дошло следом за заготовкой.
+
+    python benchmarks/bench_fallback.py --players 50 --stall 10 --stall-ms 5000 --deadline-ms 1500
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ["EVENT_LOG_DIR"] = ""  # журнал ходов здесь не нужен
+os.environ["STATE_BACKEND"] = "memory"
+os.environ["DEEPSEEK_API_KEY"] = "fake"
+
+from fake_llm import FakeLLMConfig, create_app, percentile, serve_in_thread
+
+ACTIONS = ["осматриваюсь", "куплю бутер", "поговорю с Саней", "закажу кофе", "иду в логово", "назад в город"]
+PHASES = ("норма", "зависание", "восстановление")
+
+
+async def _run(args, config: FakeLLMConfig, deadline_ms: float, breaker_failures: int) -> dict:
+    import engine
+    import storyteller
+    from admission import AdmissionController, CircuitBreaker
+    from engine import StepResult, run_step, running_engine, stream_step
+    from memory import Summarizer
+    from state_manager import player_session
+
+    # семафоры допуска и очередь свёртки привязаны к циклу событий — на каждый прогон свои
+    storyteller.admission = engine.admission = AdmissionController()
+    engine.summarizer = Summarizer(storyteller.summarize_history, player_session)
+    engine.LLM_STEP_DEADLINE_MS = deadline_ms
+    engine.breaker = CircuitBreaker(breaker_failures, args.cooldown)
+    stats = {phase: {"latency": [], "first": [], "fallback": 0, "late": 0, "errors": 0, "requests": 0}
+             for phase in PHASES}
+    phase = {"name": PHASES[0]}
+
+    async def player(i: int, stop: float):
+        rnd = random.Random(i)
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            first = None
+            if args.stream:
+                result = StepResult()
+                async for _ in stream_step(f"p{i}", rnd.choice(ACTIONS), result):
+                    if first is None:
+                        first = time.perf_counter() - started
+            else:
+                result = await run_step(f"p{i}", rnd.choice(ACTIONS))
+            # ход относится к фазе, в которой закончился
+            current = stats[phase["name"]]
+            current["latency"].append(time.perf_counter() - started)
+            current["first"].append(first or 0.0)
+            current["fallback"] += bool(result.fallback)
+            current["late"] += result.late
+            current["errors"] += result.status == "llm_error"
+            await asyncio.sleep(rnd.uniform(0, args.think_ms / 1000))
+
+    async with running_engine():
+        started = time.perf_counter()
+        stop = started + args.warm + args.stall + args.recover
+        players = [asyncio.create_task(player(i, stop)) for i in range(args.players)]
+        for name, seconds, first_token_ms in ((PHASES[0], args.warm, args.first_token_ms),
+                                              (PHASES[1], args.stall, args.stall_ms),
+                                              (PHASES[2], args.recover, args.first_token_ms)):
+            phase["name"] = name
+            config.first_token_ms = first_token_ms
+            before = config.requests
+            await asyncio.sleep(seconds)
+            stats[name]["requests"] = config.requests - before
+        await asyncio.gather(*players)
+    config.first_token_ms = args.first_token_ms
+    stats["breaker"] = engine.breaker.stats()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--think-ms", type=float, default=300, help="пауза игрока между ходами (до)")
+    parser.add_argument("--warm", type=float, default=5, help="секунд нормальной работы")
+    parser.add_argument("--stall", type=float, default=10, help="секунд зависания upstream")
+    parser.add_argument("--recover", type=float, default=6, help="секунд после зависания")
+    parser.add_argument("--first-token-ms", type=float, default=300)
+    parser.add_argument("--token-ms", type=float, default=10)
+    parser.add_argument("--stall-ms", type=float, default=5000, help="первый токен во время зависания")
+    parser.add_argument("--deadline-ms", type=float, default=1500, help="LLM_STEP_DEADLINE_MS")
+    parser.add_argument("--breaker-failures", type=int, default=5, help="LLM_BREAKER_FAILURES")
+    parser.add_argument("--cooldown", type=float, default=2, help="LLM_BREAKER_COOLDOWN, секунд")
+    parser.add_argument("--stream", action="store_true", help="ходы через stream_step")
+    parser.add_argument("--llm-port", type=int, default=8903)
+    args = parser.parse_args()
+
+    os.environ["DEEPSEEK_API_URL"] = f"http://127.0.0.1:{args.llm_port}/v1/chat/completions"
+    logging.disable(logging.WARNING)
+    config = FakeLLMConfig(args.first_token_ms, args.token_ms)
+    llm = serve_in_thread(create_app(config), args.llm_port)
+
+    modes = (("без бюджета", 0, 0), ("дедлайн", args.deadline_ms, 0),
+             ("+ размыкатель", args.deadline_ms, args.breaker_failures))
+    head = "до 1-го куска" if args.stream else "ход"
+    print(f"{'режим':<14} {'фаза':<15} {'ходов':>6} {head + ' p50, мс':>20} {'p99, мс':>8} {'max, мс':>8} "
+          f"{'заготовок':>10} {'опоздавших':>11} {'ошибок':>7} {'в upstream':>11}")
+    try:
+        for name, deadline_ms, failures in modes:
+            stats = asyncio.run(_run(args, config, deadline_ms, failures))
+            for phase in PHASES:
+                s = stats[phase]
+                values = s["first"] if args.stream else s["latency"]
+                share = s["fallback"] / max(1, len(s["latency"]))
+                print(f"{name:<14} {phase:<15} {len(s['latency']):>6} {percentile(values, 0.5, 0.0) * 1000:>20.0f} "
+                      f"{percentile(values, 0.99, 0.0) * 1000:>8.0f} {max(values, default=0) * 1000:>8.0f} "
+                      f"{share:>10.0%} {s['late']:>11} {s['errors']:>7} {s['requests']:>11}")
+            if failures:
+                b = stats["breaker"]
+                print(f"{'':<14} размыкатель: размыкался {b['opened']} раз, "
+                      f"ходов мимо upstream {b['short_circuited']}, сейчас {b['state']}")
+    finally:
+        llm.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
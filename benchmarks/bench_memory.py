@@ -0,0 +1,80 @@
+# benchmarks/bench_memory.py
+"""
+Размер промпта и время его сборки на длинной сессии: игрок делает N ходов,
+память (memory.remember_turn + Summarizer) сворачивает старые ходы в летопись.
+Для сравнения — «наивная» история, где в промпт идут все ходы целиком.
+
+    python benchmarks/bench_memory.py --turns 1000
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+from contextlib import asynccontextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from memory import Summarizer, count_prompt_tokens, remember_turn, trim_to_tokens, MEMORY_SUMMARY_TOKENS
+from storyteller import PlayerState, SYSTEM_PROMPT, _build_messages
+from fake_llm import percentile
+
+ACTIONS = ["осматриваюсь", "куплю бутер", "говорю с Саней о ведьме", "иду в логово к ведьме",
+           "бью ведьму факелом", "возвращаюсь в город и заказываю кофе"]
+REPLY = ("🌲 Ветер гонит туман по болоту. Саня протирает кружку и кивает тебе. "
+         "Где-то за сваями квакает жаба размером с телёнка. Таверна гудит, пахнет колбасой и дымом.")
+
+
+async def run(turns: int, seed: int = 1):
+    rnd = random.Random(seed)
+    state = PlayerState()
+    naive = []
+
+    @asynccontextmanager
+    async def session(user_id):
+        yield state
+
+    async def summarize(summary, folded):
+        # «LLM» возвращает летопись ограниченной длины — как и настоящий SUMMARY_PROMPT
+        return trim_to_tokens(f"{summary} Ещё {len(folded)} ходов: {folded[-1][0]}.", MEMORY_SUMMARY_TOKENS)
+
+    summarizer = Summarizer(summarize, session)
+    sizes, build_us, naive_sizes = [], [], []
+    for turn in range(turns):
+        action = rnd.choice(ACTIONS)
+        started = time.perf_counter()
+        messages = _build_messages(state, action)
+        build_us.append((time.perf_counter() - started) * 1e6)
+        system = [{"role": "system", "content": SYSTEM_PROMPT}]
+        sizes.append(count_prompt_tokens(system + messages))
+
+        naive.append({"role": "user", "content": f"Действие игрока: {action}"})
+        naive_sizes.append(count_prompt_tokens(system + messages[:1] + naive))
+        naive.append({"role": "assistant", "content": REPLY})
+
+        remember_turn(state, action, REPLY)
+        if summarizer.needs_fold(state):
+            await summarizer.fold("bench")  # в приложении — фоновая задача
+    return sizes, build_us, naive_sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=1000)
+    args = parser.parse_args()
+
+    sizes, build_us, naive_sizes = asyncio.run(run(args.turns))
+    windows = [(0, 10), (10, 100), (100, args.turns // 2), (args.turns // 2, args.turns)]
+    print(f"{'ходы':>12} {'токены p50':>11} {'p99':>6} {'сборка p50, мкс':>16} {'p99':>7} {'наивно p99':>11}")
+    for lo, hi in windows:
+        if lo >= hi:
+            continue
+        print(f"{f'{lo + 1}–{hi}':>12} {percentile(sizes[lo:hi], 0.5):>11} {percentile(sizes[lo:hi], 0.99):>6} "
+              f"{percentile(build_us[lo:hi], 0.5):>16.1f} {percentile(build_us[lo:hi], 0.99):>7.1f} "
+              f"{percentile(naive_sizes[lo:hi], 0.99):>11}")
+
+
+if __name__ == "__main__":
+    main()
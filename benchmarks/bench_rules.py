@@ -0,0 +1,85 @@
+# benchmarks/bench_rules.py
+"""
+Стоимость разбора действия движком правил (rules.ActionEngine) при росте
+региона: от реального мира до 10k синтетических предметов/переходов/квестов.
+
+    python benchmarks/bench_rules.py --rules 10000
+"""
+import os
+import sys
+import random
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from world import Item, Quest, RegionData, WorldSnapshot, current_world
+from rules import RegionRules, get_engine
+from storyteller import PlayerState
+
+ACTIONS = [
+    "куплю бутер и кофе",
+    "осматриваюсь по сторонам, ищу кого-нибудь живого",
+    "поеду в логово к ведьме",
+    "подхожу к стойке и заказываю у Сани большой бутерброд с колбасой, а потом иду назад в город",
+]
+
+SYNTHETIC_START = "Регион 0"
+
+_ALPHABET = "абвгдежзиклмнопрстуфхцчшщэюя"
+
+
+def _word(rnd: random.Random) -> str:
+    return "".join(rnd.choice(_ALPHABET) for _ in range(rnd.randint(5, 9)))
+
+
+def synthetic_world(n_rules: int, seed: int = 1) -> WorldSnapshot:
+    """
+    Мир из реальных регионов + n_rules правил вокруг «Региона 0»: треть — предметы
+    его лавки, треть — переходы в соседние регионы, треть — квесты соседей
+    """
+    rnd = random.Random(seed)
+    current = current_world()
+    regions = {name: current.get_region(name) for name in current.region_names()}
+    shop, quests, travel = [], [], []
+    for i in range(n_rules):
+        kind = i % 3
+        if kind == 0:
+            shop.append(Item(_word(rnd), (_word(rnd),), 1, "Игрок что-то купил."))
+        elif kind == 1:
+            travel.append((_word(rnd), _word(rnd)))
+        else:
+            quests.append(Quest(f"q{i}", "Квест", "", {"items": {_word(rnd): 1}}, {}, ""))
+    neighbours = [f"Регион {i + 1}" for i in range(max(1, len(travel) // 30))]
+    for i, name in enumerate(neighbours):
+        regions[name] = RegionData(name=name, description="", exits=(SYNTHETIC_START,),
+                                   quests=tuple(quests[i::len(neighbours)]),
+                                   travel_keywords=tuple(travel[i * 30:(i + 1) * 30]))
+    regions[SYNTHETIC_START] = RegionData(name=SYNTHETIC_START, description="",
+                                          exits=tuple(neighbours), shop=tuple(shop))
+    return WorldSnapshot.from_regions(list(regions.values()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rules", type=int, default=10_000)
+    parser.add_argument("--iterations", type=int, default=20_000)
+    args = parser.parse_args()
+
+    print(f"{'правил':>8} {'сборка, мс':>11} {'разбор, мкс':>12}")
+    for n in sorted({0, 100, 1000, args.rules}):
+        world = synthetic_world(n) if n else current_world()
+        start = SYNTHETIC_START if n else PlayerState().current_region
+        build_ms = timeit.timeit(lambda: RegionRules(world, start), number=1) * 1000
+        engine = get_engine(world)
+
+        def step():
+            for action in ACTIONS:
+                engine.apply(PlayerState(current_region=start), action)
+
+        per_action_us = timeit.timeit(step, number=args.iterations // len(ACTIONS)) / args.iterations * 1e6
+        print(f"{n:>8} {build_ms:>11.1f} {per_action_us:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
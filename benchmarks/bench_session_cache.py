@@ -0,0 +1,74 @@
+# benchmarks/bench_session_cache.py
+"""
+Память кэша сессий в установившемся режиме: N синтетических игроков
+по кругу проходят через SessionCache с лимитом записей/байт.
+
+    python benchmarks/bench_session_cache.py --users 1000000 --max-entries 10000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storyteller import PlayerState
+from session_cache import SessionCache
+import state_codec
+from state_manager import approx_state_size
+
+ITEMS = ["Бутерброд", "Кофе", "Факел", "Верёвка", "Зелье"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--max-entries", type=int, default=10_000)
+    parser.add_argument("--max-bytes", type=int, default=0)
+    parser.add_argument("--ttl", type=float, default=0)
+    parser.add_argument("--checkpoints", type=int, default=10)
+    args = parser.parse_args()
+
+    written = 0
+
+    def on_evict(user_id, state, reason):
+        # «запись в хранилище»: сериализуем и выбрасываем
+        nonlocal written
+        state_codec.encode(state)
+        written += 1
+
+    cache = SessionCache(
+        max_entries=args.max_entries,
+        max_bytes=args.max_bytes,
+        ttl=args.ttl,
+        sizeof=approx_state_size,
+        on_evict=on_evict,
+    )
+    rnd = random.Random(42)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    step = max(1, args.users // args.checkpoints)
+    print(f"{'игроков':>10} {'записей':>8} {'MiB':>8} {'пик MiB':>8} {'вытеснено':>10}")
+    for i in range(args.users):
+        user_id = f"user{i}"
+        state = cache.get(user_id)
+        if state is None:
+            state = PlayerState()
+        item = rnd.choice(ITEMS)
+        state.inventory[item] = state.inventory.get(item, 0) + 1
+        cache.set(user_id, state)
+
+        if (i + 1) % step == 0:
+            current, peak = tracemalloc.get_traced_memory()
+            print(f"{i + 1:>10} {len(cache):>8} {current / 2**20:>8.1f} {peak / 2**20:>8.1f} {written:>10}")
+    elapsed = time.perf_counter() - started
+    tracemalloc.stop()
+
+    print(f"\n{args.users / elapsed:,.0f} операций/с; {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# benchmarks/bench_state_codec.py
+"""
+Сериализация PlayerState: pydantic JSON (как было) против state_codec
+(бинарный снимок с id из таблицы символов мира + дельты).
+
+Профили состояния:
+  новый       — только что пришёл, пустая память;
+  в игре      — инвентарь, квесты, убитые враги, 6 ходов в памяти + летопись;
+  торговец    — 40 предметов в инвентаре, короткая память.
+Для каждого — кодирование/декодирование снимка и запись одного хода
+(что state_manager делает на каждом сохранении): «+1 к счётчику в инвентаре»
+и «новый ход в памяти». Для JSON запись хода = снова всё состояние целиком.
+
+    python benchmarks/bench_state_codec.py --n 20000
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import state_codec
+from state_manager import STATE_DELTA_MAX
+from storyteller import PlayerState
+from world import current_world
+
+REPLY = ("🌲 Ветер гонит туман по болоту. Саня протирает кружку и кивает тебе. "
+         "Где-то за сваями квакает жаба размером с телёнка. Таверна гудит, пахнет колбасой и дымом.")
+
+
+def profiles():
+    world = current_world()
+    items = [s for s in world.symbols if s not in world.region_names()][:3] or ["Бутерброд", "Кофе"]
+    yield "новый", PlayerState()
+    yield "в игре", PlayerState(
+        inventory={name: i + 2 for i, name in enumerate(items)},
+        killed_enemies=["Рыжая ведьма"] * 3,
+        active_quests=["kill_ryzhaya_witch"],
+        history=[[f"действие {i}", REPLY] for i in range(6)],
+        summary="Странник прибыл в Ебеньград, купил бутер и узнал от Сани о Рыжей ведьме. " * 3,
+    )
+    yield "торговец", PlayerState(
+        inventory={**{name: 5 for name in items}, **{f"Трофей {i}": i for i in range(40 - len(items))}},
+        history=[["торгуюсь", REPLY]],
+    )
+
+
+def timed(fn, n: int) -> float:
+    """Микросекунды на вызов"""
+    started = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - started) / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n", type=int, default=20000, help="повторов на замер")
+    args = parser.parse_args()
+    n = args.n
+
+    print(f"{'профиль':<10} {'формат':<8} {'снимок, Б':>10} {'encode, мкс':>12} {'decode, мкс':>12} "
+          f"{'ход +1, Б':>10} {'ход +1, мкс':>12} {'ход память, Б':>14} {'ход память, мкс':>16}")
+    for name, state in profiles():
+        dump = state.model_dump()
+        item = next(iter(dump["inventory"]), "Бутерброд")
+        bumped = {**dump, "inventory": {**dump["inventory"], item: dump["inventory"].get(item, 0) + 1}}
+        turned = {**dump, "history": (dump["history"] + [["осматриваюсь", REPLY]])[-6:]}
+        bumped_state, turned_state = PlayerState(**bumped), PlayerState(**turned)
+
+        raw_json = state.model_dump_json()
+        raw_bin = state_codec.encode(dump)
+        assert state_codec.decode(raw_bin).model_dump() == dump
+
+        # JSON: сохранение хода — весь model_dump_json(); бинарный — только дельта к сохранённому
+        json_row = (len(raw_json.encode()),
+                    timed(state.model_dump_json, n),
+                    timed(lambda: PlayerState.model_validate_json(raw_json), n),
+                    len(bumped_state.model_dump_json().encode()),
+                    timed(bumped_state.model_dump_json, n),
+                    len(turned_state.model_dump_json().encode()),
+                    timed(turned_state.model_dump_json, n))
+        delta_bump = state_codec.encode_delta(dump, bumped)
+        delta_turn = state_codec.encode_delta(dump, turned)
+        bin_row = (len(raw_bin),
+                   timed(lambda: state_codec.encode(dump), n),
+                   timed(lambda: state_codec.decode(raw_bin), n),
+                   len(delta_bump),
+                   timed(lambda: state_codec.encode_delta(dump, bumped), n),
+                   len(delta_turn),
+                   timed(lambda: state_codec.encode_delta(dump, turned), n))
+        for fmt, row in (("json", json_row), ("codec", bin_row)):
+            print(f"{name:<10} {fmt:<8} {row[0]:>10} {row[1]:>12.2f} {row[2]:>12.2f} "
+                  f"{row[3]:>10} {row[4]:>12.2f} {row[5]:>14} {row[6]:>16.2f}")
+
+        # чтение после цепочки дельт — то, что платит игрок, пришедший после простоя
+        chain = [raw_bin] + [state_codec.encode_delta(dump, bumped)] * STATE_DELTA_MAX
+        print(f"{'':<10} {'codec':<8} чтение снимок + {STATE_DELTA_MAX} дельт (STATE_DELTA_MAX): "
+              f"{timed(lambda: state_codec.decode(chain), max(1, n // 4)):.2f} мкс")
+
+
+if __name__ == "__main__":
+    main()
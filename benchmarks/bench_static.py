@@ -0,0 +1,146 @@
+# benchmarks/bench_static.py
+"""
+Отдача фронтенда Mini App: как было (index.html читается с диска на каждый
+заход, /static — StaticFiles без сжатия и Cache-Control) и как стало
+(assets.static_assets: всё в памяти, gzip/brotli, адреса с хэшем, immutable, 304).
+
+Два сценария загрузки страницы:
+  первый заход  — кэш браузера пуст: index.html + все ассеты из него;
+  повторный     — браузер шлёт If-None-Match по тому, что у него есть,
+                  а immutable-ассеты с прошлого раза не запрашивает вовсе.
+
+    python benchmarks/bench_static.py --loads 2000
+"""
+import os
+import re
+import sys
+import time
+import asyncio
+import logging
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse
+from fastapi.staticfiles import StaticFiles
+
+ACCEPT_ENCODING = "gzip, deflate, br"
+_REF = re.compile(r'(?:src|href)="(/?static/[^"]+)"')
+
+
+def legacy_app() -> FastAPI:
+    """Отдача до оптимизации — как было в main.py"""
+    app = FastAPI()
+    app.mount("/static", StaticFiles(directory="static"), name="static")
+
+    @app.get("/", response_class=HTMLResponse)
+    async def home():
+        with open("static/index.html", "r", encoding="utf-8") as f:
+            return f.read()
+
+    return app
+
+
+def optimized_app() -> FastAPI:
+    """Те же маршруты, что в main.py, без остального приложения"""
+    from assets import AssetStore
+
+    store = AssetStore()
+    app = FastAPI()
+
+    @app.get("/")
+    async def home(request: Request):
+        return store.serve_index(request)
+
+    @app.get("/static/{path:path}")
+    async def static_file(path: str, request: Request):
+        return store.serve(path, request)
+
+    return app
+
+
+class Browser:
+    """Кэш браузера: ETag и Cache-Control каждого адреса"""
+
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.cache = {}  # url → (etag, immutable)
+        self.assets = []
+        self.requests = 0
+        self.bytes = 0
+
+    async def get(self, url: str):
+        headers = {"Accept-Encoding": ACCEPT_ENCODING}
+        cached = self.cache.get(url)
+        if cached and cached[0]:
+            headers["If-None-Match"] = cached[0]
+        # raw-ответ: считаем байты до распаковки, как их видит сеть
+        request = self.client.build_request("GET", url, headers=headers)
+        response = await self.client.send(request, stream=True)
+        raw = b"".join([chunk async for chunk in response.aiter_raw()])
+        await response.aclose()
+        self.requests += 1
+        self.bytes += len(raw) + sum(len(k) + len(v) + 4 for k, v in response.headers.raw)
+        if response.status_code == 200:
+            self.cache[url] = (response.headers.get("etag"),
+                               "immutable" in response.headers.get("cache-control", ""))
+        return response, raw
+
+    async def load_page(self):
+        response, raw = await self.get("/")
+        if response.status_code == 200:
+            html = httpx.Response(200, headers=response.headers, content=raw).text
+            self.assets = ["/" + url.lstrip("/") for url in _REF.findall(html)]
+        for url in self.assets:
+            cached = self.cache.get(url)
+            if cached and cached[1]:
+                continue  # immutable — из кэша без запроса
+            await self.get(url)
+
+
+async def _run(app: FastAPI, loads: int, repeat: bool) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        warm = Browser(client)
+        await warm.load_page()  # заполнить кэш браузера для повторных заходов
+
+        requests = bytes_ = 0
+        started = time.perf_counter()
+        for _ in range(loads):
+            browser = Browser(client)
+            if repeat:
+                browser.cache, browser.assets = dict(warm.cache), list(warm.assets)
+            await browser.load_page()
+            requests += browser.requests
+            bytes_ += browser.bytes
+        elapsed = time.perf_counter() - started
+    return {
+        "pages_s": loads / elapsed,
+        "req_s": requests / elapsed,
+        "req_page": requests / loads,
+        "kb_page": bytes_ / loads / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--loads", type=int, default=2000, help="загрузок страницы на сценарий")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    print(f"{'вариант':<10} {'сценарий':<16} {'страниц/с':>10} {'запросов/с':>11} {'запросов':>9} {'КБ/страница':>12}")
+    for name, factory in (("было", legacy_app), ("стало", optimized_app)):
+        app = factory()
+        for scenario, repeat in (("первый заход", False), ("повторный", True)):
+            r = asyncio.run(_run(app, args.loads, repeat))
+            print(f"{name:<10} {scenario:<16} {r['pages_s']:>10.0f} {r['req_s']:>11.0f} "
+                  f"{r['req_page']:>9.1f} {r['kb_page']:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
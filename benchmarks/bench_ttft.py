@@ -0,0 +1,82 @@
+# benchmarks/bench_ttft.py
+"""
+Время до первого токена (TTFT): /api/step против /api/step/stream
+на локальном фейковом LLM-сервере.
+
+    python benchmarks/bench_ttft.py --requests 20
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+from fake_llm import FakeLLMConfig, create_app, serve_in_thread
+from utils import sign_init_data
+
+BOT_TOKEN = "123456:bench-token"
+INIT_DATA = sign_init_data({"id": 1, "first_name": "Bench"}, BOT_TOKEN)
+
+
+async def _measure(base_url: str, n: int):
+    plain, first_token, stream_total = [], [], []
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        for _ in range(n):
+            started = time.perf_counter()
+            r = await client.post("/api/step", json={"initData": INIT_DATA, "action": "осмотреться"})
+            r.raise_for_status()
+            plain.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            got_first = False
+            async with client.stream("POST", "/api/step/stream", json={"initData": INIT_DATA, "action": "осмотреться"}) as r:
+                async for line in r.aiter_lines():
+                    if not got_first and line.startswith("event: token"):
+                        first_token.append(time.perf_counter() - started)
+                        got_first = True
+            stream_total.append(time.perf_counter() - started)
+    return plain, first_token, stream_total
+
+
+def _ms(values):
+    return f"p50={statistics.median(values) * 1000:.0f}ms max={max(values) * 1000:.0f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--first-token-ms", type=float, default=300)
+    parser.add_argument("--token-ms", type=float, default=20)
+    parser.add_argument("--llm-port", type=int, default=8901)
+    parser.add_argument("--app-port", type=int, default=8902)
+    args = parser.parse_args()
+
+    llm = serve_in_thread(create_app(FakeLLMConfig(args.first_token_ms, args.token_ms)), args.llm_port)
+
+    os.environ["TELEGRAM_BOT_TOKEN"] = BOT_TOKEN
+    os.environ["BOT_MODE"] = "off"  # токен фейковый — вебхук в Telegram не регистрируем
+    os.environ["DEEPSEEK_API_KEY"] = "fake"
+    os.environ["DEEPSEEK_API_URL"] = f"http://127.0.0.1:{args.llm_port}/v1/chat/completions"
+    os.chdir(ROOT)
+    import main as app_main
+    app = serve_in_thread(app_main.app, args.app_port)
+
+    try:
+        plain, first_token, stream_total = asyncio.run(_measure(f"http://127.0.0.1:{args.app_port}", args.requests))
+    finally:
+        app.should_exit = True
+        llm.should_exit = True
+
+    print(f"/api/step          полный ответ: {_ms(plain)}")
+    print(f"/api/step/stream   первый токен: {_ms(first_token)}")
+    print(f"/api/step/stream   полный ответ: {_ms(stream_total)}")
+
+
+if __name__ == "__main__":
+    main()
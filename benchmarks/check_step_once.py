@@ -0,0 +1,99 @@
+# benchmarks/check_step_once.py
+"""
+Регрессионная проверка: один ход = один вызов повествователя и одно применение
+действия. Приложение целиком (main.app) в этом же процессе, DeepSeek — фейковый
+сервер, который считает запросы. Для /api/step и /api/step/stream проверяем:
+в upstream ушёл ровно один запрос, покупка добавила ровно один предмет,
+свободный текст инвентарь не тронул. Код выхода 1 — проверка не прошла.
+
+    python benchmarks/check_step_once.py
+"""
+import os
+import sys
+import json
+import asyncio
+import logging
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+BOT_TOKEN = "123456:check-token"
+os.environ["TELEGRAM_BOT_TOKEN"] = BOT_TOKEN
+os.environ["BOT_MODE"] = "off"
+os.environ["DEEPSEEK_API_KEY"] = "fake"
+os.environ["STATE_BACKEND"] = "memory"
+os.environ["EVENT_LOG_DIR"] = ""
+os.environ["RESPONSE_CACHE_ENABLED"] = "0"  # попадание в кэш тоже «один вызов», но проверяем не его
+
+import httpx
+from fake_llm import FakeLLMConfig, create_app, serve_in_thread
+from utils import sign_init_data
+
+# действие → какой предмет должен прибавиться на 1 (None — инвентарь не меняется)
+CASES = [("куплю бутер", "Бутерброд"), ("закажу кофе", "Кофе"), ("осматриваюсь", None)]
+
+
+async def _step(client: httpx.AsyncClient, endpoint: str, init_data: str, action: str) -> dict:
+    body = {"initData": init_data, "action": action}
+    if endpoint == "step":
+        r = await client.post("/api/step", json=body)
+        r.raise_for_status()
+        return r.json()["debug"]
+    r = await client.post("/api/step/stream", json=body)
+    r.raise_for_status()
+    done = [line for line in r.text.splitlines() if line.startswith("data:")][-1]
+    return json.loads(done[5:])["debug"]
+
+
+async def _check(config: FakeLLMConfig) -> list:
+    import main as app_main
+
+    failures = []
+    transport = httpx.ASGITransport(app=app_main.app)
+    async with app_main.app.router.lifespan_context(app_main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://check", timeout=60) as client:
+            for n, endpoint in enumerate(("step", "stream")):
+                # свой игрок на эндпоинт: ходов меньше, чем до свёртки памяти — других вызовов LLM нет
+                init_data = sign_init_data({"id": 100 + n, "first_name": "Check"}, BOT_TOKEN)
+                inventory = {}
+                for action, item in CASES:
+                    before = config.requests
+                    debug = await _step(client, endpoint, init_data, action)
+                    calls = config.requests - before
+                    expected = dict(inventory)
+                    if item:
+                        expected[item] = expected.get(item, 0) + 1
+                    ok = calls == 1 and debug["inventory"] == expected
+                    print(f"{endpoint:<7} {action:<14} вызовов LLM: {calls}  инвентарь: {debug['inventory']}  "
+                          f"{'ok' if ok else 'ОШИБКА'}")
+                    if not ok:
+                        failures.append(f"{endpoint} «{action}»: вызовов {calls}, инвентарь {debug['inventory']}, "
+                                        f"ожидали 1 и {expected}")
+                    inventory = debug["inventory"]
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--llm-port", type=int, default=8906)
+    args = parser.parse_args()
+
+    os.environ["DEEPSEEK_API_URL"] = f"http://127.0.0.1:{args.llm_port}/v1/chat/completions"
+    os.chdir(ROOT)
+    logging.disable(logging.WARNING)
+    config = FakeLLMConfig(first_token_ms=5, token_ms=0)
+    llm = serve_in_thread(create_app(config), args.llm_port)
+    try:
+        failures = asyncio.run(_check(config))
+    finally:
+        llm.should_exit = True
+    if failures:
+        print("\n".join(failures))
+        sys.exit(1)
+    print("ok: один ход — один вызов повествователя и одно применение действия")
+
+
+if __name__ == "__main__":
+    main()
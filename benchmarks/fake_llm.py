@@ -0,0 +1,163 @@
+# benchmarks/fake_llm.py
+"""
+Локальный фейковый OpenAI-совместимый сервер chat/completions для замеров.
+
+    python benchmarks/fake_llm.py --port 8900 --first-token-ms 300 --token-ms 20
+
+и в .env приложения: DEEPSEEK_API_URL=http://127.0.0.1:8900/v1/chat/completions
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+REPLY = (
+    "🌲 Ветер гонит туман по болоту. Саня протирает кружку и кивает тебе. "
+    "Где-то за сваями квакает жаба размером с телёнка. "
+    "Таверна гудит, пахнет колбасой и дымом. "
+    "Ты чувствуешь, что этот вечер запомнится надолго. "
+    "Из тёмного угла на тебя смотрит незнакомец в капюшоне. "
+    "Он медленно поднимает кружку в знак приветствия."
+)
+
+
+class FakeLLMConfig:
+    def __init__(self, first_token_ms: float = 300, token_ms: float = 20, reply: str = REPLY,
+                 error_rate: float = 0.0, error_status: int = 429, retry_after: float = None,
+                 jitter_ms: float = 0.0, prefix_hit_speedup: float = 0.0):
+        self.first_token_ms = first_token_ms  # задержка до первого токена
+        self.token_ms = token_ms              # задержка между токенами
+        self.reply = reply
+        self.error_rate = error_rate          # доля ответов с ошибкой (429 и т.п.)
+        self.error_status = error_status
+        self.retry_after = retry_after        # заголовок Retry-After в ошибках, секунд
+        self.jitter_ms = jitter_ms            # случайная добавка к задержке
+        # Кэш префиксов как у провайдера: префикс (system-сообщения) считается один раз,
+        # после первого токена запроса; попадание сокращает время до первого токена на эту долю
+        self.prefix_hit_speedup = prefix_hit_speedup
+        self.prefix_hits = 0
+        self.prefix_misses = 0
+        self._prefixes = set()
+        self.requests = 0
+        self.errors = 0
+        self.active = 0
+        self.max_active = 0                   # пик одновременных запросов
+
+
+def _tokens(text: str):
+    """Грубая нарезка на «токены»: слово + пробел"""
+    words = text.split(" ")
+    return [w + (" " if i < len(words) - 1 else "") for i, w in enumerate(words)]
+
+
+def create_app(config: FakeLLMConfig) -> FastAPI:
+    app = FastAPI()
+    app.state.config = config
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        config.requests += 1
+        tokens = _tokens(config.reply)
+        # ~3 символа на токен, как оценивает memory.estimate_tokens
+        prompt_tokens = sum(len(m.get("content", "")) for m in body.get("messages", [])) // 3
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                 "total_tokens": prompt_tokens + len(tokens)}
+
+        if config.error_rate and random.random() < config.error_rate:
+            config.errors += 1
+            headers = {"Retry-After": str(config.retry_after)} if config.retry_after is not None else {}
+            return JSONResponse({"error": {"message": "fake error"}}, status_code=config.error_status,
+                                headers=headers)
+
+        first_token_ms = config.first_token_ms + random.uniform(0, config.jitter_ms)
+        prefix = "\x1f".join(m.get("content", "") for m in body.get("messages", []) if m.get("role") == "system")
+        if prefix in config._prefixes:
+            config.prefix_hits += 1
+            first_token_ms *= 1 - config.prefix_hit_speedup
+            usage["prompt_cache_hit_tokens"] = len(prefix) // 3
+        else:
+            config.prefix_misses += 1
+            asyncio.get_running_loop().call_later(first_token_ms / 1000, config._prefixes.add, prefix)
+
+        if not body.get("stream"):
+            config.active += 1
+            config.max_active = max(config.max_active, config.active)
+            try:
+                await asyncio.sleep((first_token_ms + config.token_ms * len(tokens)) / 1000)
+            finally:
+                config.active -= 1
+            return JSONResponse({
+                "id": f"fake-{config.requests}",
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": config.reply},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        async def stream():
+            config.active += 1
+            config.max_active = max(config.max_active, config.active)
+            try:
+                await asyncio.sleep(first_token_ms / 1000)
+                for i, token in enumerate(tokens):
+                    if i:
+                        await asyncio.sleep(config.token_ms / 1000)
+                    chunk = {"choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    yield f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n"
+                yield "data: [DONE]\n\n"
+            finally:
+                config.active -= 1
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def percentile(values, q, default=None):
+    """Квантиль q (0..1) по ближайшему рангу — общий для бенчмарков; пустой список — default"""
+    if not values:
+        return default
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def serve_in_thread(app, port: int):
+    """Запускает ASGI-приложение через uvicorn в фоновом потоке; возвращает сервер (server.should_exit = True — стоп)"""
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--first-token-ms", type=float, default=300)
+    parser.add_argument("--token-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--retry-after", type=float, default=None)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--prefix-hit-speedup", type=float, default=0.0)
+    args = parser.parse_args()
+
+    import uvicorn
+    config = FakeLLMConfig(args.first_token_ms, args.token_ms, error_rate=args.error_rate,
+                           error_status=args.error_status, retry_after=args.retry_after,
+                           jitter_ms=args.jitter_ms, prefix_hit_speedup=args.prefix_hit_speedup)
+    uvicorn.run(create_app(config), host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
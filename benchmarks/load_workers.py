@@ -0,0 +1,160 @@
+# benchmarks/load_workers.py
+"""
+Нагрузочная проверка многопроцессного режима: uvicorn --workers N с общим
+SQLite-хранилищем, M синтетических игроков параллельно, у каждого K покупок.
+Покупки одного игрока идут по --concurrent одновременно (разные воркеры
+берут его ходы параллельно), плюс «горячий» игрок с --hot-steps одновременных
+покупок. В конце у каждого игрока должно быть ровно столько бутербродов,
+сколько покупок, — ходы одного игрока не затирают друг друга между воркерами.
+После остановки воркеров состояние каждого игрока восстанавливается из общего
+журнала ходов (event_log.replay) и сверяется с последним ответом.
+
+    python benchmarks/load_workers.py --workers 4 --users 200 --steps 5 --concurrent 5 --hot-steps 80
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+from event_log import replay
+from fake_llm import FakeLLMConfig, create_app, serve_in_thread
+from utils import sign_init_data
+
+BOT_TOKEN = "123456:load-test-token"
+
+
+async def _player(client: httpx.AsyncClient, user_id: int, steps: int, concurrent: int, latencies: list):
+    init_data = sign_init_data({"id": user_id, "first_name": f"Bot{user_id}"}, BOT_TOKEN)
+    slots = asyncio.Semaphore(concurrent)
+
+    async def buy():
+        async with slots:
+            started = time.perf_counter()
+            r = await client.post("/api/step", json={"initData": init_data, "action": "куплю бутер"})
+            latencies.append(time.perf_counter() - started)
+            r.raise_for_status()
+
+    await asyncio.gather(*[buy() for _ in range(steps)])
+    # итог — отдельным ходом после всех покупок: он ничего не покупает
+    r = await client.post("/api/step", json={"initData": init_data, "action": "осматриваюсь"})
+    r.raise_for_status()
+    return user_id, steps, r.json()
+
+
+async def _run(base_url: str, users: int, steps: int, concurrent: int, hot_steps: int):
+    latencies = []
+    players = [(1000 + i, steps, concurrent) for i in range(users)]
+    if hot_steps:
+        players.append((999, hot_steps, hot_steps))
+    connections = users * concurrent + hot_steps
+    # keep-alive короче, чем у uvicorn (5 с), — иначе гонка на переиспользовании закрытого соединения
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections, keepalive_expiry=2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        started = time.perf_counter()
+        results = await asyncio.gather(*[_player(client, user_id, n, c, latencies) for user_id, n, c in players])
+        elapsed = time.perf_counter() - started
+
+    errors = []
+    for user_id, expected, last in results:
+        if str(last["user_id"]) != str(user_id):
+            errors.append(f"{user_id}: ответ для чужого игрока {last['user_id']}")
+        elif last["debug"]["inventory"].get("Бутерброд") != expected:
+            errors.append(f"{user_id}: инвентарь {last['debug']['inventory']}, ожидалось {expected}")
+    return elapsed, latencies, errors, results
+
+
+def _check_replay(root: str, results: list) -> list:
+    """Журнал ходов всех воркеров (один каталог) против последних ответов"""
+    errors = []
+    for user_id, _, last in results:
+        state, _ = replay(str(user_id), root)
+        expected = (last["debug"]["region"], last["debug"]["inventory"])
+        got = (state["current_region"], state["inventory"]) if state else None
+        if got != expected:
+            errors.append(f"{user_id}: replay {got}, ожидалось {expected}")
+    return errors
+
+
+def _wait_ready(base_url: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(base_url + "/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("приложение не поднялось")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--concurrent", type=int, default=5, help="одновременных ходов одного игрока")
+    parser.add_argument("--hot-steps", type=int, default=80, help="одновременных покупок «горячего» игрока (0 — без него)")
+    parser.add_argument("--llm-ms", type=float, default=50)
+    parser.add_argument("--llm-port", type=int, default=8921)
+    parser.add_argument("--app-port", type=int, default=8922)
+    args = parser.parse_args()
+
+    serve_in_thread(create_app(FakeLLMConfig(args.llm_ms, 0)), args.llm_port)
+
+    tmp = tempfile.mkdtemp()
+    env = dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN=BOT_TOKEN,
+        BOT_MODE="off",
+        DEEPSEEK_API_KEY="fake",
+        DEEPSEEK_API_URL=f"http://127.0.0.1:{args.llm_port}/v1/chat/completions",
+        STATE_BACKEND="sqlite",
+        STATE_DB_PATH=os.path.join(tmp, "players.db"),
+        STATE_SHARED="1",
+        EVENT_LOG_DIR=os.path.join(tmp, "events"),
+    )
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.app_port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    base_url = f"http://127.0.0.1:{args.app_port}"
+    try:
+        _wait_ready(base_url)
+        elapsed, latencies, errors, results = asyncio.run(_run(base_url, args.users, args.steps, args.concurrent, args.hot_steps))
+    finally:
+        app.terminate()
+        app.wait(timeout=30)
+    replay_errors = _check_replay(env["EVENT_LOG_DIR"], results)
+
+    total = args.users * args.steps + args.hot_steps
+    latencies.sort()
+    print(f"{args.workers} воркеров × {args.users} игроков × {args.steps} ходов (по {args.concurrent} сразу) "
+          f"+ {args.hot_steps} сразу у одного: "
+          f"{total / elapsed:.0f} ходов/с, p50={statistics.median(latencies) * 1000:.0f}ms "
+          f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.0f}ms")
+    if errors:
+        print(f"❌ нарушена изоляция состояния ({len(errors)}):")
+        for line in errors[:20]:
+            print("  ", line)
+        sys.exit(1)
+    print("✅ состояние каждого игрока изолировано и согласовано")
+    if replay_errors:
+        print(f"❌ журнал ходов разошёлся с состоянием ({len(replay_errors)}):")
+        for line in replay_errors[:20]:
+            print("  ", line)
+        sys.exit(1)
+    print(f"✅ replay журнала сходится с состоянием у всех {len(results)} игроков")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+# benchmarks/loadtest.py
+"""
+Нагрузочный прогон приложения целиком: FastAPI-приложение в этом же процессе,
+рядом — фейковый DeepSeek (fake_llm.py) с заданной задержкой, стримингом и
+долей ошибок. Тысячи синтетических игроков ходят одновременно со смесью
+действий (покупки, переходы, свободный текст). Итог — пропускная способность,
+p50/p95/p99 задержки, память и разбивка по этапам из /metrics, в JSON.
+
+    python benchmarks/loadtest.py --players 2000 --duration 30
+    python benchmarks/loadtest.py --players 2000 --duration 30 --baseline benchmarks/results/<прошлый>.json
+
+Транспорт: asgi — запросы идут в приложение напрямую, без сокетов (тысячи
+игроков без упора в порты); http — через uvicorn в фоновом потоке, как в проде.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+BOT_TOKEN = "123456:loadtest-token"
+# utils читает токен при импорте: без него все игроки слились бы в одного test_user
+os.environ["TELEGRAM_BOT_TOKEN"] = BOT_TOKEN
+os.environ["BOT_MODE"] = "off"  # токен фейковый — вебхук в Telegram не регистрируем
+
+import httpx
+from fake_llm import FakeLLMConfig, create_app, percentile, serve_in_thread
+from utils import sign_init_data
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Смесь действий: (вес, вид, варианты)
+ACTION_MIX = [
+    (0.30, "purchase", ["куплю бутер", "закажу кофе", "возьму бутерброд и кофе"]),
+    (0.20, "navigation", ["иду в логово к ведьме", "пойду в логово", "возвращаюсь назад в город"]),
+    (0.50, "free_text", ["осматриваюсь", "говорю с Саней о ведьме", "сажусь у окна и слушаю разговоры",
+                         "спрашиваю незнакомца в капюшоне, кто он", "бью ведьму факелом"]),
+]
+
+
+def pick_action(rnd: random.Random):
+    roll = rnd.random()
+    for weight, kind, actions in ACTION_MIX:
+        if roll < weight:
+            return kind, rnd.choice(actions)
+        roll -= weight
+    kind, actions = ACTION_MIX[-1][1], ACTION_MIX[-1][2]
+    return kind, rnd.choice(actions)
+
+
+def rss_mb():
+    """Текущий RSS процесса (Linux), МБ"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if platform.system() == "Darwin" else peak / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Recorder:
+    def __init__(self):
+        self.latency = defaultdict(list)        # (эндпоинт, вид действия) → секунды
+        self.first_token = []
+        self.statuses = defaultdict(int)
+        self.steps = 0
+
+    def add(self, endpoint: str, kind: str, status, seconds: float):
+        self.statuses[str(status)] += 1
+        if status == 200:
+            self.latency[(endpoint, kind)].append(seconds)
+            self.steps += 1
+
+    def summary(self, elapsed: float):
+        def stats(values):
+            return {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 2) if values else None,
+                "p95_ms": round(percentile(values, 0.95) * 1000, 2) if values else None,
+                "p99_ms": round(percentile(values, 0.99) * 1000, 2) if values else None,
+                "max_ms": round(max(values) * 1000, 2) if values else None,
+            }
+
+        everything = [v for values in self.latency.values() for v in values]
+        by_endpoint = defaultdict(list)
+        for (endpoint, kind), values in self.latency.items():
+            by_endpoint[endpoint] += values
+        return {
+            "throughput_rps": round(self.steps / elapsed, 2),
+            "latency": stats(everything),
+            "latency_by_endpoint": {e: stats(v) for e, v in by_endpoint.items()},
+            "latency_by_action": {f"{e}:{k}": stats(v) for (e, k), v in sorted(self.latency.items())},
+            "first_token": stats(self.first_token) if self.first_token else None,
+            "statuses": dict(self.statuses),
+        }
+
+
+async def _step(client: httpx.AsyncClient, rec: Recorder, endpoint: str, init_data: str, kind: str, action: str):
+    """Один ход; возвращает Retry-After, если сервер попросил подождать"""
+    body = {"initData": init_data, "action": action}
+    started = time.perf_counter()
+    try:
+        if endpoint == "step":
+            r = await client.post("/api/step", json=body)
+            rec.add(endpoint, kind, r.status_code, time.perf_counter() - started)
+            return float(r.headers.get("Retry-After", 0)) if r.status_code == 503 else None
+        async with client.stream("POST", "/api/step/stream", json=body) as r:
+            if r.status_code == 503:
+                rec.add(endpoint, kind, 503, time.perf_counter() - started)
+                return float(r.headers.get("Retry-After", 0))
+            status = r.status_code
+            got_first = False
+            async for line in r.aiter_lines():
+                if line.startswith("event: token") and not got_first:
+                    rec.first_token.append(time.perf_counter() - started)
+                    got_first = True
+                elif line.startswith("event: error"):
+                    status = "stream_error"
+        rec.add(endpoint, kind, status, time.perf_counter() - started)
+    except httpx.HTTPError as e:
+        rec.add(endpoint, kind, type(e).__name__, time.perf_counter() - started)
+    return None
+
+
+async def _player(client, rec: Recorder, player_id: int, args, deadline: float, seed: int):
+    rnd = random.Random(seed * 100003 + player_id)
+    init_data = sign_init_data({"id": 10_000 + player_id, "first_name": f"Bot{player_id}"}, BOT_TOKEN)
+    await asyncio.sleep(rnd.uniform(0, args.ramp))
+    while time.perf_counter() < deadline:
+        kind, action = pick_action(rnd)
+        endpoint = "stream" if rnd.random() < args.stream_ratio else "step"
+        retry_after = await _step(client, rec, endpoint, init_data, kind, action)
+        if retry_after:
+            # как клиент Mini App: при 503 ждём, сколько сказал сервер, а не долбим снова
+            await asyncio.sleep(retry_after * rnd.uniform(1, 1.5))
+        elif args.think_ms:
+            await asyncio.sleep(rnd.expovariate(1000 / args.think_ms))
+
+
+def _stage_breakdown():
+    """Среднее по этапам из гистограммы adventure_stage_seconds (то же, что отдаёт /metrics)"""
+    from metrics import STAGE_SECONDS
+    return {
+        f"{endpoint}:{stage}": {"count": count, "mean_ms": round(total / count * 1000, 3)}
+        for (endpoint, stage), (_, total, count) in STAGE_SECONDS._series.items() if count
+    }
+
+
+async def _drive(app, args, base_url=None):
+    rec = Recorder()
+    limits = httpx.Limits(max_connections=args.players, max_keepalive_connections=args.players, keepalive_expiry=2)
+    if base_url is None:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest",
+                                   timeout=args.timeout)
+    else:
+        client = httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits)
+
+    samples = []
+
+    async def sample_memory():
+        while True:
+            samples.append(rss_mb())
+            await asyncio.sleep(0.5)
+
+    sampler = asyncio.create_task(sample_memory())
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    deadline = started + args.ramp + args.duration
+    async with client:
+        await asyncio.gather(*[_player(client, rec, i, args, deadline, args.seed) for i in range(args.players)])
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+
+    result = rec.summary(elapsed)
+    result["elapsed_seconds"] = round(elapsed, 2)
+    result["memory"] = {
+        "rss_before_mb": round(rss_before, 1) if rss_before else None,
+        "rss_max_mb": round(max(s for s in samples if s), 1) if any(samples) else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    return result
+
+
+def _configure_env(args):
+    """Окружение приложения — до импорта main (модули читают os.getenv при импорте)"""
+    os.environ["DEEPSEEK_API_KEY"] = "fake"
+    os.environ["DEEPSEEK_API_URL"] = f"http://127.0.0.1:{args.llm_port}/v1/chat/completions"
+    os.environ.setdefault("STATE_BACKEND", "memory")
+    os.environ.setdefault("WORLD_RELOAD_INTERVAL", "0")
+    # журнал ходов — во временный каталог, не в корень репозитория
+    os.environ.setdefault("EVENT_LOG_DIR", tempfile.mkdtemp(prefix="events-"))
+    for item in args.env:
+        key, _, value = item.partition("=")
+        os.environ[key] = value
+
+
+def compare(result: dict, baseline: dict):
+    """Разница с прошлым прогоном: + — хуже для задержки, лучше для пропускной способности"""
+    rows = [("throughput_rps", result["throughput_rps"], baseline.get("results", baseline)["throughput_rps"])]
+    base_latency = baseline.get("results", baseline)["latency"]
+    for q in ("p50_ms", "p95_ms", "p99_ms"):
+        rows.append((f"latency {q}", result["latency"][q], base_latency.get(q)))
+    print(f"\nсравнение с {baseline.get('commit') or 'базой'}:")
+    for name, now, before in rows:
+        if now is None or not before:
+            continue
+        print(f"  {name:>18}: {before:>10} → {now:>10} ({(now - before) / before * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=20, help="секунд после разгона")
+    parser.add_argument("--ramp", type=float, default=5, help="игроки подключаются равномерно за столько секунд")
+    parser.add_argument("--think-ms", type=float, default=500, help="средняя пауза игрока между ходами")
+    parser.add_argument("--stream-ratio", type=float, default=0.5, help="доля ходов через /api/step/stream")
+    parser.add_argument("--transport", choices=("asgi", "http"), default="asgi")
+    parser.add_argument("--first-token-ms", type=float, default=300)
+    parser.add_argument("--token-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--llm-port", type=int, default=8931)
+    parser.add_argument("--app-port", type=int, default=8932)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="переменные окружения приложения, например LLM_MAX_CONCURRENCY=256")
+    parser.add_argument("--out", help="куда писать JSON (по умолчанию benchmarks/results/loadtest-<коммит>-<время>.json)")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    llm_config = FakeLLMConfig(args.first_token_ms, args.token_ms, error_rate=args.error_rate,
+                               error_status=args.error_status, jitter_ms=args.jitter_ms)
+    llm = serve_in_thread(create_app(llm_config), args.llm_port)
+
+    _configure_env(args)
+    os.chdir(ROOT)
+    import main as app_main
+
+    async def run_asgi():
+        # ASGITransport не запускает lifespan — поднимаем его сами
+        async with app_main.lifespan(app_main.app):
+            return await _drive(app_main.app, args)
+
+    try:
+        if args.transport == "asgi":
+            result = asyncio.run(run_asgi())
+        else:
+            server = serve_in_thread(app_main.app, args.app_port)
+            try:
+                result = asyncio.run(_drive(app_main.app, args, f"http://127.0.0.1:{args.app_port}"))
+            finally:
+                server.should_exit = True
+    finally:
+        llm.should_exit = True
+
+    result["stages"] = _stage_breakdown()
+    result["upstream"] = {"requests": llm_config.requests, "errors": llm_config.errors,
+                          "max_concurrent": llm_config.max_active}
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "baseline")},
+        "results": result,
+    }
+
+    out = args.out or os.path.join(RESULTS_DIR, f"loadtest-{report['commit'] or 'nogit'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    lat = result["latency"]
+    print(f"игроков {args.players}, {result['elapsed_seconds']} с, ходов {sum(v['count'] for v in result['latency_by_endpoint'].values())}")
+    print(f"пропускная способность: {result['throughput_rps']} ходов/с")
+    print(f"задержка: p50={lat['p50_ms']} p95={lat['p95_ms']} p99={lat['p99_ms']} max={lat['max_ms']} мс")
+    if result["first_token"]:
+        ft = result["first_token"]
+        print(f"первый токен: p50={ft['p50_ms']} p99={ft['p99_ms']} мс")
+    print(f"статусы: {result['statuses']}")
+    print(f"память: {result['memory']}")
+    print(f"upstream: {result['upstream']}")
+    print(f"результат: {out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# bot.py
+import os
+import hmac
+import asyncio
+import logging
+from typing import List, Optional
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+
+# .env — до чтения настроек (при запуске отдельным воркером main.py его не грузит)
+load_dotenv()
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from fastapi import Request, Response
+
+# Бот в режиме webhook: Telegram сам присылает апдейты, без long-polling и холостых запросов.
+# Запускается в одном event loop с FastAPI (main.py, BOT_MODE=webhook)
+# или отдельным воркером: python bot.py (состояние общее — STATE_BACKEND=sqlite + STATE_SHARED=1).
+
+# Публичный адрес вебхука, например https://example.com/webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = urlparse(WEBHOOK_URL).path or "/webhook"
+# Секрет приходит в заголовке X-Telegram-Bot-Api-Secret-Token — чужие POST на вебхук отбиваются
+WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# webhook — бот работает в этом процессе; off — только Mini App. По умолчанию — есть ли WEBHOOK_URL.
+BOT_MODE = os.getenv("BOT_MODE", "webhook" if WEBHOOK_URL else "off")
+# Регистрировать вебхук в Telegram при старте (0 — если это делает деплой или другой воркер)
+BOT_SET_WEBHOOK = os.getenv("BOT_SET_WEBHOOK", "1") not in ("0", "false", "no")
+# Пул обработки: вебхук только ставит апдейт в очередь и сразу отвечает 200
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "16"))
+BOT_QUEUE_SIZE = int(os.getenv("BOT_QUEUE_SIZE", "1000"))
+# Сколько ждать недообработанные апдейты при остановке
+BOT_DRAIN_TIMEOUT = float(os.getenv("BOT_DRAIN_TIMEOUT", "10"))
+# Отдельный воркер: python bot.py
+BOT_HOST = os.getenv("BOT_HOST", "0.0.0.0")
+BOT_PORT = int(os.getenv("BOT_PORT", "8081"))
+
+
+class BotRunner:
+    """
+    Приём апдейтов отдельно от обработки: submit() кладёт апдейт в ограниченную
+    очередь и возвращается сразу, BOT_WORKERS задач разбирают её через диспетчер
+    aiogram. Очередь полна — submit() возвращает False, вебхук отвечает 503,
+    и Telegram повторит доставку позже.
+    """
+
+    def __init__(self, token: str, workers: int = BOT_WORKERS, queue_size: int = BOT_QUEUE_SIZE):
+        from handlers import router
+
+        self.bot = Bot(token)
+        self.dp = Dispatcher()
+        self.dp.include_router(router)
+        self.workers = max(1, workers)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks: List[asyncio.Task] = []
+
+        self.received = 0
+        self.rejected = 0   # очередь полна — Telegram повторит
+        self.processed = 0
+        self.failed = 0
+
+    async def start(self, webhook_url: Optional[str] = None, secret: Optional[str] = None):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if webhook_url and BOT_SET_WEBHOOK:
+            try:
+                await self.bot.set_webhook(webhook_url, secret_token=secret or None,
+                                           allowed_updates=self.dp.resolve_used_update_types())
+                logging.info(f"Вебхук бота: {webhook_url}")
+            except Exception as e:
+                # Приложение поднимается и без этого: вебхук мог остаться с прошлого запуска
+                logging.error(f"Вебхук не зарегистрирован: {e}")
+
+    def submit(self, data: dict) -> bool:
+        """Апдейт из тела вебхука → в очередь. False — очередь полна."""
+        update = Update.model_validate(data, context={"bot": self.bot})
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.received += 1
+        return True
+
+    async def _worker(self):
+        while True:
+            update = await self._queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logging.error(f"Ошибка обработки апдейта {update.update_id}: {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    async def stop(self):
+        # Дорабатываем принятое (Telegram уже получил 200 и не пришлёт его снова)
+        try:
+            await asyncio.wait_for(self._queue.join(), BOT_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning(f"Бот остановлен, не обработано апдейтов: {self._queue.qsize()}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.bot.session.close()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize(),
+            "received": self.received,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+
+def check_secret(header: Optional[str]) -> bool:
+    """Заголовок вебхука совпадает с TELEGRAM_WEBHOOK_SECRET (без секрета — принимаем всё)"""
+    if not WEBHOOK_SECRET:
+        return True
+    return hmac.compare_digest((header or "").encode(), WEBHOOK_SECRET.encode())
+
+
+async def handle_webhook(runner: BotRunner, request: Request) -> Response:
+    """POST от Telegram: проверка секрета → в очередь → 200 сразу, не дожидаясь хода"""
+    if not check_secret(request.headers.get(SECRET_HEADER)):
+        return Response(status_code=401)
+    try:
+        accepted = runner.submit(await request.json())
+    except ValueError:  # не JSON или не апдейт — повторять бессмысленно
+        return Response(status_code=400)
+    # 503 — Telegram повторит доставку, когда очередь разгрузится
+    return Response(status_code=200 if accepted else 503)
+
+
+def create_bot_runner(token: Optional[str]) -> Optional[BotRunner]:
+    """Бот для этого процесса или None (нет токена или BOT_MODE=off)"""
+    if not token or BOT_MODE != "webhook":
+        return None
+    return BotRunner(token)
+
+
+def create_webhook_app():
+    """Отдельный воркер бота: только вебхук, без Mini App"""
+    from contextlib import asynccontextmanager
+    from fastapi import FastAPI
+    from engine import running_engine
+    from utils import BOT_TOKEN
+
+    if not BOT_TOKEN:
+        raise SystemExit("TELEGRAM_BOT_TOKEN не задан")
+    runner = BotRunner(BOT_TOKEN)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        async with running_engine():
+            await runner.start(WEBHOOK_URL, WEBHOOK_SECRET)
+            try:
+                yield
+            finally:
+                await runner.stop()
+
+    app = FastAPI(title="Fantasy Adventure Bot", lifespan=lifespan)
+
+    @app.post(WEBHOOK_PATH)
+    async def telegram_webhook(request: Request):
+        return await handle_webhook(runner, request)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", "bot": runner.stats()}
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    logging.basicConfig(level=logging.INFO)
+    uvicorn.run(create_webhook_app(), host=BOT_HOST, port=BOT_PORT)
@@ -0,0 +1,294 @@
+# engine.py
+import os
+import logging
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Tuple
+
+from world import WorldChanged, WorldSnapshot, current_world, refresh_world
+from rules import ActionResult, get_engine
+from storyteller import get_ai_response, stream_ai_response, summarize_history, PlayerState, admission
+from admission import CircuitBreaker, Overloaded
+from fallback import fallback_narration
+from memory import Summarizer, remember_turn
+from metrics import StageTimer
+from state_manager import player_session, start_state_manager, stop_state_manager
+from llm_client import create_http_client, close_http_client
+from event_log import event_log
+
+# Один ход игрока — общий для Mini App (/api/step, /api/step/stream) и бота:
+# состояние под блокировкой → правила мира → повествователь → память → сохранение.
+
+# Бюджет хода от прихода запроса: не уложился повествователь — запасное повествование
+# (fallback.py), а в потоке настоящий ответ дойдёт следом. 0 — ждём до LLM_TIMEOUT.
+LLM_STEP_DEADLINE_MS = float(os.getenv("LLM_STEP_DEADLINE_MS", "0"))
+# Отделяет опоздавший ответ повествователя от уже отданной заготовки
+LATE_SEPARATOR = "\n\n"
+
+# Размыкатель цепи к DeepSeek: сбои и пропущенные дедлайны считает движок
+breaker = CircuitBreaker()
+
+
+def _log_fold(user_id: str, before: dict, state: PlayerState):
+    """Свёртка памяти меняет состояние вне хода — в журнал, иначе replay разойдётся с хранилищем"""
+    event_log.record(user_id, "", [f"Летопись: свёрнуто ходов {len(before['history']) - len(state.history)}"],
+                     before, state.model_dump(), status="fold")
+
+
+# Свёртка старых ходов в летопись — в фоне, вне пути запроса
+summarizer = Summarizer(summarize_history, player_session,
+                        on_fold=_log_fold if event_log.enabled else None)
+
+
+@asynccontextmanager
+async def running_engine() -> AsyncIterator[None]:
+    """Всё, что нужно ходам: HTTP-клиент к DeepSeek, хранилище состояний, фоновая свёртка памяти"""
+    # 🔌 Один HTTP-клиент к DeepSeek на всё время жизни процесса
+    create_http_client()
+    # 💾 Хранилище состояний игроков + фоновая запись
+    await start_state_manager()
+    # 📜 Журнал ходов: пишется в фоне, останавливается после свёртки памяти — она тоже пишет в него
+    await event_log.start()
+    summarizer.start()
+    try:
+        yield
+    finally:
+        await summarizer.stop()
+        await event_log.stop()
+        await stop_state_manager()
+        await close_http_client()
+
+
+class StepResult:
+    __slots__ = ("response", "region", "inventory", "quests", "prompt_tokens", "llm_error", "fallback", "late")
+
+    def __init__(self):
+        self.response = ""
+        self.region: Optional[str] = None
+        self.inventory: dict = {}
+        self.quests: list = []
+        self.prompt_tokens: Optional[int] = None
+        self.llm_error = False  # вместо повествования — текст ошибки связи
+        self.fallback: Optional[str] = None  # отдана заготовка: deadline, breaker, unavailable
+        self.late = False  # в потоке за заготовкой дошёл ответ повествователя
+
+    @property
+    def status(self) -> str:
+        if self.llm_error and not self.fallback:
+            return "llm_error"
+        return "fallback" if self.fallback else "ok"
+
+    def debug(self) -> dict:
+        return {
+            "region": self.region,
+            "inventory": self.inventory,
+            "quests": self.quests,
+            "prompt_tokens": self.prompt_tokens,
+            "fallback": self.fallback
+        }
+
+
+def _step_regions(state: PlayerState, world: WorldSnapshot) -> set:
+    """Регионы, которые понадобятся ходу: текущий, его выходы, регионы активных квестов"""
+    names = {state.current_region, *world.exits(state.current_region)}
+    names.update(world.quest_region(q) for q in state.active_quests)
+    names.discard(None)
+    return names
+
+
+async def _step_world(state: PlayerState) -> WorldSnapshot:
+    """
+    Один снимок мира на весь ход — перезагрузка посреди хода его не заденет. Нужные
+    ходу регионы загружаются сразу; если файл региона правили после снимка, мир
+    перезагружается и ход целиком идёт на новом снимке.
+    """
+    world = current_world()
+    try:
+        world.pin(_step_regions(state, world))
+    except WorldChanged as e:
+        logging.info(f"{e} — перезагружаем мир")
+        world = await asyncio.to_thread(refresh_world, world)
+        world.pin(_step_regions(state, world))
+    return world
+
+
+def _apply_action(state: PlayerState, user_action: str, world: WorldSnapshot) -> ActionResult:
+    """Применяет действие к состоянию (покупки, квесты, навигация); события в нём — для ИИ"""
+    return get_engine(world).apply(state, user_action)
+
+
+def _deadline(started: float) -> Optional[float]:
+    return started + LLM_STEP_DEADLINE_MS / 1000 if LLM_STEP_DEADLINE_MS > 0 else None
+
+
+def _fallback(state: PlayerState, user_action: str, outcome: ActionResult, world: WorldSnapshot,
+              meta: dict, reason: str) -> str:
+    meta["fallback"] = reason
+    return fallback_narration(state, user_action, outcome, world, reason)
+
+
+def _skip_upstream(deadline: Optional[float]) -> Optional[str]:
+    """Почему в DeepSeek не идём (None — идём): бюджет уже съеден или цепь разомкнута"""
+    if deadline is not None and deadline <= time.perf_counter():
+        return "deadline"
+    return None if breaker.allow() else "breaker"
+
+
+async def _narrate(state: PlayerState, user_action: str, outcome: ActionResult, user_id: str,
+                   world: WorldSnapshot, meta: dict, timer: StageTimer, deadline: Optional[float]) -> str:
+    """Повествование в пределах бюджета хода; не успел или upstream лежит — заготовка"""
+    skip = _skip_upstream(deadline)
+    if skip:
+        return _fallback(state, user_action, outcome, world, meta, skip)
+    call = get_ai_response(state, user_action, events=outcome.events, user_id=user_id,
+                           world=world, meta=meta, timer=timer)
+    try:
+        # по дедлайну ход перестаёт ждать; вызов, который делят с ним другие ходы (кэш
+        # ответов, пачка), живёт для них, а не нужный больше никому — отменяется
+        response = await (call if deadline is None else asyncio.wait_for(call, deadline - time.perf_counter()))
+    except asyncio.TimeoutError:
+        breaker.failure()
+        return _fallback(state, user_action, outcome, world, meta, "deadline")
+    if meta.get("unavailable"):
+        breaker.failure()
+        return _fallback(state, user_action, outcome, world, meta, "unavailable")
+    if not meta.get("error"):
+        breaker.success()  # ошибка не из-за upstream (4xx, без ключа) — размыкателю не сигнал
+    return response
+
+
+async def _stream_narration(state: PlayerState, user_action: str, outcome: ActionResult, user_id: str,
+                            world: WorldSnapshot, meta: dict, timer: StageTimer,
+                            deadline: Optional[float]) -> AsyncIterator[Tuple[str, bool]]:
+    """
+    Потоковое повествование: (кусок, от повествователя ли он). Первый токен не
+    пришёл к дедлайну — сразу заготовка, а ответ повествователя, когда придёт,
+    идёт следом в тот же поток (meta["late"]).
+    """
+    skip = _skip_upstream(deadline)
+    if skip:
+        yield _fallback(state, user_action, outcome, world, meta, skip), False
+        return
+    upstream = stream_ai_response(state, user_action, events=outcome.events, user_id=user_id,
+                                  world=world, meta=meta, timer=timer)
+    first = asyncio.ensure_future(upstream.__anext__())
+    try:
+        late = False
+        if deadline is not None:
+            # ждём без отмены: опоздавший ответ ещё пригодится
+            await asyncio.wait({first}, timeout=max(0.0, deadline - time.perf_counter()))
+            late = not first.done()
+        if late:
+            breaker.failure()
+            yield _fallback(state, user_action, outcome, world, meta, "deadline"), False
+        try:
+            chunk = await first
+        except StopAsyncIteration:
+            return
+        except Overloaded:
+            if late:
+                return  # ход уже состоялся с заготовкой
+            raise
+        if meta.get("error"):
+            # вместо ответа — текст ошибки связи: заготовка уже отдана или отдаём её сейчас
+            if not late and meta.get("unavailable"):
+                breaker.failure()
+                yield _fallback(state, user_action, outcome, world, meta, "unavailable"), False
+            elif not late:
+                yield chunk, True
+            return
+        if late:
+            meta["late"] = True
+            yield LATE_SEPARATOR, False
+        else:
+            breaker.success()
+        yield chunk, True
+        async for chunk in upstream:
+            yield chunk, True
+    finally:
+        if not first.done():
+            first.cancel()
+            await asyncio.gather(first, return_exceptions=True)
+        await upstream.aclose()
+
+
+def _finish(user_id: str, state: PlayerState, before: Optional[dict], result: StepResult, user_action: str,
+            events: list, meta: dict, timer: StageTimer, world: WorldSnapshot):
+    result.llm_error = bool(meta.get("error"))
+    result.fallback = meta.get("fallback")
+    result.late = bool(meta.get("late"))
+    result.prompt_tokens = meta.get("prompt_tokens")
+    # Ход — в память (ошибки связи и заготовки не запоминаем, опоздавший ответ — да);
+    # свёртка — в фоне после сохранения
+    if not result.llm_error and (not result.fallback or result.late):
+        remember_turn(state, user_action, result.response)
+    result.region = state.current_region
+    result.inventory = dict(state.inventory)
+    result.quests = list(state.active_quests)
+    # 📜 В журнал — ещё под блокировкой игрока: записи одного игрока идут в порядке ходов
+    if event_log.enabled:
+        llm = timer.stages.get("llm_call")
+        event_log.record(user_id, user_action, events, before, state.model_dump(),
+                         llm_ms=llm * 1000 if llm is not None else None,
+                         status=result.status, world_version=world.version)
+
+
+async def run_step(user_id: str, user_action: str, timer: Optional[StageTimer] = None) -> StepResult:
+    """Полный ход. Overloaded (очередь к LLM полна) — ход откатывается, вызывающий отвечает 503."""
+    timer = timer or StageTimer("step")
+    # 🚦 Очередь к LLM полна — отказываем сразу, не трогая состояние
+    if admission.saturated():
+        raise Overloaded("LLM queue is full")
+
+    result = StepResult()
+    started = time.perf_counter()
+    deadline = _deadline(started)
+    async with player_session(user_id) as state:
+        timer.record("state_load", time.perf_counter() - started)
+
+        world = await _step_world(state)
+        before = state.model_dump() if event_log.enabled else None  # для журнала ходов
+        with timer.stage("rule_eval"):
+            outcome = _apply_action(state, user_action, world)
+
+        # исключение (в том числе Overloaded) откатывает ход — это делает player_session
+        meta = {}
+        result.response = await _narrate(state, user_action, outcome, user_id, world, meta, timer, deadline)
+
+        _finish(user_id, state, before, result, user_action, outcome.events, meta, timer, world)
+        started = time.perf_counter()
+    timer.record("state_save", time.perf_counter() - started)
+    summarizer.schedule(user_id, state)
+    return result
+
+
+async def stream_step(user_id: str, user_action: str, result: StepResult,
+                      timer: Optional[StageTimer] = None) -> AsyncIterator[str]:
+    """
+    Ход с потоковым ответом: отдаёт очищенные куски текста, итог — в result
+    (заполнен, когда генератор закончился и состояние сохранено). В result.response —
+    ответ повествователя; заготовка — только если его так и не было.
+    """
+    timer = timer or StageTimer("stream")
+    started = time.perf_counter()
+    deadline = _deadline(started)
+    async with player_session(user_id) as state:
+        timer.record("state_load", time.perf_counter() - started)
+        world = await _step_world(state)
+        before = state.model_dump() if event_log.enabled else None  # для журнала ходов
+        with timer.stage("rule_eval"):
+            outcome = _apply_action(state, user_action, world)
+
+        # Overloaded до первого токена или клиент ушёл посреди потока — player_session откатывает ход
+        meta, chunks, sent = {}, [], []
+        async for chunk, narrated in _stream_narration(state, user_action, outcome, user_id,
+                                                       world, meta, timer, deadline):
+            (chunks if narrated else sent).append(chunk)
+            yield chunk
+
+        result.response = "".join(chunks) if chunks else "".join(sent)
+        _finish(user_id, state, before, result, user_action, outcome.events, meta, timer, world)
+        started = time.perf_counter()
+    timer.record("state_save", time.perf_counter() - started)
+    summarizer.schedule(user_id, state)
@@ -0,0 +1,343 @@
+# event_log.py
+import os
+import json
+import time
+import zlib
+import heapq
+import socket
+import struct
+import asyncio
+import logging
+import argparse
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import state_codec
+
+# Журнал ходов: только дописывается. На ход — действие игрока, события правил
+# (покупки, квесты, переходы), дельта состояния (state_codec) и задержка LLM.
+# Путь запроса только кладёт запись в ограниченную очередь; фоновый писатель
+# кодирует пачку, пишет её в текущий сегмент и делает fsync не чаще раза в
+# EVENT_LOG_FSYNC_MS. Сегменты ротируются по размеру. Запись игрока — дельта
+# к его предыдущей записи в том же сегменте; первая запись в сегменте и запись,
+# перед которой были чужие изменения (ход на другом воркере, отброшенная при
+# переполнении запись), — полный снимок. Состояние восстанавливается по
+# последнему снимку в журнале и хвосту дельт после него (python event_log.py replay).
+
+# Каталог журнала ("" — журнал выключен). Воркеры могут писать в общий каталог:
+# у каждого свои сегменты (хост и pid в имени), при чтении они сливаются по времени.
+EVENT_LOG_DIR = os.getenv("EVENT_LOG_DIR", "events")
+EVENT_LOG_SEGMENT_BYTES = int(os.getenv("EVENT_LOG_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+EVENT_LOG_QUEUE = int(os.getenv("EVENT_LOG_QUEUE", "100000"))
+EVENT_LOG_BATCH = int(os.getenv("EVENT_LOG_BATCH", "2048"))
+# fsync пачкой, не чаще раза в интервал: при падении машины теряется не больше его
+EVENT_LOG_FSYNC_MS = float(os.getenv("EVENT_LOG_FSYNC_MS", "50"))
+
+SEGMENT_PREFIX = "events-"
+SEGMENT_SUFFIX = ".log"
+# Кадр: длина тела, crc32 тела; тело: вид записи, длина метаданных, метаданные (JSON), состояние
+_FRAME = struct.Struct("<II")
+_BODY = struct.Struct("<BI")
+SNAPSHOT = state_codec.SNAPSHOT
+DELTA = state_codec.DELTA
+
+
+class Event:
+    """Одна запись журнала, как её видит replay и аудит"""
+
+    __slots__ = ("kind", "meta", "state", "segment", "offset")
+
+    def __init__(self, kind: int, meta: dict, state: bytes, segment: str = "", offset: int = 0):
+        self.kind = kind
+        self.meta = meta
+        self.state = state
+        self.segment = segment
+        self.offset = offset
+
+    @property
+    def user_id(self) -> str:
+        return self.meta["u"]
+
+
+def writer_id() -> str:
+    """Пространство имён сегментов этого процесса: хост и pid"""
+    host = "".join(c if c.isalnum() else "_" for c in socket.gethostname())
+    return f"{host}.{os.getpid()}"
+
+
+def segment_name(index: int, writer: str = "") -> str:
+    return f"{SEGMENT_PREFIX}{writer}-{index:08d}{SEGMENT_SUFFIX}" if writer else \
+        f"{SEGMENT_PREFIX}{index:08d}{SEGMENT_SUFFIX}"
+
+
+def parse_segment_name(name: str) -> Tuple[str, int]:
+    """(писатель, номер); у сегментов без писателя в имени писатель — """""
+    writer, _, index = name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)].rpartition("-")
+    return writer, int(index)
+
+
+def list_segments(root: str, writer: Optional[str] = None) -> List[str]:
+    """Сегменты по писателям, у каждого по номеру; writer — только сегменты этого писателя"""
+    if not os.path.isdir(root):
+        return []
+    names = [f for f in os.listdir(root) if f.startswith(SEGMENT_PREFIX) and f.endswith(SEGMENT_SUFFIX)]
+    if writer is not None:
+        names = [f for f in names if parse_segment_name(f)[0] == writer]
+    return sorted(names, key=parse_segment_name)
+
+
+def encode_frame(kind: int, meta: dict, state: bytes) -> bytes:
+    raw_meta = json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    body = _BODY.pack(kind, len(raw_meta)) + raw_meta + state
+    return _FRAME.pack(len(body), zlib.crc32(body)) + body
+
+
+def read_segment(path: str) -> Iterator[Event]:
+    """Записи сегмента по порядку; оборванный хвост (падение посреди записи) пропускается"""
+    name = os.path.basename(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    pos = 0
+    while pos + _FRAME.size <= len(data):
+        size, crc = _FRAME.unpack_from(data, pos)
+        body = data[pos + _FRAME.size:pos + _FRAME.size + size]
+        if len(body) < size or zlib.crc32(body) != crc:
+            logging.warning(f"{name}: запись на смещении {pos} повреждена — дальше не читаем")
+            return
+        kind, meta_len = _BODY.unpack_from(body)
+        meta = json.loads(body[_BODY.size:_BODY.size + meta_len])
+        yield Event(kind, meta, body[_BODY.size + meta_len:], name, pos)
+        pos += _FRAME.size + size
+
+
+def _read_writer(root: str, names: List[str]) -> Iterator[Event]:
+    for name in names:
+        yield from read_segment(os.path.join(root, name))
+
+
+def read_log(root: str = EVENT_LOG_DIR) -> Iterator[Event]:
+    """
+    Записи всех писателей по времени. Внутри одного писателя порядок — как в его
+    сегментах (слияние его не переставляет), писатели сливаются по meta["t"]:
+    ходы одного игрока на разных воркерах разнесены во времени блокировкой игрока.
+    """
+    writers: Dict[str, List[str]] = {}
+    for name in list_segments(root):
+        writers.setdefault(parse_segment_name(name)[0], []).append(name)
+    if len(writers) == 1:
+        yield from _read_writer(root, next(iter(writers.values())))
+        return
+    yield from heapq.merge(*(_read_writer(root, names) for names in writers.values()), key=lambda e: e.meta["t"])
+
+
+class EventLog:
+    """
+    Писатель журнала. record() не ждёт диска: запись уходит в очередь,
+    при переполнении отбрасывается (считается в dropped) — ход важнее аудита.
+    """
+
+    def __init__(self, root: str = EVENT_LOG_DIR, segment_bytes: int = EVENT_LOG_SEGMENT_BYTES,
+                 max_queue: int = EVENT_LOG_QUEUE, batch: int = EVENT_LOG_BATCH,
+                 fsync_ms: float = EVENT_LOG_FSYNC_MS):
+        self.root = root
+        self.writer = writer_id()
+        self.segment_bytes = segment_bytes
+        self.batch = max(1, batch)
+        self.fsync_interval = fsync_ms / 1000
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        self._file = None
+        self._segment_index = 0
+        self._segment_size = 0
+        self._segment_last: Dict[str, dict] = {}  # игрок → его последнее записанное в сегмент состояние
+        self._unsynced = False
+        self._last_fsync = 0.0
+
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.fsyncs = 0
+        self.segments = 0
+        self.bytes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.root)
+
+    def record(self, user_id: str, action: str, events: Sequence[str], before: dict, after: dict,
+               llm_ms: Optional[float] = None, status: str = "ok", world_version: Optional[int] = None):
+        """Ход в журнал: before/after — model_dump() состояния до и после хода"""
+        if self._task is None:
+            return
+        # время с микросекундами: по нему сливаются сегменты разных воркеров
+        meta = {"u": user_id, "t": round(time.time(), 6), "a": action, "e": list(events), "s": status}
+        if llm_ms is not None:
+            meta["ms"] = round(llm_ms, 1)
+        if world_version is not None:
+            meta["w"] = world_version
+        try:
+            self._queue.put_nowait((meta, before, after))
+        except asyncio.QueueFull:
+            # следующая запись игрока не совпадёт с последней записанной — писатель сделает её снимком
+            self.dropped += 1
+            return
+        self.recorded += 1
+
+    # ====== ПИСАТЕЛЬ ======
+    def _encode(self, meta: dict, before: dict, after: dict) -> bytes:
+        user_id = meta["u"]
+        last = self._segment_last.get(user_id)
+        self._segment_last[user_id] = after
+        # дельта только поверх своей же предыдущей записи: если между ними состояние менял
+        # другой воркер или запись отброшена, before с ней не совпадёт — пишем снимок
+        if last is None or last != before:
+            return encode_frame(SNAPSHOT, meta, state_codec.encode(after))
+        return encode_frame(DELTA, meta, state_codec.encode_delta(before, after) or b"")
+
+    def _open_segment(self):
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+        os.makedirs(self.root, exist_ok=True)
+        existing = list_segments(self.root, self.writer)
+        # после рестарта — новый сегмент: хвост старого мог оборваться
+        last = parse_segment_name(existing[-1])[1] if existing else 0
+        self._segment_index = max(self._segment_index, last) + 1
+        self._file = open(os.path.join(self.root, segment_name(self._segment_index, self.writer)), "ab")
+        self._segment_size = 0
+        self._segment_last = {}
+        self.segments += 1
+
+    def _sync(self):
+        if self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = False
+            self.fsyncs += 1
+        self._last_fsync = time.monotonic()
+
+    def _write(self, frames: List[bytes]):
+        data = b"".join(frames)
+        self._file.write(data)
+        self._segment_size += len(data)
+        self.bytes += len(data)
+        self._unsynced = True
+        if time.monotonic() - self._last_fsync >= self.fsync_interval:
+            self._sync()
+
+    async def _writer(self):
+        while True:
+            try:
+                first = await asyncio.wait_for(self._queue.get(), timeout=self.fsync_interval or None)
+            except asyncio.TimeoutError:
+                # тишина — дописанное досинхронизируем
+                if self._unsynced:
+                    await asyncio.to_thread(self._sync)
+                continue
+            items, stopping = [], first is None  # None — сигнал остановки от stop()
+            if not stopping:
+                items.append(first)
+            while not stopping and len(items) < self.batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                else:
+                    items.append(item)
+            if items:
+                await self._flush(items)
+            if stopping:
+                return
+
+    async def _flush(self, items: List[Tuple[dict, dict, dict]]):
+        frames, size = [], self._segment_size
+        for meta, before, after in items:
+            if size >= self.segment_bytes:
+                if frames:
+                    await asyncio.to_thread(self._write, frames)
+                    frames = []
+                await asyncio.to_thread(self._open_segment)
+                size = 0
+            frame = self._encode(meta, before, after)
+            frames.append(frame)
+            size += len(frame)
+        if frames:
+            await asyncio.to_thread(self._write, frames)
+        self.written += len(items)
+
+    async def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        await asyncio.to_thread(self._open_segment)
+        self._task = asyncio.create_task(self._writer())
+
+    async def stop(self):
+        """Дописывает очередь, fsync, закрывает сегмент"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        # записи, пришедшие, пока писатель заканчивал
+        items = [item for item in (self._queue.get_nowait() for _ in range(self._queue.qsize())) if item]
+        if items:
+            await self._flush(items)
+        await asyncio.to_thread(self._sync)
+        self._file.close()
+        self._file = None
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "enabled": self._task is not None,
+            "queued": self._queue.qsize(),
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "fsyncs": self.fsyncs,
+            "segments": self.segments,
+            "bytes": self.bytes,
+        }
+
+
+event_log = EventLog()
+
+
+# ====== ВОССТАНОВЛЕНИЕ ======
+def replay(user_id: str, root: str = EVENT_LOG_DIR, until: Optional[float] = None) -> Tuple[Optional[dict], int]:
+    """
+    Состояние игрока по журналу (все писатели, по времени): последний снимок +
+    дельты после него (until — момент времени, на который восстанавливаем). Возвращает (model_dump, записей применено).
+    """
+    chain: List[bytes] = []
+    for event in read_log(root):
+        if event.user_id != user_id or (until is not None and event.meta["t"] > until):
+            continue
+        if event.kind == SNAPSHOT:
+            chain = [event.state]
+        elif chain and event.state:
+            chain.append(event.state)
+    if not chain:
+        return None, 0
+    return state_codec.decode_dict(chain)[0], len(chain)
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Журнал ходов: история игрока и восстановление состояния")
+    parser.add_argument("command", choices=("replay", "history"))
+    parser.add_argument("user_id")
+    parser.add_argument("--dir", default=EVENT_LOG_DIR)
+    parser.add_argument("--until", type=float, help="unix-время, на которое восстановить состояние")
+    args = parser.parse_args()
+
+    if args.command == "history":
+        for event in read_log(args.dir):
+            if event.user_id == args.user_id:
+                print(json.dumps(event.meta, ensure_ascii=False))
+        return
+    state, applied = replay(args.user_id, args.dir, args.until)
+    if state is None:
+        raise SystemExit(f"В журнале {args.dir} нет снимка игрока {args.user_id}")
+    print(json.dumps(state, ensure_ascii=False, indent=2))
+    logging.info(f"Восстановлено из {applied} записей")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,166 @@
+# fallback.py
+import os
+import json
+import random
+import argparse
+from typing import Dict, List, Optional
+
+from world import WORLD_DIR, FALLBACK_POOL, RegionData, WorldChanged, WorldSnapshot, current_world
+from rules import ActionResult, KeywordIndex, compile_condition, normalize
+
+# Запасное повествование: когда DeepSeek не уложился в бюджет хода или лежит,
+# игрок получает заранее заготовленный текст по (регион, намерение, состояние
+# квестов). Заготовки собираются из данных мира офлайн (python fallback.py) в
+# data/world/fallback.json; регион, которого там нет, собирается при первом ходе.
+
+INTENTS = ("look", "talk", "fight", "buy", "travel", "quest")
+QUEST_STATES = ("none", "active", "done")
+
+# Основы слов намерений, которые правила мира не распознают сами (покупка,
+# переход и квест видны по результату правил)
+INTENT_STEMS = {
+    "talk": ("говор", "спрос", "скаж", "привет", "болта", "расскаж"),
+    "fight": ("атак", "удар", "бью", "бей", "убь", "убив", "сраж", "напад", "драк", "дерусь"),
+}
+
+QUEST_HINTS = {
+    "none": "",
+    "active": "\n\n📜 Незаконченное дело не отпускает тебя.",
+    "done": "\n\n🏆 Дело сделано — пора за наградой.",
+}
+
+DEFAULT_NARRATION = "🌫️ Туман сгущается, и на миг мир замирает. Ты переводишь дух."
+
+_intent_index = KeywordIndex()
+for _intent, _stems in INTENT_STEMS.items():
+    for _stem in _stems:
+        _intent_index.add(_stem, _intent)
+
+_served: Dict[str, int] = {}
+
+
+def _first_sentence(text: str) -> str:
+    head = text.split(". ", 1)[0].rstrip(".")
+    return f"{head}." if head else ""
+
+
+def _intent_variants(region: RegionData, intent: str) -> List[str]:
+    desc = region.description
+    first = _first_sentence(desc)
+    npc = region.npcs[0] if region.npcs else None
+    if intent == "look":
+        variants = [f"🌫️ {desc}", f"🕯️ Ты медленно оглядываешься. {desc}"]
+        variants += [f"👀 {n.name}, {n.role.lower()}, поднимает на тебя глаза. {n.description}" for n in region.npcs]
+        variants += [f"⚠️ {first} Где-то рядом — {e.name}. Воздух будто густеет." for e in region.enemies]
+        return variants
+    if intent == "talk":
+        return [f"🗣️ {n.name}: {n.dialogue}" for n in region.npcs] or [f"🗣️ Твои слова тонут в тишине. {first}"]
+    if intent == "fight":
+        return ([f"⚔️ {e.name} — прямо перед тобой. {e.description}" for e in region.enemies]
+                or [f"⚔️ Ты хватаешься за оружие, но драться здесь не с кем. {first}"])
+    if intent == "buy":
+        if npc is not None:
+            return [f"🛒 {npc.name} принимает монеты и подвигает к тебе покупку."]
+        return [f"🛒 Покупка у тебя в руках. {first}"]
+    if intent == "travel":
+        return [f"🧭 Дорога позади — {region.name}. {desc}", f"🧭 Ты на месте: {region.name}. {first}"]
+    return [f"📜 {q.name}. {q.description}" for q in region.quests] or [f"📜 В голове складывается новое дело. {first}"]
+
+
+def build_region_pool(region: RegionData) -> Dict[str, List[str]]:
+    """Заготовки региона: "намерение/квесты" → варианты текста"""
+    pool = {}
+    for intent in INTENTS:
+        variants = _intent_variants(region, intent)
+        for quest in QUEST_STATES:
+            pool[f"{intent}/{quest}"] = [text + QUEST_HINTS[quest] for text in variants]
+    return pool
+
+
+def build_pool(world: WorldSnapshot) -> Dict[str, object]:
+    """Заготовки для всех регионов мира — то, что пишется в fallback.json"""
+    regions = {}
+    for name in world.region_names():
+        region = world.get_region(name)
+        if region is not None:
+            regions[name] = build_region_pool(region)
+    return {"regions": regions}
+
+
+def _file_pool(world: WorldSnapshot) -> Dict[str, Dict[str, List[str]]]:
+    def load():
+        try:
+            raw = world.read_file(FALLBACK_POOL)
+        except WorldChanged:
+            return {}  # файл пересобран после снимка — заготовки соберутся из регионов снимка
+        return json.loads(raw).get("regions", {}) if raw is not None else {}
+    return world.derived(("fallback_file",), load)
+
+
+def region_pool(world: WorldSnapshot, name: str) -> Dict[str, List[str]]:
+    def build():
+        pool = _file_pool(world).get(name)
+        if pool is None:
+            region = world.get_region(name)
+            pool = build_region_pool(region) if region is not None else {}
+        return pool
+    return world.derived(("fallback", name), build)
+
+
+def classify(action: str, outcome: Optional[ActionResult] = None) -> str:
+    """Намерение хода: сначала то, что уже сделали правила мира, потом слова игрока"""
+    if outcome is not None:
+        if outcome.moved_to:
+            return "travel"
+        if outcome.activated_quests:
+            return "quest"
+        if outcome.purchased:
+            return "buy"
+    found = _intent_index.find(normalize(action))
+    for intent in ("fight", "talk"):
+        if intent in found:
+            return intent
+    return "look"
+
+
+def quest_state(state, world: WorldSnapshot) -> str:
+    if not state.active_quests:
+        return "none"
+    for quest_id in state.active_quests:
+        quest = world.get_quest(quest_id)
+        if quest is None or not quest.completion_condition:
+            continue
+        done = world.derived(("quest_done", quest_id), lambda: compile_condition(quest.completion_condition))
+        if done(state):
+            return "done"
+    return "active"
+
+
+def fallback_narration(state, action: str, outcome: Optional[ActionResult] = None,
+                       world: Optional[WorldSnapshot] = None, reason: str = "deadline") -> str:
+    """Заготовка для хода + события правил (покупки, квесты), чтобы игрок видел, что произошло"""
+    world = world or current_world()
+    key = f"{classify(action, outcome)}/{quest_state(state, world)}"
+    variants = region_pool(world, state.current_region).get(key)
+    text = random.choice(variants) if variants else DEFAULT_NARRATION
+    if outcome is not None and outcome.events:
+        text += "\n\n" + " ".join(outcome.events)
+    _served[reason] = _served.get(reason, 0) + 1
+    return text
+
+
+def fallback_stats() -> Dict[str, int]:
+    """Сколько ходов получили заготовку, по причине: deadline, breaker, unavailable"""
+    return dict(_served)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Собрать заготовки запасного повествования по данным мира")
+    parser.add_argument("root", nargs="?", default=WORLD_DIR)
+    args = parser.parse_args()
+    pool = build_pool(WorldSnapshot.load(args.root))
+    with open(os.path.join(args.root, FALLBACK_POOL), "w", encoding="utf-8") as f:
+        json.dump(pool, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    print(f"{FALLBACK_POOL}: регионов {len(pool['regions'])}, "
+          f"заготовок {sum(len(v) for r in pool['regions'].values() for v in r.values())}")
@@ -1,12 +1,38 @@
 # handlers.py
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message
 from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest
 from keyboard import get_start_keyboard
-from ai_client import get_ai_response
+from admission import Overloaded
+from engine import run_step
 
 router = Router()
 
+START_BUTTON = "⚔️ Начать приключение"
+# Первый ход бота — тот же, что делает игрок, впервые открыв Mini App
+INTRO_ACTION = "осматриваюсь"
+OVERLOADED_TEXT = "⏳ Повествователь перегружен. Попробуй через пару секунд."
+
+
+async def _answer(message: Message, text: str):
+    try:
+        await message.answer(text, parse_mode="Markdown")
+    except TelegramBadRequest:
+        # ИИ мог оставить непарную * или _ — отправляем без разметки
+        await message.answer(text)
+
+
+async def _play(message: Message, action: str):
+    """Ход игрока через общий движок: те же состояние, мир и квесты, что в Mini App"""
+    try:
+        result = await run_step(str(message.from_user.id), action)
+    except Overloaded:
+        await message.answer(OVERLOADED_TEXT)
+        return
+    await _answer(message, result.response)
+
+
 @router.message(Command("start"))
 async def cmd_start(message: Message):
     await message.answer(
@@ -18,15 +44,14 @@ async def cmd_start(message: Message):
         parse_mode="Markdown"
     )
 
-@router.message(F.text == "⚔️ Начать приключение")
+@router.message(F.text == START_BUTTON)
 async def start_adventure(message: Message):
-    # Первое повествование от ИИ
-    intro = await get_ai_response("старт приключения", context="Начало игры")
-    await message.answer(intro, parse_mode="Markdown")
+    # Первое повествование — обычный ход в текущем регионе игрока
+    await _play(message, INTRO_ACTION)
 
-@router.message()
+@router.message(F.text)
 async def handle_user_action(message: Message):
-    # Пользователь описывает действие — отправляем в ИИ
+    # Пользователь описывает действие — тот же ход, что /api/step
     user_action = message.text.strip()
-    response = await get_ai_response(user_action)
-    await message.answer(response, parse_mode="Markdown")
\ No newline at end of file
+    if user_action:
+        await _play(message, user_action)
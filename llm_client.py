@@ -0,0 +1,89 @@
+# llm_client.py
+import os
+import logging
+import importlib.util
+from typing import Optional, Dict
+
+import httpx
+
+# Один долгоживущий клиент на процесс: keep-alive + пул соединений к DeepSeek.
+# Создаётся при старте FastAPI (lifespan в main.py) и закрывается при остановке.
+_client: Optional[httpx.AsyncClient] = None
+
+# Настройки пула (через .env)
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "1") not in ("0", "false", "no")
+
+
+def _http2_available() -> bool:
+    """HTTP/2 в httpx требует пакет h2 (pip install httpx[http2])"""
+    return importlib.util.find_spec("h2") is not None
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Создаёт общий клиент с лимитами пула, keep-alive и (если можно) HTTP/2"""
+    global _client
+    if _client is not None and not _client.is_closed:
+        return _client
+
+    http2 = LLM_HTTP2 and _http2_available()
+    if LLM_HTTP2 and not http2:
+        logging.warning("HTTP/2 для DeepSeek выключен: пакет h2 не установлен")
+
+    _client = httpx.AsyncClient(
+        http2=http2,
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+    )
+    return _client
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Общий клиент. Вне FastAPI (скрипты, бот) создаётся лениво при первом вызове."""
+    if _client is None or _client.is_closed:
+        return create_http_client()
+    return _client
+
+
+def pool_stats() -> Dict[str, object]:
+    """Статистика пула соединений для /health: занятые, простаивающие, ожидающие"""
+    stats: Dict[str, object] = {
+        "open": _client is not None and not _client.is_closed,
+        "http2": False,
+        "max_connections": LLM_MAX_CONNECTIONS,
+        "connections": 0,
+        "in_use": 0,
+        "idle": 0,
+        "waiting": 0,
+    }
+    if not stats["open"]:
+        return stats
+
+    # httpx не отдаёт статистику публично — смотрим в пул httpcore
+    pool = getattr(_client._transport, "_pool", None)
+    if pool is None:
+        return stats
+
+    stats["http2"] = bool(getattr(pool, "_http2", False))
+    connections = list(getattr(pool, "connections", []))
+    idle = sum(1 for c in connections if c.is_idle())
+    stats["connections"] = len(connections)
+    stats["idle"] = idle
+    stats["in_use"] = len(connections) - idle
+    stats["waiting"] = sum(1 for r in getattr(pool, "_requests", []) if r.is_queued())
+    return stats
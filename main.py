@@ -1,55 +1,183 @@
 # main.py
 import os
+import json
+import asyncio
 import logging
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response
-from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 
+# .env грузим ДО импортов модулей, которые читают os.getenv при импорте
+load_dotenv()
+# Логи — тоже до импортов: модули пишут в лог уже при загрузке (мир, фронтенд)
+logging.basicConfig(level=logging.INFO)
+
 # Импорты компонентов мира — ОБЯЗАТЕЛЬНО в таком порядке
-from world import get_region, Region, get_quest_by_id
-from storyteller import get_ai_response, PlayerState
-from state_manager import get_player_state, save_player_state
+from world import current_world, reload_if_changed
+from storyteller import context_cache_stats, response_cache, admission, narration_batcher
+from admission import Overloaded
+from memory import prompt_stats
+from state_manager import session_stats
+from engine import StepResult, breaker, run_step, running_engine, stream_step, summarizer
+from fallback import fallback_stats
+from event_log import event_log
+from bot import WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_URL, create_bot_runner, handle_webhook
+from assets import STATIC_RELOAD_INTERVAL, static_assets
+from utils import BOT_TOKEN, get_user_id, init_data_cache_stats
+from llm_client import pool_stats
+from metrics import registry, StageTimer
 
 # Настройка
-load_dotenv()
-logging.basicConfig(level=logging.INFO)
+# Как часто проверять data/world/index.json на изменения (0 — не следить)
+WORLD_RELOAD_INTERVAL = float(os.getenv("WORLD_RELOAD_INTERVAL", "5"))
+
+# Telegram-бот в этом же event loop (BOT_MODE=webhook) или None — см. bot.py
+bot_runner = create_bot_runner(BOT_TOKEN)
+
+# Заголовок, по которому ход возвращает разбивку времени по этапам (debug.timing + Server-Timing)
+DEBUG_TIMING_HEADER = "X-Debug-Timing"
+
+
+# === МЕТРИКИ (/metrics) ===
+# Состояние кэшей и очередей снимается в момент опроса — на пути запроса только счётчики
+def _cache_counters(stats_fn):
+    def collect():
+        stats = stats_fn()
+        return {"hit": stats["hits"], "miss": stats["misses"]} if stats else None
+    return collect
+
+
+registry.gauge("sessions_active", "Сессии игроков в памяти воркера", lambda: session_stats()["entries"])
+registry.gauge("sessions_dirty", "Состояния, ждущие записи в хранилище", lambda: session_stats()["dirty"])
+registry.gauge("cache_lookups_total", "Обращения к кэшам по результату", lambda: {
+    (name, result): n
+    for name, collect in (
+        ("sessions", _cache_counters(session_stats)),
+        ("init_data", _cache_counters(init_data_cache_stats)),
+        ("player_context", _cache_counters(context_cache_stats)),
+        ("response", _cache_counters(lambda: response_cache.stats() if response_cache is not None else None)),
+    )
+    for result, n in (collect() or {}).items()
+}, ("cache", "result"), kind="counter")
+registry.gauge("llm_slots", "Вызовы LLM: в работе и в очереди",
+               lambda: {k: admission.stats()[k] for k in ("active", "waiting")}, ("state",))
+registry.gauge("llm_admission_total", "Допуск к LLM: пропущено, отбито, не дождались слота, повторы",
+               lambda: {k: admission.stats()[k] for k in ("admitted", "rejected", "timed_out", "retried")},
+               ("result",), kind="counter")
+registry.gauge("llm_breaker_open", "Размыкатель цепи к DeepSeek: 1 — запросы не идут, ходы получают заготовки",
+               lambda: 0 if breaker.state == "closed" else 1)
+registry.gauge("llm_fallbacks_total", "Ходы с запасным повествованием по причине",
+               fallback_stats, ("reason",), kind="counter")
+registry.gauge("llm_pool_connections", "Соединения пула к DeepSeek",
+               lambda: {k: pool_stats()[k] for k in ("in_use", "idle", "waiting")}, ("state",))
+registry.gauge("prompt_tokens", "Размер промпта (оценка) по последним запросам", lambda: {
+    q: prompt_stats.stats()[k] for q, k in (("0.5", "p50"), ("0.99", "p99"), ("1", "max"))
+}, ("quantile",))
+registry.gauge("memory_fold_queue", "Игроки в очереди на свёртку истории", lambda: summarizer.stats()["queued"])
+registry.gauge("memory_folds_total", "Свёртки истории в летопись",
+               lambda: {k: summarizer.stats()[k] for k in ("folded", "fallbacks", "skipped")},
+               ("result",), kind="counter")
+registry.gauge("narration_batches_total", "Микропачки повествователя: запросы, пачки, вызовы upstream", lambda: {
+    k: narration_batcher.stats()[k] for k in ("submitted", "batches", "dispatched", "coalesced")
+} if narration_batcher is not None else None, ("result",), kind="counter")
+registry.gauge("bot_updates_total", "Апдейты бота: приняты, отбиты (очередь полна), обработаны, с ошибкой",
+               lambda: {k: bot_runner.stats()[k] for k in ("received", "rejected", "processed", "failed")}
+               if bot_runner is not None else None, ("result",), kind="counter")
+registry.gauge("event_log_queue", "Записи журнала ходов, ждущие писателя", lambda: event_log.stats()["queued"])
+registry.gauge("event_log_records_total", "Журнал ходов: записано, отброшено (очередь полна), fsync",
+               lambda: {k: event_log.stats()[k] for k in ("written", "dropped", "fsyncs")}, ("result",), kind="counter")
+registry.gauge("static_responses_total", "Ответы фронтенда: с телом и 304 Not Modified",
+               lambda: {"200": static_assets.served, "304": static_assets.not_modified}, ("status",), kind="counter")
+registry.gauge("world_version", "Версия снимка мира", lambda: current_world().version)
 
-app = FastAPI(title="Fantasy Adventure Mini App")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+
+async def _watch(reload_fn, interval: float, what: str):
+    """Горячая перезагрузка: новый снимок подменяет старый между запросами"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(reload_fn)
+        except Exception as e:
+            logging.error(f"{what} не перезагружен, остаёмся на старом снимке: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 🔌 HTTP-клиент к DeepSeek, 💾 хранилище состояний, свёртка памяти
+    async with running_engine():
+        # 🌍 Слежение за файлами мира и фронтенда
+        watchers = [asyncio.create_task(_watch(fn, interval, what)) for fn, interval, what in (
+            (reload_if_changed, WORLD_RELOAD_INTERVAL, "Мир"),
+            (static_assets.refresh_if_changed, STATIC_RELOAD_INTERVAL, "Фронтенд"),
+        ) if interval > 0]
+        # 🤖 Бот — после движка, останавливается раньше него: дорабатывает принятые апдейты
+        if bot_runner is not None:
+            await bot_runner.start(WEBHOOK_URL, WEBHOOK_SECRET)
+        try:
+            yield
+        finally:
+            if bot_runner is not None:
+                await bot_runner.stop()
+            for watcher in watchers:
+                watcher.cancel()
+
+
+app = FastAPI(title="Fantasy Adventure Mini App", lifespan=lifespan)
 
 # === ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ===
 
-def _handle_purchase(state: PlayerState, action: str):
-    """Обрабатывает покупки в Ебеньграде (триггеры квестов)"""
-    low = action.lower()
-    if "бутер" in low and ("куп" in low or "заказ" in low or "возьм" in low):
-        state.inventory["Бутерброд"] = state.inventory.get("Бутерброд", 0) + 1
-        return True
-    if "кофе" in low and ("куп" in low or "заказ" in low or "возьм" in low):
-        state.inventory["Кофе"] = state.inventory.get("Кофе", 0) + 1
-        return True
-    return False
-
-def _check_quest_triggers(state: PlayerState):
-    """Проверяет, активировать ли квест 'Убить Рыжую ведьму'"""
-    if "kill_ryzhaya_witch" in state.active_quests:
-        return  # уже активен
-
-    # Триггер: 2 бутера + 1 кофе
-    if state.inventory.get("Бутерброд", 0) >= 2 and state.inventory.get("Кофе", 0) >= 1:
-        state.active_quests.append("kill_ryzhaya_witch")
-        logging.info(f"Квест активирован для игрока в {state.current_region}")
+def _overloaded_response(e: Overloaded) -> JSONResponse:
+    return JSONResponse(
+        {"ok": False, "error": "⏳ Повествователь перегружен. Попробуй через пару секунд."},
+        status_code=503,
+        headers={"Retry-After": str(max(1, round(e.retry_after)))}
+    )
+
+
+def _resolve_user_id(init_data: str) -> str:
+    """ID игрока из проверенного initData. Без TELEGRAM_BOT_TOKEN — демо-режим с одним игроком."""
+    if not BOT_TOKEN:
+        return "test_user"
+    return get_user_id(init_data)
 
-# === ЭНДПОИНТЫ ===
 
-@app.get("/", response_class=HTMLResponse)
-async def home():
+async def _read_body(request: Request) -> Optional[dict]:
+    """Тело запроса хода; None — не JSON-объект (ответим 400, а не 500)"""
     try:
-        with open("static/index.html", "r", encoding="utf-8") as f:
-            return f.read()
-    except FileNotFoundError:
-        return "<h1>❌ static/index.html не найден</h1><p>Проверьте структуру проекта в Render → Files</p>"
+        data = await request.json()
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _timing_response(payload: dict, timer: StageTimer, profile: bool) -> JSONResponse:
+    """Ответ хода; по заголовку X-Debug-Timing — с разбивкой по этапам"""
+    if not profile:
+        return JSONResponse(payload)
+    payload.setdefault("debug", {})["timing"] = timer.breakdown()
+    return JSONResponse(payload, headers={"Server-Timing": timer.server_timing()})
+
+
+def _sse(event: str, data: dict) -> str:
+    """Одно событие Server-Sent Events (данные — JSON, чтобы переносы строк не ломали формат)"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+# === ЭНДПОИНТЫ ===
+
+@app.get("/")
+async def home(request: Request):
+    # index.html из памяти: ссылки на ассеты с хэшем, ETag → 304 при повторном заходе
+    response = static_assets.serve_index(request)
+    if response is None:
+        return HTMLResponse("<h1>❌ static/index.html не найден</h1><p>Проверьте структуру проекта в Render → Files</p>")
+    return response
+
+@app.get("/static/{path:path}")
+async def static_file(path: str, request: Request):
+    return static_assets.serve(path, request)
 
 @app.get("/app")
 async def redirect_app():
@@ -62,71 +190,127 @@ async def favicon():
         media_type="image/x-icon"
     )
 
+@app.get("/metrics")
+async def metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 async def health():
+    world = current_world()
     return {
         "status": "ok",
         "deepseek_configured": bool(os.getenv("DEEPSEEK_API_KEY")),
-        "regions_loaded": len([r for r in [get_region("Ебеньград"), get_region("Логово Рыжей")] if r])
+        "regions_loaded": world.region_count,
+        "world_version": world.version,
+        "llm_pool": pool_stats(),
+        "sessions": session_stats(),
+        "response_cache": response_cache.stats() if response_cache is not None else None,
+        "llm_admission": admission.stats(),
+        "llm_breaker": breaker.stats(),
+        "fallbacks": fallback_stats(),
+        "prompt_tokens": prompt_stats.stats(),
+        "memory": summarizer.stats(),
+        "narration_batching": narration_batcher.stats() if narration_batcher is not None else None,
+        "bot": bot_runner.stats() if bot_runner is not None else None,
+        "static": static_assets.stats(),
+        "event_log": event_log.stats()
     }
 
+@app.post(WEBHOOK_PATH)
+async def telegram_webhook(request: Request):
+    """Апдейты Telegram: подтверждаем сразу, ход идёт в пуле бота"""
+    if bot_runner is None:
+        return Response(status_code=404)
+    return await handle_webhook(bot_runner, request)
+
 @app.post("/api/step")
 async def adventure_step(request: Request):
+    timer = StageTimer("step")
+    profile = request.headers.get(DEBUG_TIMING_HEADER) == "1"
     try:
-        data = await request.json()
+        # 1️⃣ Разбор запроса
+        data = await _read_body(request)
+        if data is None:
+            timer.finish("bad_request")
+            return JSONResponse({"ok": False, "error": "invalid JSON body"}, status_code=400)
         init_data = data.get("initData", "")
         user_action = data.get("action", "").strip()
 
-        # 🔐 Валидация (минимальная — для Mini App можно и без неё на старте)
-        user_id = "test_user"  # ← для демо. В продакшене — из initData
+        # 🔐 Валидация initData → настоящий ID игрока Telegram
+        try:
+            user_id = _resolve_user_id(init_data)
+        except ValueError as e:
+            timer.finish("unauthorized")
+            return JSONResponse({"ok": False, "error": str(e)}, status_code=401)
         if not user_action:
-            raise HTTPException(status_code=400, detail="action required")
-
-        # 🧩 Получаем состояние игрока
-        state = get_player_state(user_id)
+            timer.finish("bad_request")
+            return JSONResponse({"ok": False, "error": "action required"}, status_code=400)
 
-        # 🛒 Обработка покупок (только в Ебеньграде)
-        if state.current_region == "Ебеньград":
-            _handle_purchase(state, user_action)
-            _check_quest_triggers(state)
+        # 2️⃣ Ход: состояние → правила мира → повествователь → память (engine.run_step)
+        result = await run_step(user_id, user_action, timer)
+        payload = {
+            "ok": True,
+            "user_id": user_id,
+            "response": result.response,
+            "debug": result.debug()
+        }
+        timer.finish(result.status)
+        return _timing_response(payload, timer, profile)
 
-        events = []  # ← новые события для ИИ
+    except Overloaded as e:
+        timer.finish("overloaded")
+        return _overloaded_response(e)
+    except Exception as e:
+        timer.finish("error")
+        logging.error(f"Ошибка в /api/step: {e}", exc_info=True)
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
 
-        if state.current_region == "Ебеньград":
-            if _handle_purchase(state, user_action):
-                # Определим, что именно куплено
-                if "бутер" in user_action.lower():
-                    events.append("Игрок купил бутерброд у Сани в таверне.")
-                if "кофе" in user_action.lower():
-                    events.append("Игрок заказал кофе у Сани.")
-            _check_quest_triggers(state)
 
-        # Передайте события в get_ai_response
-        ai_response = await get_ai_response(state, user_action, events=events)
+@app.post("/api/step/stream")
+async def adventure_step_stream(request: Request):
+    """То же, что /api/step, но ответ повествователя идёт потоком (SSE) по мере генерации"""
+    data = await _read_body(request)
+    if data is None:
+        return JSONResponse({"ok": False, "error": "invalid JSON body"}, status_code=400)
+    user_action = data.get("action", "").strip()
 
-        # 🧭 Простейшая навигация (для демо)
-        if "логово" in user_action.lower() and "едь" in user_action.lower():
-            state.current_region = "Логово Рыжей"
-        elif "город" in user_action.lower() or "назад" in user_action.lower():
-            state.current_region = "Ебеньград"
+    try:
+        user_id = _resolve_user_id(data.get("initData", ""))
+    except ValueError as e:
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=401)
+    if not user_action:
+        return JSONResponse({"ok": False, "error": "action required"}, status_code=400)
+    if admission.saturated():
+        return _overloaded_response(Overloaded("LLM queue is full"))
 
-        # 💾 Сохраняем
-        save_player_state(user_id, state)
+    timer = StageTimer("stream")
+    profile = request.headers.get(DEBUG_TIMING_HEADER) == "1"
 
-        # 🧠 Генерация ответа ИИ
-        ai_response = await get_ai_response(state, user_action)
+    async def event_stream():
+        status = "disconnected"  # клиент ушёл до конца хода
+        try:
+            result = StepResult()
+            async for chunk in stream_step(user_id, user_action, result, timer):
+                yield _sse("token", {"text": chunk})
+            status = result.status
+            debug = result.debug()
+            if profile:
+                debug["timing"] = timer.breakdown()
+            yield _sse("done", {"ok": True, "user_id": user_id, "debug": debug})
+        except Overloaded:
+            status = "overloaded"
+            yield _sse("error", {"ok": False, "status": 503,
+                                 "error": "⏳ Повествователь перегружен. Попробуй через пару секунд."})
+        except Exception as e:
+            status = "error"
+            logging.error(f"Ошибка в /api/step/stream: {e}", exc_info=True)
+            yield _sse("error", {"ok": False, "error": str(e)})
+        finally:
+            timer.finish(status)
 
-        return JSONResponse({
-            "ok": True,
-            "user_id": user_id,
-            "response": ai_response,
-            "debug": {
-                "region": state.current_region,
-                "inventory": state.inventory,
-                "quests": state.active_quests
-            }
-        })
-
-    except Exception as e:
-        logging.error(f"Ошибка в /api/step: {e}", exc_info=True)
-        return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
\ No newline at end of file
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,207 @@
+# memory.py
+import os
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncContextManager, Awaitable, Callable, Dict, List, Optional, Set
+
+# Память повествователя (через .env)
+MEMORY_VERBATIM_TURNS = int(os.getenv("MEMORY_VERBATIM_TURNS", "6"))     # последние ходы — дословно
+MEMORY_MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", "32"))              # потолок буфера ходов в состоянии
+MEMORY_FOLD_BATCH = int(os.getenv("MEMORY_FOLD_BATCH", "4"))             # сворачиваем пачками, не по ходу
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1200"))      # токенов на всю историю в промпте
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "300"))   # токенов на летопись
+MEMORY_TURN_CHARS = int(os.getenv("MEMORY_TURN_CHARS", "600"))           # ответ в буфере обрезается
+
+# Токенайзера DeepSeek под рукой нет: для русского текста ~3 символа на токен
+CHARS_PER_TOKEN = 3
+MESSAGE_OVERHEAD_TOKENS = 4  # служебные токены роли/разметки на сообщение
+
+Turn = List[str]  # [действие игрока, ответ повествователя] — два поля, без обёрток
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def count_prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(estimate_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def trim_to_tokens(text: str, tokens: int) -> str:
+    """Оставляет конец текста: в летописи свежие события важнее старых"""
+    limit = tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text[-limit:]
+    space = cut.find(" ")
+    return "…" + (cut[space + 1:] if 0 <= space < 40 else cut)
+
+
+def fold_locally(summary: str, turns: List[Turn]) -> str:
+    """Свёртка без LLM: в летопись уходят сами действия игрока (запасной путь и вытеснение)"""
+    actions = "; ".join(action[:80] for action, _ in turns)
+    folded = f"{summary} Игрок: {actions}." if summary else f"Игрок: {actions}."
+    return trim_to_tokens(folded, MEMORY_SUMMARY_TOKENS)
+
+
+def remember_turn(state, action: str, response: str):
+    """
+    Ход → кольцевой буфер state.history. Если фоновая свёртка не успевает и буфер
+    полон, самые старые ходы сворачиваются в летопись сразу, без LLM.
+    """
+    state.history.append([action, response[:MEMORY_TURN_CHARS]])
+    overflow = len(state.history) - MEMORY_MAX_TURNS
+    if overflow > 0:
+        dropped = state.history[:overflow]
+        del state.history[:overflow]
+        state.summary = fold_locally(state.summary, dropped)
+
+
+def history_messages(state, budget: int = MEMORY_TOKEN_BUDGET,
+                     verbatim: int = MEMORY_VERBATIM_TURNS) -> List[Dict[str, str]]:
+    """
+    История для промпта в пределах бюджета: летопись + последние ходы дословно
+    (от свежих к старым, пока влезают). Размер не зависит от длины сессии.
+    """
+    messages: List[Dict[str, str]] = []
+    used = 0
+    if state.summary:
+        summary = "=== ЛЕТОПИСЬ ===\n" + trim_to_tokens(state.summary, min(MEMORY_SUMMARY_TOKENS, budget // 3))
+        used = estimate_tokens(summary) + MESSAGE_OVERHEAD_TOKENS
+        messages.append({"role": "system", "content": summary})
+
+    recent: List[Dict[str, str]] = []
+    for action, response in reversed(state.history[-verbatim:] if verbatim else []):
+        cost = estimate_tokens(action) + estimate_tokens(response) + 2 * MESSAGE_OVERHEAD_TOKENS
+        if used + cost > budget:
+            break
+        used += cost
+        recent.append({"role": "assistant", "content": response})
+        recent.append({"role": "user", "content": f"Действие игрока: {action}"})
+    recent.reverse()
+    return messages + recent
+
+
+class PromptStats:
+    """Размер промптов (оценка в токенах) по последним запросам"""
+
+    def __init__(self, window: int = 1000):
+        self._sizes = deque(maxlen=window)
+        self.requests = 0
+
+    def record(self, tokens: int):
+        self._sizes.append(tokens)
+        self.requests += 1
+
+    def stats(self) -> Dict[str, object]:
+        sizes = sorted(self._sizes)
+        if not sizes:
+            return {"requests": 0, "p50": 0, "p99": 0, "max": 0}
+        return {
+            "requests": self.requests,
+            "p50": sizes[len(sizes) // 2],
+            "p99": sizes[min(len(sizes) - 1, int(len(sizes) * 0.99))],
+            "max": sizes[-1],
+        }
+
+
+prompt_stats = PromptStats()
+
+
+class Summarizer:
+    """
+    Фоновая свёртка старых ходов в летопись: ход игрока только ставит его в очередь,
+    LLM вызывается вне блокировки игрока и вне пути запроса. Если за время вызова
+    буфер изменился (вытеснение), результат отбрасывается — свернём в следующий раз.
+    """
+
+    def __init__(
+        self,
+        summarize: Callable[[str, List[Turn]], Awaitable[str]],
+        session: Callable[[str], AsyncContextManager],
+        verbatim: int = MEMORY_VERBATIM_TURNS,
+        batch: int = MEMORY_FOLD_BATCH,
+        max_queue: int = 10000,
+        on_fold: Optional[Callable[[str, dict, Any], None]] = None,
+    ):
+        self.summarize = summarize
+        self.session = session
+        # (user_id, состояние до свёртки — model_dump(), состояние после) — для журнала ходов
+        self.on_fold = on_fold
+        self.verbatim = verbatim
+        self.batch = max(1, batch)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._queued: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+        self.folded = 0
+        self.fallbacks = 0
+        self.skipped = 0
+
+    def needs_fold(self, state) -> bool:
+        return len(state.history) >= self.verbatim + self.batch
+
+    def schedule(self, user_id: str, state):
+        if user_id in self._queued or not self.needs_fold(state):
+            return
+        try:
+            self._queue.put_nowait(user_id)
+        except asyncio.QueueFull:
+            return  # не успеваем — буфер упрётся в потолок и свернётся локально
+        self._queued.add(user_id)
+
+    async def fold(self, user_id: str):
+        async with self.session(user_id) as state:
+            if not self.needs_fold(state):
+                return
+            turns = [list(t) for t in state.history[:-self.verbatim or None]]
+            summary = state.summary
+
+        try:
+            new_summary = trim_to_tokens(await self.summarize(summary, turns), MEMORY_SUMMARY_TOKENS)
+        except Exception as e:
+            logging.warning(f"Летопись для {user_id} свёрнута без LLM: {e}")
+            self.fallbacks += 1
+            new_summary = fold_locally(summary, turns)
+
+        async with self.session(user_id) as state:
+            if state.summary != summary or state.history[:len(turns)] != turns:
+                self.skipped += 1
+                return
+            before = state.model_dump() if self.on_fold is not None else None
+            del state.history[:len(turns)]
+            state.summary = new_summary
+            self.folded += 1
+            if self.on_fold is not None:
+                self.on_fold(user_id, before, state)
+
+    async def _worker(self):
+        while True:
+            user_id = await self._queue.get()
+            self._queued.discard(user_id)
+            try:
+                await self.fold(user_id)
+            except Exception as e:
+                logging.error(f"Ошибка свёртки истории {user_id}: {e}", exc_info=True)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "queued": self._queue.qsize(),
+            "folded": self.folded,
+            "fallbacks": self.fallbacks,
+            "skipped": self.skipped,
+        }
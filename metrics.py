@@ -0,0 +1,204 @@
+# metrics.py
+import time
+import bisect
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Метрики в текстовом формате Prometheus — без prometheus_client и внешних сервисов.
+# Всё считается в одном процессе; при нескольких воркерах каждый отдаёт свои.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        key = tuple(str(v) for v in labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(tuple(str(v) for v in labels), 0)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(v)}" for key, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    """
+    Значение снимается в момент запроса /metrics: fn() → число или {метки: число}.
+    kind="counter" — для накопительных счётчиков, которые уже ведёт чужой код (кэши, очереди).
+    """
+
+    def __init__(self, name: str, help: str, fn: Callable[[], object], labelnames: Sequence[str] = (),
+                 kind: str = "gauge"):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        value = self.fn()
+        if value is None:
+            return []
+        if isinstance(value, dict):
+            return [f"{self.name}{_labels(self.labelnames, key if isinstance(key, tuple) else (key,))} {_number(v)}"
+                    for key, v in value.items()]
+        return [f"{self.name} {_number(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки → (счётчики по корзинам, сумма, количество)
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, *labels: str):
+        key = tuple(str(v) for v in labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, fn: Callable[[], object], labelnames: Sequence[str] = (),
+              kind: str = "gauge") -> Gauge:
+        return self.register(Gauge(name, help, fn, labelnames, kind))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            body = metric.render()
+            if body:
+                lines += metric.header() + body
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# === МЕТРИКИ ПУТИ ЗАПРОСА ===
+STAGE_SECONDS = registry.histogram(
+    "adventure_stage_seconds", "Время этапов хода игрока", ("endpoint", "stage"))
+REQUESTS = registry.counter(
+    "adventure_requests_total", "Ходы игроков по результату", ("endpoint", "status"))
+LLM_RESPONSES = registry.counter(
+    "llm_responses_total", "Ответы DeepSeek по HTTP-статусу (error — ответа не было)", ("kind", "status"))
+LLM_TOKENS = registry.counter(
+    "llm_tokens_total", "Токены из поля usage ответов DeepSeek", ("kind", "type"))
+
+
+def record_llm_usage(kind: str, usage: Optional[dict]):
+    """usage из ответа DeepSeek: prompt/completion + попадания в кэш префиксов"""
+    if not usage:
+        return
+    for field, type_ in (("prompt_tokens", "prompt"), ("completion_tokens", "completion"),
+                         ("prompt_cache_hit_tokens", "prompt_cache_hit"),
+                         ("prompt_cache_miss_tokens", "prompt_cache_miss")):
+        if usage.get(field):
+            LLM_TOKENS.inc(kind, type_, amount=usage[field])
+
+
+class StageTimer:
+    """
+    Разбивка одного хода по этапам. Всегда пишет в гистограмму; разбивку
+    можно вернуть клиенту (заголовок X-Debug-Timing) — профилирование под нагрузкой.
+    """
+
+    __slots__ = ("endpoint", "stages", "_started")
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.stages: Dict[str, float] = {}
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, self.endpoint, name)
+
+    def finish(self, status: str = "ok"):
+        self.record("total", time.perf_counter() - self._started)
+        REQUESTS.inc(self.endpoint, status)
+
+    def breakdown(self) -> Dict[str, float]:
+        """Этапы в миллисекундах"""
+        return {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()}
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.breakdown().items())
@@ -0,0 +1,139 @@
+# response_cache.py
+import re
+import time
+import random
+import asyncio
+import hashlib
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from session_cache import SessionCache
+
+_SPACES = re.compile(r"\s+")
+_EDGE_PUNCT = re.compile(r"^[\s.,!?…;:«»\"'-]+|[\s.,!?…;:«»\"'-]+$")
+
+
+def normalize_action(action: str) -> str:
+    """«  Осмотреться!!» и «осмотреться» — одно и то же действие"""
+    action = _EDGE_PUNCT.sub("", action.lower().replace("ё", "е"))
+    return _SPACES.sub(" ", action)
+
+
+class _Entry:
+    __slots__ = ("variants", "fetches", "created", "latency")
+
+    def __init__(self, now: float):
+        self.variants: List[str] = []
+        self.fetches = 0    # сколько раз ходили в upstream (повторы тоже считаются)
+        self.created = now
+        self.latency = 0.0  # суммарная задержка этих вызовов
+
+    def avg_latency(self) -> float:
+        return self.latency / self.fetches if self.fetches else 0.0
+
+
+class _Inflight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class ResponseCache:
+    """
+    Кэш ответов повествователя для одинаковых запросов (контекст + действие + события).
+
+    Первые `variants` запросов по ключу идут в upstream и копят разные ответы,
+    дальше отдаётся случайный из накопленных (сохраняем разнообразие).
+    Одновременные промахи по одному ключу склеиваются в один вызов (single-flight).
+    Вызов принадлежит кэшу, а не первому запросу: кто перестал ждать (дедлайн хода,
+    разрыв), уходит сам, а вызов отменяется, только когда не ждёт никто.
+    """
+
+    def __init__(self, variants: int = 3, ttl: float = 600, max_keys: int = 10000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.variants = max(1, variants)
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = SessionCache(max_entries=max_keys)
+        self._inflight: Dict[str, _Inflight] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.saved_latency = 0.0
+
+    @staticmethod
+    def fingerprint(context: str, action: str, events: Optional[list] = None) -> str:
+        raw = "\x1f".join([context, normalize_action(action), *(events or [])])
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def _entry(self, key: str) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is not None and self.clock() - entry.created > self.ttl:
+            self._entries.pop(key)
+            return None
+        return entry
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[str]]) -> str:
+        entry = self._entry(key)
+        if entry is not None and entry.fetches >= self.variants:
+            self.hits += 1
+            self.saved_latency += entry.avg_latency()
+            return random.choice(entry.variants)
+
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            self.misses += 1
+            inflight = self._inflight[key] = _Inflight(asyncio.ensure_future(self._fetch(key, fetch)))
+            coalesced = False
+        else:
+            self.coalesced += 1
+            coalesced = True
+        started = self.clock()
+        inflight.waiters += 1
+        try:
+            result = await asyncio.shield(inflight.task)
+        finally:
+            inflight.waiters -= 1
+            if inflight.waiters == 0 and not inflight.task.done():
+                # ждать больше некому — слот допуска и соединение освобождаются
+                if self._inflight.get(key) is inflight:
+                    del self._inflight[key]
+                inflight.task.cancel()
+        if coalesced:
+            # сэкономили бы полный вызов; ждали только его остаток
+            entry = self._entries.peek(key)
+            if entry is not None:
+                self.saved_latency += max(0.0, entry.avg_latency() - (self.clock() - started))
+        return result
+
+    async def _fetch(self, key: str, fetch: Callable[[], Awaitable[str]]) -> str:
+        # ошибки не кэшируем; ждущие получают ту же ошибку через задачу
+        started = self.clock()
+        try:
+            result = await fetch()
+        finally:
+            inflight = self._inflight.get(key)
+            if inflight is not None and inflight.task is asyncio.current_task():
+                del self._inflight[key]
+        entry = self._entry(key)
+        if entry is None:
+            entry = _Entry(self.clock())
+            self._entries.set(key, entry)
+        if result not in entry.variants:
+            entry.variants.append(result)
+        entry.fetches += 1
+        entry.latency += self.clock() - started
+        return result
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "keys": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+            "saved_latency_seconds": round(self.saved_latency, 3),
+        }
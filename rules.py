@@ -0,0 +1,207 @@
+# rules.py
+import logging
+from collections import deque
+from typing import TYPE_CHECKING, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from world import Item, current_world
+
+if TYPE_CHECKING:
+    from storyteller import PlayerState
+
+# Глаголы покупки (основы). Предмет покупается, только если в действии есть и он, и глагол.
+PURCHASE_VERBS = ["куп", "заказ", "закаж", "возьм"]
+
+Condition = Callable[["PlayerState"], bool]
+
+
+def normalize(text: str) -> str:
+    return text.lower().replace("ё", "е")
+
+
+class KeywordIndex:
+    """
+    Автомат Ахо–Корасик по основам слов: один проход по тексту находит все
+    вхождения всех ключей. Стоимость поиска зависит от длины действия,
+    а не от числа предметов, NPC и квестов в мире.
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Hashable]] = [[]]
+        self._built = True
+
+    def add(self, keyword: str, payload: Hashable):
+        node = 0
+        for ch in normalize(keyword):
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append(payload)
+        self._built = False
+
+    def build(self):
+        """Ссылки неудач (BFS); выходы узла дополняются выходами его суффиксов"""
+        queue = deque(self._goto[0].values())
+        for node in queue:
+            self._fail[node] = 0
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        self._built = True
+
+    def find(self, text: str) -> Set[Hashable]:
+        """Все payload, чьи ключи встречаются в уже нормализованном тексте"""
+        if not self._built:
+            self.build()
+        goto, fail, out = self._goto, self._fail, self._out
+        found: Set[Hashable] = set()
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+
+def compile_condition(spec: Optional[Dict]) -> Condition:
+    """
+    Условие квеста из данных мира → предикат над PlayerState.
+    Ключи: items {предмет: минимум}, killed [враги], quests [активные квесты], region.
+    """
+    spec = spec or {}
+    unknown = set(spec) - {"items", "killed", "quests", "region"}
+    if unknown:
+        raise ValueError(f"Неизвестные ключи условия: {', '.join(sorted(unknown))}")
+
+    checks: List[Condition] = []
+    if spec.get("items"):
+        items = tuple(spec["items"].items())
+        checks.append(lambda s: all(s.inventory.get(name, 0) >= need for name, need in items))
+    if spec.get("killed"):
+        killed = frozenset(spec["killed"])
+        checks.append(lambda s: killed.issubset(s.killed_enemies))
+    if spec.get("quests"):
+        quests = frozenset(spec["quests"])
+        checks.append(lambda s: quests.issubset(s.active_quests))
+    if spec.get("region"):
+        region = spec["region"]
+        checks.append(lambda s: s.current_region == region)
+
+    if len(checks) == 1:
+        return checks[0]
+    return lambda s: all(check(s) for check in checks)
+
+
+class ActionResult:
+    __slots__ = ("events", "purchased", "moved_to", "activated_quests")
+
+    def __init__(self):
+        self.events: List[str] = []
+        self.purchased: List[str] = []
+        self.moved_to: Optional[str] = None
+        self.activated_quests: List[str] = []
+
+
+class RegionRules:
+    """
+    Правила одного региона: его лавка, квесты и выходы. Собираются при первом
+    ходе в регионе и живут в снимке мира — большой мир не компилируется целиком.
+    """
+
+    def __init__(self, world, name: str):
+        region = world.get_region(name)
+        self.name = name
+        self.exits: Tuple[str, ...] = world.exits(name)
+        self.shop: Tuple[Item, ...] = region.shop if region else ()
+        self.quests: List[Tuple[str, Condition]] = [
+            (q.id, compile_condition(q.trigger_condition)) for q in (region.quests if region else ())
+        ]
+        self.travel_groups: Dict[Tuple[str, int], int] = {}  # (цель, вариант) → сколько основ нужно
+        self.index = KeywordIndex()
+
+        for verb in PURCHASE_VERBS:
+            self.index.add(verb, ("verb",))
+        for pos, item in enumerate(self.shop):
+            for stem in item.stems:
+                self.index.add(stem, ("item", pos))
+        for target in self.exits:
+            target_region = world.get_region(target)
+            if target_region is None:
+                continue
+            for i, group in enumerate(target_region.travel_keywords):
+                self.travel_groups[(target, i)] = len(set(group))
+                for stem in set(group):
+                    self.index.add(stem, ("travel", target, i, stem))
+        self.index.build()
+
+
+class ActionEngine:
+    """Покупки, триггеры квестов и навигация по данным мира — без ad-hoc проверок подстрок"""
+
+    def __init__(self, world):
+        self.world = world
+
+    def rules(self, region: str) -> RegionRules:
+        return self.world.derived(("rules", region), lambda: RegionRules(self.world, region))
+
+    def apply(self, state, action: str) -> ActionResult:
+        """Применяет действие к состоянию на месте и возвращает, что произошло"""
+        result = ActionResult()
+        region = state.current_region
+        rules = self.rules(region)
+        hits = rules.index.find(normalize(action))
+
+        wants_to_buy = ("verb",) in hits
+        items: List[int] = []
+        travel: Dict[Tuple[str, int], int] = {}
+        for hit in hits:
+            if hit[0] == "item":
+                items.append(hit[1])
+            elif hit[0] == "travel":
+                travel[(hit[1], hit[2])] = travel.get((hit[1], hit[2]), 0) + 1
+
+        # 🛒 Покупки (в регионе, где предмет продаётся)
+        if wants_to_buy:
+            for pos in sorted(items):
+                item = rules.shop[pos]
+                state.inventory[item.name] = state.inventory.get(item.name, 0) + 1
+                result.purchased.append(item.name)
+                result.events.append(item.event)
+
+        # 📜 Триггеры квестов региона
+        for quest_id, condition in rules.quests:
+            if quest_id not in state.active_quests and condition(state):
+                state.active_quests.append(quest_id)
+                result.activated_quests.append(quest_id)
+                logging.info(f"Квест {quest_id} активирован для игрока в {region}")
+
+        # 🧭 Навигация — только по выходам текущего региона
+        reached = {t for (t, i), count in travel.items() if count == rules.travel_groups[(t, i)]}
+        if reached:
+            for target in rules.exits:  # порядок выходов решает, если подошло несколько
+                if target in reached:
+                    state.current_region = target
+                    result.moved_to = target
+                    break
+
+        return result
+
+
+def get_engine(world=None) -> ActionEngine:
+    """Движок правил поверх снимка мира (по умолчанию — текущего)"""
+    world = world or current_world()
+    return world.derived(("engine",), lambda: ActionEngine(world))
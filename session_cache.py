@@ -0,0 +1,137 @@
+# session_cache.py
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class SessionCache:
+    """
+    Ограниченный кэш сессий: LRU-вытеснение, TTL простоя и лимит по числу
+    записей и/или примерному объёму в байтах.
+
+    Порядок OrderedDict — порядок последнего обращения, поэтому и самые
+    давно не используемые, и просроченные записи всегда лежат в начале.
+    on_evict(key, value, reason) вызывается для каждой вытесненной записи
+    (reason: "lru", "bytes" или "ttl") — например, чтобы дописать её в хранилище.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        sizeof: Optional[Callable[[Any], int]] = None,
+        on_evict: Optional[Callable[[Hashable, Any, str], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries or None
+        self.max_bytes = max_bytes or None
+        self.ttl = ttl or None
+        self.sizeof = sizeof or (lambda value: 0)
+        self.on_evict = on_evict
+        self.clock = clock
+
+        # key -> [value, last_access, size]
+        self._entries: "OrderedDict[Hashable, list]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        now = self.clock()
+        if self.ttl is not None and now - entry[1] > self.ttl:
+            self._remove(key, "ttl")
+            self.misses += 1
+            return None
+        entry[1] = now
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def peek(self, key: Hashable) -> Any:
+        """Значение без обновления LRU-порядка и счётчиков"""
+        entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def set(self, key: Hashable, value: Any):
+        size = self.sizeof(value)
+        old = self._entries.get(key)
+        if old is not None:
+            self.bytes -= old[2]
+            old[0], old[1], old[2] = value, self.clock(), size
+            self._entries.move_to_end(key)
+        else:
+            self._entries[key] = [value, self.clock(), size]
+        self.bytes += size
+        self._shrink(protect=key)
+
+    def pop(self, key: Hashable) -> Any:
+        """Удаляет запись без вызова on_evict"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self.bytes -= entry[2]
+        return entry[0]
+
+    def expire(self) -> int:
+        """Вытесняет все записи, простоявшие дольше TTL (дёшево: они в начале)"""
+        if self.ttl is None:
+            return 0
+        deadline = self.clock() - self.ttl
+        expired = 0
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry[1] > deadline:
+                break
+            self._remove(key, "ttl")
+            expired += 1
+        return expired
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _shrink(self, protect: Hashable):
+        while self.max_entries is not None and len(self._entries) > self.max_entries:
+            if not self._evict_oldest("lru", protect):
+                break
+        while self.max_bytes is not None and self.bytes > self.max_bytes:
+            if not self._evict_oldest("bytes", protect):
+                break
+
+    def _evict_oldest(self, reason: str, protect: Hashable) -> bool:
+        for key in self._entries:
+            if key != protect:
+                self._remove(key, reason)
+                return True
+        return False
+
+    def _remove(self, key: Hashable, reason: str):
+        value, _, size = self._entries.pop(key)
+        self.bytes -= size
+        if reason == "ttl":
+            self.expirations += 1
+        else:
+            self.evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(key, value, reason)
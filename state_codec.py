@@ -0,0 +1,414 @@
+# state_codec.py
+import json
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from storyteller import PlayerState
+from world import WorldSnapshot, current_world
+
+# Бинарный формат PlayerState: заголовок (магия, версия схемы, вид записи, длина
+# таблицы символов) + поля подряд, числа — varint, ходы памяти — одним компактным
+# JSON-текстом. Имена регионов, предметов, врагов и id квестов пишутся номером из
+# таблицы символов мира (world.symbols); чего там нет — строкой. Таблица только
+# дописывается, поэтому номера меньше длины из заголовка значат то же, что при записи;
+# запись от более длинной таблицы (мир пересобран без прежней таблицы) не читается.
+#
+# Запись — снимок или дельта к предыдущему состоянию: ход, который поменял один
+# счётчик в инвентаре, пишет пару байт вместо всего состояния. Хранилище держит
+# снимок + цепочку дельт (state_manager), чтение проигрывает их по порядку.
+#
+# Старые записи (JSON от pydantic — версия 0) читаются и поднимаются миграциями
+# до текущей версии; перезаписываются в новом формате при следующем сохранении.
+#
+# Выигрыш — в байтах, не в процессоре. Снимок кодек пишет и читает на Python, и это
+# медленнее JSON pydantic (Rust): encode в 2–4 раза, decode — от паритета до ~3 раз
+# на инвентаре из десятков предметов (benchmarks/bench_state_codec.py). Дельта хода
+# по времени примерно равна повторной сериализации всего состояния в JSON, а по
+# объёму — десяток байт вместо килобайт: это и экономит запись в хранилище и журнал.
+
+MAGIC = b"\xa7P"
+SCHEMA_VERSION = 2
+SNAPSHOT = 0
+DELTA = 1
+
+Record = Union[bytes, str]
+
+# json.dumps с параметрами собирает новый JSONEncoder на каждый вызов
+_TURNS_JSON = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+# Порядок полей в снимке и биты маски изменённых полей в дельте
+FIELDS = ("current_region", "inventory", "killed_enemies", "active_quests", "history", "summary")
+
+
+# ====== VARINT ======
+def _put_uint(out: bytearray, n: int):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _put_int(out: bytearray, n: int):
+    # zigzag: маленькие отрицательные тоже в один байт
+    _put_uint(out, (n << 1) if n >= 0 else ((-n << 1) - 1))
+
+
+class _Reader:
+    __slots__ = ("buf", "pos", "symbols", "limit")
+
+    def __init__(self, buf: bytes, pos: int, symbols: Sequence[str], limit: Optional[int] = None):
+        self.buf = buf
+        self.pos = pos
+        self.symbols = symbols
+        self.limit = len(symbols) if limit is None else limit  # длина таблицы на момент записи
+
+    def uint(self) -> int:
+        buf, pos = self.buf, self.pos
+        byte = buf[pos]
+        pos += 1
+        if byte < 0x80:
+            self.pos = pos
+            return byte
+        n, shift = byte & 0x7F, 7
+        while True:
+            byte = buf[pos]
+            pos += 1
+            n |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                self.pos = pos
+                return n
+            shift += 7
+
+    def int(self) -> int:
+        n = self.uint()
+        return (n >> 1) if not n & 1 else -((n + 1) >> 1)
+
+    def text(self) -> str:
+        size = self.uint()
+        start = self.pos
+        self.pos += size
+        return self.buf[start:self.pos].decode("utf-8")
+
+    def symbol(self) -> str:
+        tag = self.uint()
+        if tag & 1:  # строка, которой нет в таблице: длина*2+1, затем байты
+            start = self.pos
+            self.pos += tag >> 1
+            return self.buf[start:self.pos].decode("utf-8")
+        index = tag >> 1
+        if index >= self.limit:
+            raise ValueError(f"Символ {index} вне таблицы записи ({self.limit}): запись повреждена")
+        return self.symbols[index]
+
+    # Списки и инвентарь читаются одним циклом на локальных переменных: почти всё —
+    # номер символа до 64, короткое имя или счётчик до 64, то есть один байт тега;
+    # остальное уходит в symbol()/int(). Вызов метода на элемент стоил дороже самого разбора.
+    def symbol_list(self, count: int) -> List[str]:
+        buf, table, limit = self.buf, self.symbols, self.limit
+        pos, values = self.pos, []
+        for _ in range(count):
+            tag = buf[pos]
+            if tag < 0x80:
+                pos += 1
+                if tag & 1:
+                    start, pos = pos, pos + (tag >> 1)
+                    values.append(buf[start:pos].decode("utf-8"))
+                    continue
+                if tag >> 1 < limit:
+                    values.append(table[tag >> 1])
+                    continue
+                pos -= 1
+            self.pos = pos
+            values.append(self.symbol())
+            pos = self.pos
+        self.pos = pos
+        return values
+
+    def inventory(self, count: int) -> Dict[str, int]:
+        buf, table, limit = self.buf, self.symbols, self.limit
+        pos, items = self.pos, {}
+        for _ in range(count):
+            tag = buf[pos]
+            if tag < 0x80 and tag & 1:
+                start, pos = pos + 1, pos + 1 + (tag >> 1)
+                name = buf[start:pos].decode("utf-8")
+            elif tag < 0x80 and tag >> 1 < limit:
+                pos += 1
+                name = table[tag >> 1]
+            else:
+                self.pos = pos
+                name = self.symbol()
+                pos = self.pos
+            n = buf[pos]
+            if n < 0x80:
+                pos += 1
+                items[name] = (n >> 1) if not n & 1 else -((n + 1) >> 1)
+            else:
+                self.pos = pos
+                items[name] = self.int()
+                pos = self.pos
+        self.pos = pos
+        return items
+
+
+class _Writer:
+    __slots__ = ("out", "ids")
+
+    def __init__(self, kind: int, ids: Dict[str, int]):
+        self.out = bytearray(MAGIC)
+        self.out.append(SCHEMA_VERSION)
+        self.out.append(kind)
+        _put_uint(self.out, len(ids))
+        self.ids = ids
+
+    def text(self, value: str):
+        raw = value.encode("utf-8")
+        _put_uint(self.out, len(raw))
+        self.out += raw
+
+    def symbol(self, value: str):
+        out = self.out
+        index = self.ids.get(value)
+        if index is not None:
+            if index < 64:
+                out.append(index << 1)
+            else:
+                _put_uint(out, index << 1)
+        else:
+            raw = value.encode("utf-8")
+            if len(raw) < 64:
+                out.append((len(raw) << 1) | 1)
+            else:
+                _put_uint(out, (len(raw) << 1) | 1)
+            out += raw
+
+    def symbols(self, values: Sequence[str]):
+        out, ids, symbol = self.out, self.ids, self.symbol
+        _put_uint(out, len(values))
+        for value in values:
+            index = ids.get(value)
+            if index is not None and index < 64:
+                out.append(index << 1)
+            elif index is None:
+                raw = value.encode("utf-8")
+                if len(raw) < 64:
+                    out.append((len(raw) << 1) | 1)
+                else:
+                    _put_uint(out, (len(raw) << 1) | 1)
+                out += raw
+            else:
+                symbol(value)
+
+    def inventory(self, items: Dict[str, int]):
+        out, ids, symbol = self.out, self.ids, self.symbol
+        _put_uint(out, len(items))
+        for name, count in items.items():
+            index = ids.get(name)
+            if index is not None and index < 64:
+                out.append(index << 1)
+            elif index is None:
+                raw = name.encode("utf-8")
+                if len(raw) < 64:
+                    out.append((len(raw) << 1) | 1)
+                else:
+                    _put_uint(out, (len(raw) << 1) | 1)
+                out += raw
+            else:
+                symbol(name)
+            if 0 <= count < 64:
+                out.append(count << 1)
+            else:
+                _put_int(out, count)
+
+    def turns(self, turns: Sequence[Sequence[str]]):
+        # ходы — это почти весь объём и десятки строк: одним JSON-текстом их
+        # пишет и читает C-код json, а не цикл на Python по каждой строке
+        self.text(_TURNS_JSON(turns))
+
+
+def _world_tables(world: Optional[WorldSnapshot]) -> Tuple[Sequence[str], Dict[str, int]]:
+    world = world or current_world()
+    return world.symbols, world.symbol_ids()
+
+
+# ====== ЗАПИСЬ ======
+def encode(data: Union[PlayerState, dict], world: Optional[WorldSnapshot] = None) -> bytes:
+    """Полный снимок состояния"""
+    if isinstance(data, PlayerState):
+        data = data.model_dump()
+    w = _Writer(SNAPSHOT, _world_tables(world)[1])
+    w.symbol(data["current_region"])
+    w.inventory(data["inventory"])
+    w.symbols(data["killed_enemies"])
+    w.symbols(data["active_quests"])
+    w.turns(data["history"])
+    w.text(data["summary"])
+    return bytes(w.out)
+
+
+def _common_prefix(old: Sequence, new: Sequence) -> int:
+    n = min(len(old), len(new))
+    i = 0
+    while i < n and old[i] == new[i]:
+        i += 1
+    return i
+
+
+def _ring_shift(old: Sequence, new: Sequence) -> int:
+    """Сколько ходов ушло из начала истории: new = old[shift:] + новые ходы"""
+    for shift in range(len(old) + 1):
+        kept = len(old) - shift
+        if kept <= len(new) and new[:kept] == old[shift:]:
+            return shift
+    return len(old)
+
+
+def encode_delta(old: dict, new: dict, world: Optional[WorldSnapshot] = None) -> Optional[bytes]:
+    """
+    Дельта old → new (оба — model_dump()). None — изменений нет.
+    Списки пишутся как «оставить первые k + хвост», история — как «выкинуть k из начала + новые ходы».
+    """
+    changed = [f for f in FIELDS if old[f] != new[f]]
+    if not changed:
+        return None
+    w = _Writer(DELTA, _world_tables(world)[1])
+    _put_uint(w.out, sum(1 << FIELDS.index(f) for f in changed))
+    for field in changed:
+        before, after = old[field], new[field]
+        if field == "current_region":
+            w.symbol(after)
+        elif field == "inventory":
+            updated = {k: v for k, v in after.items() if before.get(k) != v}
+            w.inventory(updated)
+            w.symbols([k for k in before if k not in after])
+        elif field in ("killed_enemies", "active_quests"):
+            keep = _common_prefix(before, after)
+            _put_uint(w.out, keep)
+            w.symbols(after[keep:])
+        elif field == "history":
+            shift = _ring_shift(before, after)
+            _put_uint(w.out, shift)
+            w.turns(after[len(before) - shift:])
+        else:
+            w.text(after)
+    return bytes(w.out)
+
+
+# ====== ЧТЕНИЕ ======
+def _read_snapshot_v1(r: _Reader) -> dict:
+    uint, symbol, text = r.uint, r.symbol, r.text
+    data = {"current_region": symbol()}
+    data["inventory"] = r.inventory(uint())
+    data["killed_enemies"] = r.symbol_list(uint())
+    data["active_quests"] = r.symbol_list(uint())
+    data["history"] = json.loads(text())
+    data["summary"] = text()
+    return data
+
+
+def _apply_delta_v1(r: _Reader, data: dict) -> dict:
+    mask = r.uint()
+    for bit, field in enumerate(FIELDS):
+        if not mask & (1 << bit):
+            continue
+        if field == "current_region":
+            data[field] = r.symbol()
+        elif field == "inventory":
+            inventory = dict(data[field])
+            inventory.update(r.inventory(r.uint()))
+            for name in r.symbol_list(r.uint()):
+                inventory.pop(name, None)
+            data[field] = inventory
+        elif field in ("killed_enemies", "active_quests"):
+            keep = r.uint()
+            data[field] = data[field][:keep] + r.symbol_list(r.uint())
+        elif field == "history":
+            shift = r.uint()
+            data[field] = data[field][shift:] + json.loads(r.text())
+        else:
+            data[field] = r.text()
+    return data
+
+
+# версия схемы → чтение снимка / применение дельты к состоянию этой же версии
+# (v2 — тот же формат полей, что v1, другой только заголовок)
+_SNAPSHOT_READERS: Dict[int, Callable[[_Reader], dict]] = {1: _read_snapshot_v1, 2: _read_snapshot_v1}
+_DELTA_READERS: Dict[int, Callable[[_Reader, dict], dict]] = {1: _apply_delta_v1, 2: _apply_delta_v1}
+
+
+def _migrate_v0(data: dict) -> dict:
+    """JSON от pydantic (до бинарного формата): валидация заполнит поля, которых тогда не было"""
+    return PlayerState.model_validate(data).model_dump()
+
+
+def _migrate_v1(data: dict) -> dict:
+    """v2 отличается только заголовком (длина таблицы символов) — состояние то же"""
+    return data
+
+
+# версия N → функция, поднимающая состояние до N+1
+MIGRATIONS: Dict[int, Callable[[dict], dict]] = {0: _migrate_v0, 1: _migrate_v1}
+
+
+def _migrate(data: dict, version: int, target: int) -> dict:
+    while version < target:
+        data = MIGRATIONS[version](data)
+        version += 1
+    return data
+
+
+def _header(record: bytes, symbols: Sequence[str]) -> Tuple[int, int, _Reader]:
+    """Версия, вид записи и читатель её полей (с длиной таблицы символов из заголовка)"""
+    if record[:2] != MAGIC or len(record) < 4:
+        raise ValueError("Не запись состояния игрока")
+    version, kind = record[2], record[3]
+    if version > SCHEMA_VERSION:
+        raise ValueError(f"Запись схемы v{version} новее поддерживаемой v{SCHEMA_VERSION}")
+    reader = _Reader(record, 4, symbols)
+    if version >= 2:
+        # v1 длины не хранит — читается по текущей таблице и перезаписывается (stale)
+        reader.limit = reader.uint()
+        if reader.limit > len(symbols):
+            raise ValueError(f"Запись от таблицы символов длиной {reader.limit}, у мира {len(symbols)}: "
+                             f"таблица пересобрана не дописыванием — номера значили бы другие имена")
+    return version, kind, reader
+
+
+def is_legacy(record: Record) -> bool:
+    """JSON-запись версии 0"""
+    return isinstance(record, str) or record[:1] == b"{"
+
+
+def decode_dict(records: Sequence[Record], world: Optional[WorldSnapshot] = None) -> Tuple[dict, bool]:
+    """
+    Снимок + дельты → model_dump() текущей версии.
+    Второе значение — были ли записи старых версий (стоит перезаписать снимком).
+    """
+    symbols = _world_tables(world)[0]
+    first = records[0]
+    if is_legacy(first):
+        data, version = json.loads(first), 0
+    else:
+        version, kind, reader = _header(first, symbols)
+        if kind != SNAPSHOT:
+            raise ValueError("Цепочка записей начинается не со снимка")
+        data = _SNAPSHOT_READERS[version](reader)
+    stale = version < SCHEMA_VERSION
+
+    for record in records[1:]:
+        delta_version, kind, reader = _header(record, symbols)
+        if kind != DELTA:
+            raise ValueError("Снимок посреди цепочки дельт")
+        data = _migrate(data, version, delta_version)
+        version = max(version, delta_version)
+        stale = stale or delta_version < SCHEMA_VERSION
+        data = _DELTA_READERS[delta_version](reader, data)
+    return _migrate(data, version, SCHEMA_VERSION), stale
+
+
+def decode(records: Union[Record, Sequence[Record]], world: Optional[WorldSnapshot] = None) -> PlayerState:
+    """Запись или цепочка записей → PlayerState"""
+    if isinstance(records, (bytes, str)):
+        records = [records]
+    data, _ = decode_dict(records, world)
+    # model_validate (pydantic-core) быстрее model_construct, который перебирает поля в Python
+    return PlayerState.model_validate(data)
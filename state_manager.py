@@ -1,20 +1,500 @@
 # state_manager.py
-from typing import Dict
+import os
+import time
+import uuid
+import random
+import socket
+import asyncio
+import logging
+import sqlite3
+import threading
+import weakref
+from contextlib import asynccontextmanager, nullcontext
+from typing import Dict, List, Optional, Set, AsyncIterator
 from storyteller import PlayerState
-import json
+from session_cache import SessionCache
+import state_codec
+from state_codec import Record
 
-# В памяти (для демо). В продакшене → Redis / PostgreSQL.
-_user_sessions: Dict[str, PlayerState] = {}
+# Хранилище: memory (для демо) или sqlite (переживает рестарт, общий файл для воркеров)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "players.db")
+# Отложенная запись: грязные состояния сбрасываются пачкой раз в интервал
+# (или раньше, если набралось STATE_FLUSH_BATCH) и при остановке приложения
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "1.0"))
+STATE_FLUSH_BATCH = int(os.getenv("STATE_FLUSH_BATCH", "500"))
+# Рабочий набор сессий в памяти: LRU + TTL простоя + лимиты (0 — без лимита)
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "100000"))
+SESSION_CACHE_MAX_BYTES = int(os.getenv("SESSION_CACHE_MAX_BYTES", "0"))
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "1800"))
+# Несколько воркеров (uvicorn --workers N) с общим хранилищем: каждый ход читает
+# состояние из хранилища и пишет его сразу (write-through) — кэш воркера не устаревает
+STATE_SHARED = os.getenv("STATE_SHARED", "0") not in ("0", "false", "no")
+# Блокировка игрока между воркерами (STATE_SHARED): аренда в хранилище. Воркер продлевает
+# свои аренды, пока жив; аренда упавшего истекает через STATE_LOCK_TTL секунд
+STATE_LOCK_TTL = float(os.getenv("STATE_LOCK_TTL", "30"))
+STATE_LOCK_TIMEOUT = float(os.getenv("STATE_LOCK_TIMEOUT", "60"))  # сколько ждать аренду, дальше — ошибка
+# Состояние пишется дельтами к последнему сохранённому (state_codec); после стольких
+# дельт подряд — снова полный снимок, чтобы чтение не проигрывало длинную цепочку
+STATE_DELTA_MAX = int(os.getenv("STATE_DELTA_MAX", "8"))
 
-def get_player_state(user_id: str) -> PlayerState:
-    if user_id not in _user_sessions:
-        _user_sessions[user_id] = PlayerState()
-    return _user_sessions[user_id]
 
-def save_player_state(user_id: str, state: PlayerState):
-    _user_sessions[user_id] = state
+# === ХРАНИЛИЩА ===
+
+class StateBackend:
+    """
+    Интерфейс хранилища: записи state_codec, уже сериализованные. На игрока —
+    снимок и дельты после него; новый снимок заменяет всю цепочку.
+    """
+
+    async def open(self):
+        pass
+
+    async def load(self, user_id: str) -> Optional[List[Record]]:
+        """Снимок + дельты по порядку; None — игрока нет"""
+        raise NotImplementedError
+
+    async def save_many(self, snapshots: Dict[str, bytes], deltas: Optional[Dict[str, bytes]] = None):
+        raise NotImplementedError
+
+    async def try_lock(self, user_id: str, owner: str, ttl: float) -> bool:
+        """Аренда игрока между процессами; хранилище одного процесса в ней не нуждается"""
+        return True
+
+    async def unlock(self, user_id: str, owner: str):
+        pass
+
+    async def renew_locks(self, owner: str, ttl: float):
+        pass
+
+    async def close(self):
+        pass
+
+
+class MemoryBackend(StateBackend):
+    """В памяти процесса. Теряется при рестарте, не делится между воркерами."""
+
+    def __init__(self):
+        self._data: Dict[str, List[Record]] = {}
+
+    async def load(self, user_id: str) -> Optional[List[Record]]:
+        records = self._data.get(user_id)
+        return list(records) if records else None
+
+    async def save_many(self, snapshots: Dict[str, bytes], deltas: Optional[Dict[str, bytes]] = None):
+        for user_id, record in snapshots.items():
+            self._data[user_id] = [record]
+        for user_id, record in (deltas or {}).items():
+            self._data.setdefault(user_id, []).append(record)
+
+
+class SQLiteBackend(StateBackend):
+    """SQLite в режиме WAL: читатели не ждут писателя, файл можно делить между процессами"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()  # одно соединение — запросы из потоков по очереди
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # data — снимок: BLOB state_codec или TEXT (JSON до бинарного формата)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS player_state ("
+            "user_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS player_state_delta ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, data BLOB NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS player_state_delta_user ON player_state_delta (user_id, id)")
+        # Аренды игроков для STATE_SHARED: кто из воркеров сейчас делает ход
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS player_lock ("
+            "user_id TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.commit()
+        return conn
+
+    async def open(self):
+        self._conn = await asyncio.to_thread(self._connect)
+
+    def _load(self, user_id: str) -> Optional[List[Record]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM player_state WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            deltas = self._conn.execute(
+                "SELECT data FROM player_state_delta WHERE user_id = ? ORDER BY id", (user_id,)
+            ).fetchall()
+        return [row[0]] + [d[0] for d in deltas]
+
+    async def load(self, user_id: str) -> Optional[List[Record]]:
+        return await asyncio.to_thread(self._load, user_id)
+
+    def _save_many(self, snapshots: Dict[str, bytes], deltas: Optional[Dict[str, bytes]] = None):
+        now = time.time()
+        with self._lock, self._conn:
+            if snapshots:
+                self._conn.executemany(
+                    "INSERT INTO player_state (user_id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    [(user_id, data, now) for user_id, data in snapshots.items()]
+                )
+                self._conn.executemany(
+                    "DELETE FROM player_state_delta WHERE user_id = ?", [(user_id,) for user_id in snapshots]
+                )
+            if deltas:
+                self._conn.executemany(
+                    "INSERT INTO player_state_delta (user_id, data) VALUES (?, ?)", list(deltas.items())
+                )
+                self._conn.executemany(
+                    "UPDATE player_state SET updated_at = ? WHERE user_id = ?", [(now, user_id) for user_id in deltas]
+                )
+
+    async def save_many(self, snapshots: Dict[str, bytes], deltas: Optional[Dict[str, bytes]] = None):
+        await asyncio.to_thread(self._save_many, snapshots, deltas)
+
+    def _try_lock(self, user_id: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock, self._conn:
+            # занять свободную или истёкшую аренду; чужую живую не трогаем
+            cursor = self._conn.execute(
+                "INSERT INTO player_lock (user_id, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE player_lock.expires_at < ?",
+                (user_id, owner, now + ttl, now)
+            )
+            return cursor.rowcount == 1
+
+    async def try_lock(self, user_id: str, owner: str, ttl: float) -> bool:
+        return await asyncio.to_thread(self._try_lock, user_id, owner, ttl)
+
+    def _unlock(self, user_id: str, owner: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM player_lock WHERE user_id = ? AND owner = ?", (user_id, owner))
+
+    async def unlock(self, user_id: str, owner: str):
+        await asyncio.to_thread(self._unlock, user_id, owner)
+
+    def _renew_locks(self, owner: str, ttl: float):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE player_lock SET expires_at = ? WHERE owner = ?", (time.time() + ttl, owner))
+
+    async def renew_locks(self, owner: str, ttl: float):
+        await asyncio.to_thread(self._renew_locks, owner, ttl)
+
+    def migrate(self) -> int:
+        """Все игроки → один снимок текущей версии (JSON и цепочки дельт переписываются)"""
+        with self._lock:
+            users = [row[0] for row in self._conn.execute("SELECT user_id FROM player_state")]
+        migrated = 0
+        for start in range(0, len(users), STATE_FLUSH_BATCH):
+            snapshots = {}
+            for user_id in users[start:start + STATE_FLUSH_BATCH]:
+                records = self._load(user_id)
+                if records and (len(records) > 1 or state_codec.is_legacy(records[0])):
+                    snapshots[user_id] = state_codec.encode(state_codec.decode_dict(records)[0])
+            self._save_many(snapshots)
+            migrated += len(snapshots)
+        return migrated
+
+    async def close(self):
+        if self._conn is not None:
+            await asyncio.to_thread(self._conn.close)
+            self._conn = None
+
+
+def create_backend(kind: str = STATE_BACKEND) -> StateBackend:
+    if kind == "memory":
+        return MemoryBackend()
+    if kind == "sqlite":
+        return SQLiteBackend(STATE_DB_PATH)
+    raise ValueError(f"Неизвестный STATE_BACKEND: {kind}")
+
+
+# === СЕССИИ ===
+
+def approx_state_size(state: PlayerState) -> int:
+    """Примерный объём PlayerState в памяти (модель + снимок в _saved), байт"""
+    size = 1200
+    for item in state.inventory:
+        size += 2 * (len(item) * 2 + 120)
+    for name in state.killed_enemies:
+        size += 2 * (len(name) * 2 + 60)
+    for qid in state.active_quests:
+        size += 2 * (len(qid) + 60)
+    for action, response in state.history:
+        size += 2 * ((len(action) + len(response)) * 2 + 180)
+    size += 2 * len(state.summary) * 2
+    return size
+
+
+def _on_evict(user_id: str, state: PlayerState, reason: str):
+    """Вытесненную из памяти сессию с несохранёнными изменениями — в очередь на запись"""
+    _saved.pop(user_id, None)
+    _deltas.pop(user_id, None)
+    if user_id in _dirty and not _in_step(user_id):
+        # посреди хода не пишем: player_session вернёт в кэш итог хода или откат
+        _dirty.discard(user_id)
+        _pending[user_id] = state_codec.encode(state)
+
+
+_backend: StateBackend = MemoryBackend()
+_sessions = SessionCache(
+    max_entries=SESSION_CACHE_MAX_ENTRIES,
+    max_bytes=SESSION_CACHE_MAX_BYTES,
+    ttl=SESSION_CACHE_TTL,
+    sizeof=approx_state_size,
+    on_evict=_on_evict,
+)
+# Снимок последнего сохранённого состояния — чтобы не пересериализовать нетронутые
+# и писать только разницу с ним
+_saved: Dict[str, dict] = {}
+# Сколько дельт лежит в хранилище после снимка
+_deltas: Dict[str, int] = {}
+_dirty: Set[str] = set()
+# Вытесненные из кэша, но ещё не записанные состояния (полные снимки)
+_pending: Dict[str, bytes] = {}
+# Блокировка на игрока живёт, пока её кто-то держит или ждёт
+_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+_flush_task: Optional[asyncio.Task] = None
+_flush_wakeup: Optional[asyncio.Event] = None
+# Аренды этого процесса в хранилище (STATE_SHARED)
+_lock_owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+_renew_task: Optional[asyncio.Task] = None
+
+
+def _user_lock(user_id: str) -> asyncio.Lock:
+    lock = _locks.get(user_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _locks[user_id] = lock
+    return lock
+
+
+def _in_step(user_id: str) -> bool:
+    """Ход игрока идёт прямо сейчас — его живое состояние ещё может откатиться"""
+    lock = _locks.get(user_id)
+    return lock is not None and lock.locked()
+
+
+async def get_player_state(user_id: str) -> PlayerState:
+    state = _sessions.get(user_id)
+    if state is None:
+        raw = _pending.pop(user_id, None)
+        unsaved = raw is not None  # вытеснено, но ещё не записано
+        records = [raw] if unsaved else await _backend.load(user_id)
+        if records:
+            data, stale = state_codec.decode_dict(records)
+            state = PlayerState.model_validate(data)
+        else:
+            state, stale = PlayerState(), False
+        _sessions.set(user_id, state)
+        if unsaved:
+            _saved[user_id] = {}
+            _dirty.add(user_id)
+        else:
+            _saved[user_id] = state.model_dump()
+            # нет записи или она старой версии — при следующем сохранении нужен полный снимок
+            _deltas[user_id] = len(records) - 1 if records and not stale else STATE_DELTA_MAX
+    return state
+
+
+async def save_player_state(user_id: str, state: PlayerState):
+    """Помечает состояние на запись; сама запись — пачкой в фоне (flush)"""
+    _remember(user_id, state)
+
+
+def _remember(user_id: str, state: PlayerState):
+    _sessions.set(user_id, state)
+    if state.model_dump() != _saved.get(user_id):
+        _dirty.add(user_id)
+        if len(_dirty) >= STATE_FLUSH_BATCH and _flush_wakeup is not None:
+            _flush_wakeup.set()
+
+
+@asynccontextmanager
+async def _shared_lock(user_id: str) -> AsyncIterator[None]:
+    """Аренда игрока в общем хранилище: ход одного игрока идёт в одном воркере за раз"""
+    started, delay = time.monotonic(), 0.005
+    while not await _backend.try_lock(user_id, _lock_owner, STATE_LOCK_TTL):
+        if time.monotonic() - started >= STATE_LOCK_TIMEOUT:
+            raise TimeoutError(f"Игрок {user_id} занят другим воркером дольше {STATE_LOCK_TIMEOUT:.0f} с")
+        await asyncio.sleep(random.uniform(delay / 2, delay))
+        delay = min(delay * 2, 0.1)
+    try:
+        yield
+    finally:
+        await _backend.unlock(user_id, _lock_owner)
+
+
+async def _renew_loop():
+    while True:
+        await asyncio.sleep(STATE_LOCK_TTL / 3)
+        try:
+            await _backend.renew_locks(_lock_owner, STATE_LOCK_TTL)
+        except Exception as e:
+            logging.error(f"Аренды игроков не продлены: {e}")
+
+
+@asynccontextmanager
+async def player_session(user_id: str) -> AsyncIterator[PlayerState]:
+    """
+    Ход игрока под блокировкой: два одновременных запроса одного игрока
+    выполняются по очереди и не затирают изменения друг друга — в воркере
+    asyncio.Lock, между воркерами (STATE_SHARED) ещё и аренда в хранилище. Ход,
+    прерванный исключением или отменой (клиент ушёл посреди потока), откатывается целиком.
+    """
+    async with _user_lock(user_id), (_shared_lock(user_id) if STATE_SHARED else nullcontext()):
+        if STATE_SHARED:
+            # другой воркер мог изменить состояние — берём свежее из хранилища
+            _sessions.pop(user_id)
+            _saved.pop(user_id, None)
+            _deltas.pop(user_id, None)
+        state = await get_player_state(user_id)
+        before = state.model_copy(deep=True)
+        try:
+            yield state
+        except BaseException:
+            # ход не состоялся: в кэше — состояние до него, как в хранилище и журнале.
+            # Посреди хода flush и вытеснение его не пишут; вытесненный — обратно в кэш
+            for field in PlayerState.model_fields:
+                setattr(state, field, getattr(before, field))
+            _remember(user_id, state)
+            raise
+        await save_player_state(user_id, state)
+        if STATE_SHARED and user_id in _dirty:
+            await _write_through(user_id, state)
+
+
+def _encode_write(user_id: str, dump: dict, snapshots: Dict[str, bytes], deltas: Dict[str, bytes]):
+    """Дельта к сохранённому, если цепочка ещё короткая; иначе полный снимок"""
+    saved = _saved.get(user_id)
+    if saved and _deltas.get(user_id, 0) < STATE_DELTA_MAX:
+        delta = state_codec.encode_delta(saved, dump)
+        if delta is not None:
+            deltas[user_id] = delta
+        return
+    snapshots[user_id] = state_codec.encode(dump)
+
+
+def _mark_saved(user_id: str, dump: dict, deltas: Dict[str, bytes]):
+    _saved[user_id] = dump
+    _deltas[user_id] = _deltas.get(user_id, 0) + 1 if user_id in deltas else 0
+
+
+async def _write_through(user_id: str, state: PlayerState):
+    _dirty.discard(user_id)
+    dump = state.model_dump()
+    snapshots, deltas = {}, {}
+    _encode_write(user_id, dump, snapshots, deltas)
+    try:
+        await _backend.save_many(snapshots, deltas)
+    except Exception:
+        _dirty.add(user_id)
+        raise
+    _mark_saved(user_id, dump, deltas)
+
+
+async def flush():
+    """Сбрасывает в хранилище только изменённые состояния — дельтами, где можно"""
+    if not _dirty and not _pending:
+        return
+    snapshots, deltas = dict(_pending), {}
+    _pending.clear()
+    dumps = {}
+    for user_id in list(_dirty):
+        if _in_step(user_id):
+            continue  # ход ещё может откатиться — запишем после него
+        _dirty.discard(user_id)
+        state = _sessions.peek(user_id)
+        if state is not None:
+            dumps[user_id] = state.model_dump()
+            _encode_write(user_id, dumps[user_id], snapshots, deltas)
+    try:
+        await _backend.save_many(snapshots, deltas)
+    except Exception:
+        # попробуем в следующий раз
+        for user_id in set(snapshots) | set(deltas):
+            if user_id in dumps and user_id in _sessions:
+                _dirty.add(user_id)
+            elif user_id in dumps:
+                # вытеснен, пока шла запись: дельту не к чему применять — полный снимок
+                _pending.setdefault(user_id, state_codec.encode(dumps[user_id]))
+            else:
+                _pending.setdefault(user_id, snapshots[user_id])
+        raise
+    for user_id, dump in dumps.items():
+        if user_id in _sessions:
+            _mark_saved(user_id, dump, deltas)
+
+
+def session_stats() -> Dict[str, object]:
+    """Счётчики кэша сессий для /health"""
+    stats = _sessions.stats()
+    stats["dirty"] = len(_dirty)
+    stats["pending_writes"] = len(_pending)
+    return stats
+
+
+async def _flush_loop():
+    while True:
+        try:
+            await asyncio.wait_for(_flush_wakeup.wait(), timeout=STATE_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _flush_wakeup.clear()
+        try:
+            _sessions.expire()
+            await flush()
+        except Exception as e:
+            logging.error(f"Ошибка записи состояний: {e}", exc_info=True)
+
+
+async def start_state_manager(backend: Optional[StateBackend] = None):
+    """Открывает хранилище и запускает фоновую запись (вызывается из lifespan)"""
+    global _backend, _flush_task, _flush_wakeup, _renew_task
+    _backend = backend or create_backend()
+    if STATE_SHARED and isinstance(_backend, MemoryBackend):
+        logging.warning("STATE_SHARED=1 с memory-хранилищем: состояние не делится между воркерами")
+    await _backend.open()
+    _flush_wakeup = asyncio.Event()
+    _flush_task = asyncio.create_task(_flush_loop())
+    if STATE_SHARED:
+        _renew_task = asyncio.create_task(_renew_loop())
+
+
+async def stop_state_manager():
+    """Останавливает фоновую запись, дописывает хвост и закрывает хранилище"""
+    global _flush_task, _renew_task
+    for task in (_flush_task, _renew_task):
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    _flush_task = _renew_task = None
+    await flush()
+    await _backend.close()
 
 # Пример использования в main.py:
-# state = get_player_state(user_id)
-# state.inventory["Бутерброд"] = state.inventory.get("Бутерброд", 0) + 1
-# save_player_state(user_id, state)
\ No newline at end of file
+# async with player_session(user_id) as state:
+#     state.inventory["Бутерброд"] = state.inventory.get("Бутерброд", 0) + 1
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Переписать все состояния SQLite в текущий формат state_codec")
+    parser.add_argument("db", nargs="?", default=STATE_DB_PATH)
+    args = parser.parse_args()
+    backend = SQLiteBackend(args.db)
+    backend._conn = backend._connect()
+    print(f"Переписано игроков: {backend.migrate()}")
+    backend._conn.close()
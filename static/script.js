@@ -18,47 +18,6 @@ const startBtn = document.getElementById('startBtn');
 const loadingEl = document.getElementById('loading');
 
 
-function typeTextWithWrap(container, text, onDone) {
-    container.innerHTML = ''; // очищаем контейнер
-    let i = 0;
-    const speed = 25; // ms per char
-
-    // Создаём span для "курсора"
-    const cursor = document.createElement('span');
-    cursor.textContent = '|';
-    cursor.style.color = '#c05bff';
-    cursor.style.marginLeft = '2px';
-    cursor.style.animation = 'blink 1s infinite';
-    container.appendChild(cursor);
-
-    function type() {
-        if (i < text.length) {
-            // Вставляем символ и ПЕРЕСЧИТЫВАЕМ переносы автоматически
-            const char = text.charAt(i);
-            const textNode = document.createTextNode(char);
-            container.insertBefore(textNode, cursor);
-            i++;
-
-            // Прокручиваем плавно вниз КАЖДЫЙ РАЗ
-            requestAnimationFrame(() => {
-                storyEl.scrollTo({
-                    top: storyEl.scrollHeight,
-                    behavior: 'smooth'
-                });
-            });
-
-            setTimeout(type, speed);
-        } else {
-            // Убираем курсор
-            container.removeChild(cursor);
-            if (onDone) onDone();
-        }
-    }
-
-    type();
-}
-
-
 // Переключение вида
 function showView(view) {
     menuView.style.display = view === 'menu' ? 'flex' : 'none';
@@ -75,9 +34,6 @@ function scrollToBottom(smooth = false) {
 }
 
 
-
-
-
 // Отправка действия
 async function sendAction(action) {
     if (!action.trim()) return;
@@ -98,24 +54,62 @@ async function sendAction(action) {
     scrollToBottom(true);
 
     try {
-        const response = await fetch("/api/step", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ initData: WebApp.initData, action })
-        });
+        await streamAction(action, typingSpan);
+    } catch (err) {
+        typingSpan.textContent = `💥 ${err.message}`;
+    }
+}
+
+// Потоковый ответ: /api/step/stream отдаёт Server-Sent Events,
+// токены дописываются в чат сразу по мере генерации
+async function streamAction(action, container) {
+    const response = await fetch("/api/step/stream", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ initData: WebApp.initData, action })
+    });
 
+    const contentType = response.headers.get("Content-Type") || "";
+    if (!contentType.startsWith("text/event-stream")) {
         const data = await response.json();
+        container.textContent = `❌ Ошибка: ${data.error}`;
+        return;
+    }
 
-        if (data.ok) {
-            // 🔹 ШАГ 3: заменяем "печатает..." на реальный типинг с переносом
-            typeTextWithWrap(typingSpan, data.response, () => {
-                // Готово
-            });
-        } else {
-            typingSpan.textContent = `❌ Ошибка: ${data.error}`;
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // События разделены пустой строкой
+        let sep;
+        while ((sep = buffer.indexOf('\n\n')) !== -1) {
+            const raw = buffer.slice(0, sep);
+            buffer = buffer.slice(sep + 2);
+            handleStreamEvent(raw, container);
         }
-    } catch (err) {
-        typingSpan.textContent = `💥 ${err.message}`;
+    }
+}
+
+function handleStreamEvent(raw, container) {
+    let event = 'message';
+    let payload = '';
+    for (const line of raw.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) payload += line.slice(5).trim();
+    }
+    if (!payload) return;
+    const data = JSON.parse(payload);
+
+    if (event === 'token') {
+        container.appendChild(document.createTextNode(data.text));
+        scrollToBottom();
+    } else if (event === 'error') {
+        container.textContent = `❌ Ошибка: ${data.error}`;
     }
 }
 
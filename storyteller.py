@@ -1,12 +1,41 @@
 # storyteller.py
 import os
+import json
+import time
+import asyncio
+import hashlib
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple, AsyncIterator
 import httpx
-from typing import List, Dict
-from world import get_region, get_quest_by_id, Region, NPC, Enemy, Quest
+from llm_client import get_http_client
+from admission import AdmissionController, Overloaded, backoff_delay, is_retryable, retry_after_seconds
+from response_cache import ResponseCache
+from batching import MicroBatcher
+from metrics import LLM_RESPONSES, StageTimer, record_llm_usage
+from memory import Turn, count_prompt_tokens, fold_locally, history_messages, prompt_stats
+from world import WorldSnapshot, current_world, on_reload
 from pydantic import BaseModel
 
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"  # ← убраны лишние пробелы!
+# URL переопределяется через .env — например, на локальный фейковый сервер для замеров
+DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
+
+# Кэш одинаковых запросов к повествователю (выключен по умолчанию)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0") not in ("0", "false", "no")
+response_cache = ResponseCache(
+    variants=int(os.getenv("RESPONSE_CACHE_VARIANTS", "3")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "600")),
+    max_keys=int(os.getenv("RESPONSE_CACHE_MAX_KEYS", "10000")),
+) if RESPONSE_CACHE_ENABLED else None
+
+# Допуск к DeepSeek: лимиты одновременных вызовов, очередь, квота, повторы
+admission = AdmissionController()
+
+# Микропачки для сцен, где много игроков ходят в одном регионе (выключены по умолчанию):
+# окно сбора, размер пачки и задержка остальных после лидера для «холодного» префикса
+NARRATION_BATCH_WINDOW_MS = float(os.getenv("NARRATION_BATCH_WINDOW_MS", "0"))
+NARRATION_BATCH_MAX = int(os.getenv("NARRATION_BATCH_MAX", "16"))
+NARRATION_BATCH_LEADER_MS = float(os.getenv("NARRATION_BATCH_LEADER_MS", "0"))
 
 # Системный промпт — БЕЗ деталей мира
 SYSTEM_PROMPT = (
@@ -23,14 +52,15 @@ class PlayerState(BaseModel):
     inventory: Dict[str, int] = {}
     killed_enemies: List[str] = []
     active_quests: List[str] = []
+    # Память повествователя: последние ходы [действие, ответ] + летопись более ранних
+    history: List[List[str]] = []
+    summary: str = ""
 
 
-def _build_context(player: PlayerState) -> str:
-    """Формирует КОРОТКИЙ контекст для DeepSeek (~200 токенов)"""
-    region = get_region(player.current_region)
-    if not region:
-        return f"Игрок в неизвестном месте: {player.current_region}"
-
+# === КОНТЕКСТ ===
+# Описание региона статично — собираем один раз на регион (и снимок мира), а не на каждый ход.
+# Так начало промпта побайтово одинаково, и кэш префиксов у провайдера попадает.
+def _region_fragment(region) -> str:
     parts = [f"Место: {region.name}"]
     parts.append(f"Описание: {region.description}")
 
@@ -42,42 +72,177 @@ def _build_context(player: PlayerState) -> str:
         enemies = ", ".join([e.name for e in region.enemies])
         parts.append(f"Враги: {enemies}")
 
+    return "\n".join(parts)
+
+
+def _cached_region_fragment(world: WorldSnapshot, name: str) -> Optional[str]:
+    region = world.get_region(name)
+    if region is None:
+        return None
+    return world.derived(("context", name), lambda: _region_fragment(region))
+
+
+@lru_cache(maxsize=4096)
+def _player_fragment(world: WorldSnapshot, quests: Tuple[str, ...], inventory: Tuple[Tuple[str, int], ...]) -> str:
+    """Квесты и инвентарь; ключ кэша — снимок мира и версия этой части состояния"""
+    parts = []
+
     # Активные квесты
     quest_names = []
-    for qid in player.active_quests:
-        q = get_quest_by_id(qid)
+    for qid in quests:
+        q = world.get_quest(qid)
         if q:
             quest_names.append(q.name)
     if quest_names:
         parts.append(f"Квесты: {', '.join(quest_names)}")
 
     # Инвентарь (только непустой)
-    if player.inventory:
-        inv = ", ".join([f"{cnt}×{item}" for item, cnt in player.inventory.items() if cnt > 0])
+    if inventory:
+        inv = ", ".join([f"{cnt}×{item}" for item, cnt in inventory if cnt > 0])
         parts.append(f"Инвентарь: [{inv}]")
 
     return "\n".join(parts)
 
 
+# Фрагменты старого снимка больше не нужны новым ходам — не держим их (и снимок) в кэше
+on_reload(lambda world: _player_fragment.cache_clear())
+
+
+def context_cache_stats() -> Dict[str, int]:
+    """Попадания в кэш фрагментов игрока (квесты + инвентарь)"""
+    info = _player_fragment.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "entries": info.currsize}
+
+
+def _build_context(player: PlayerState, world: Optional[WorldSnapshot] = None) -> str:
+    """Формирует КОРОТКИЙ контекст для DeepSeek (~200 токенов)"""
+    world = world or current_world()
+    region_part = _cached_region_fragment(world, player.current_region)
+    if region_part is None:
+        return f"Игрок в неизвестном месте: {player.current_region}"
+
+    player_part = _player_fragment(world, tuple(player.active_quests), tuple(player.inventory.items()))
+    if not player_part:
+        return region_part
+    return region_part + "\n" + player_part
+
+
+class ResponseSanitizer:
+    """
+    Потоковый фильтр ответа ИИ: получает текст кусками (токенами) и
+    возвращает очищенные куски. Результат совпадает с разовой обработкой
+    всего текста: убираем «*», «###», «---», обрезаем пробелы по краям и
+    оставляем не больше 4 предложений. Хвосты, которые могут оказаться
+    частью разметки или концом текста, придерживаются до следующего куска.
+    """
+    MAX_SENTENCES = 4
+
+    def __init__(self):
+        self.done = False  # лимит предложений достигнут — дальше читать не нужно
+        self._hashes = 0
+        self._dashes = 0
+        self._started = False
+        self._spaces = ""
+        self._prev = ""
+        self._breaks = 0
+
+    def feed(self, chunk: str) -> str:
+        out: List[str] = []
+        for ch in chunk:
+            if self.done:
+                break
+            if ch != "*":  # markdown-звёздочки
+                self._hash(ch, out)
+        return "".join(out)
+
+    def finish(self) -> str:
+        out: List[str] = []
+        if not self.done:
+            self._flush_hashes(out)
+            self._flush_dashes(out)
+        self._spaces = ""  # хвостовые пробелы отбрасываем (как strip)
+        return "".join(out)
+
+    # Заголовки «###»: из серии решёток остаётся только остаток от деления на 3
+    def _hash(self, ch: str, out: List[str]):
+        if ch == "#":
+            self._hashes += 1
+            return
+        self._flush_hashes(out)
+        self._dash(ch, out)
+
+    def _flush_hashes(self, out: List[str]):
+        rest, self._hashes = self._hashes % 3, 0
+        for _ in range(rest):
+            self._dash("#", out)
+
+    # Разделители «---» — так же
+    def _dash(self, ch: str, out: List[str]):
+        if ch == "-":
+            self._dashes += 1
+            return
+        self._flush_dashes(out)
+        self._emit(ch, out)
+
+    def _flush_dashes(self, out: List[str]):
+        rest, self._dashes = self._dashes % 3, 0
+        for _ in range(rest):
+            self._emit("-", out)
+
+    # Пробелы по краям и лимит предложений (разделитель — «. »)
+    def _emit(self, ch: str, out: List[str]):
+        if self.done:
+            return
+        if not self._started:
+            if ch.isspace():
+                return
+            self._started = True
+        if ch == " " and self._prev == ".":
+            self._breaks += 1
+            if self._breaks >= self.MAX_SENTENCES:
+                self.done = True
+                return
+        self._prev = ch
+        if ch.isspace():
+            self._spaces += ch
+            return
+        if self._spaces:
+            out.append(self._spaces)
+            self._spaces = ""
+        out.append(ch)
+
+
 def sanitize_ai_response(text: str) -> str:
-    # Убираем потенциальные markdown-звёздочки
-    text = text.replace("**", "").replace("*", "")
-    # Убираем заголовки и разделители
-    text = text.replace("###", "").replace("---", "").strip()
-    # Обрезаем до 4 предложений
-    sentences = text.split('. ')
-    if len(sentences) > 4:
-        text = '. '.join(sentences[:4]) + '.'
-    return text.strip()
-
-
-async def get_deepseek_response(messages: List[Dict[str, str]]) -> str:
-    if not DEEPSEEK_API_KEY:
-        return (
-            "🧙‍♂️ *Голос эха:* «Ключ DeepSeek не задан. Проверь .env»\n\n"
-            "🌲 Лес шелестит листвой. Ветер несёт запах дыма и… старой крови."
-        )
+    sanitizer = ResponseSanitizer()
+    return sanitizer.feed(text) + sanitizer.finish()
+
+
+def _format_llm_error(e: Exception) -> str:
+    if isinstance(e, httpx.HTTPStatusError):
+        status = e.response.status_code
+        if status == 401:
+            return "🔒 *Ошибка авторизации DeepSeek.* Проверь DEEPSEEK_API_KEY в .env"
+        if status == 429:
+            wait = retry_after_seconds(e.response)
+            return f"⏳ *Лимит запросов.* Подожди {round(wait) if wait else 30} секунд."
+    return f"💥 *Ошибка связи с DeepSeek:* `{str(e)[:100]}`"
+
+
+NO_KEY_RESPONSE = (
+    "🧙‍♂️ *Голос эха:* «Ключ DeepSeek не задан. Проверь .env»\n\n"
+    "🌲 Лес шелестит листвой. Ветер несёт запах дыма и… старой крови."
+)
+
 
+# Отдельный промпт для свёртки истории — повествователю он не виден
+SUMMARY_PROMPT = (
+    "Ты ведёшь летопись приключения игрока. Тебе дают прежнюю летопись и новые ходы. "
+    "Перепиши летопись целиком: 3–5 коротких предложений, только факты — куда ходил, "
+    "что купил, с кем говорил, кого победил, какие обещания дал. Без эмодзи и украшений."
+)
+
+
+def _build_request(messages: List[Dict[str, str]], stream: bool = False, system: str = SYSTEM_PROMPT):
     headers = {
         "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
         "Content-Type": "application/json"
@@ -85,36 +250,241 @@ async def get_deepseek_response(messages: List[Dict[str, str]]) -> str:
 
     payload = {
         "model": "deepseek-chat",
-        "messages": [{"role": "system", "content": SYSTEM_PROMPT}] + messages,
+        "messages": [{"role": "system", "content": system}] + messages,
         "temperature": 0.85,
         "max_tokens": 500
     }
+    if stream:
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}  # usage придёт последним чанком
+    return headers, payload
 
+
+async def _post_completion(headers: dict, payload: dict, kind: str = "chat") -> str:
+    # Общий клиент из пула — без нового TCP+TLS рукопожатия на каждый ход
+    client = get_http_client()
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(DEEPSEEK_API_URL, headers=headers, json=payload)
-            response.raise_for_status()
-            data = response.json()
-            return data["choices"][0]["message"]["content"].strip()
+        response = await client.post(DEEPSEEK_API_URL, headers=headers, json=payload)
+    except httpx.HTTPError:
+        LLM_RESPONSES.inc(kind, "error")
+        raise
+    LLM_RESPONSES.inc(kind, response.status_code)
+    response.raise_for_status()
+    data = response.json()
+    record_llm_usage(kind, data.get("usage"))
+    return data["choices"][0]["message"]["content"].strip()
+
+
+async def _request_completion(messages: List[Dict[str, str]], user_id: str = None) -> str:
+    headers, payload = _build_request(messages)
+    return await admission.call(lambda: _post_completion(headers, payload), user_id=user_id)
+
+
+async def _dispatch_narration(item) -> str:
+    messages, user_id = item
+    return await _request_completion(messages, user_id)
+
+
+def _prefix_key(messages: List[Dict[str, str]]) -> str:
+    """Общий префикс промпта: SYSTEM_PROMPT (константа) + контекст региона"""
+    return hashlib.sha1(messages[0]["content"].encode()).hexdigest()
+
+
+def _prompt_identity(item) -> str:
+    """Одинаковый промпт — один вызов на всю пачку, кто бы его ни прислал"""
+    messages, _ = item
+    return hashlib.sha1(json.dumps(messages, ensure_ascii=False).encode()).hexdigest()
+
+
+narration_batcher = MicroBatcher(
+    _dispatch_narration,
+    identity=_prompt_identity,
+    window=NARRATION_BATCH_WINDOW_MS / 1000,
+    max_batch=NARRATION_BATCH_MAX,
+    leader_delay=NARRATION_BATCH_LEADER_MS / 1000,
+) if NARRATION_BATCH_WINDOW_MS > 0 else None
+
+
+def _narrate(messages: List[Dict[str, str]], user_id: str = None):
+    if narration_batcher is not None:
+        return narration_batcher.submit(_prefix_key(messages), (messages, user_id))
+    return _request_completion(messages, user_id)
+
+
+async def get_deepseek_response(messages: List[Dict[str, str]], cache_key: str = None, user_id: str = None,
+                                meta: dict = None) -> str:
+    """
+    Ответ DeepSeek или текст ошибки для игрока. Overloaded пробрасывается — это 503.
+    В meta (если передан) отмечается "error": такой ответ не стоит запоминать,
+    и "unavailable", если upstream лежит (связь, 5xx/429 после повторов) — вместо
+    текста ошибки движок отдаст запасное повествование.
+    """
+    if not DEEPSEEK_API_KEY:
+        if meta is not None:
+            meta["error"] = True
+        return NO_KEY_RESPONSE
+
+    try:
+        if cache_key is not None and response_cache is not None:
+            return await response_cache.get_or_fetch(cache_key, lambda: _narrate(messages, user_id))
+        return await _narrate(messages, user_id)
+    except Overloaded:
+        raise
     except Exception as e:
-        error_msg = str(e)
-        if "401" in error_msg:
-            return "🔒 *Ошибка авторизации DeepSeek.* Проверь DEEPSEEK_API_KEY в .env"
-        elif "429" in error_msg:
-            return "⏳ *Лимит запросов.* Подожди 30 секунд."
-        else:
-            return f"💥 *Ошибка связи с DeepSeek:* `{error_msg[:100]}`"
+        if meta is not None:
+            meta["error"] = True
+            meta["unavailable"] = is_retryable(e)
+        return _format_llm_error(e)
+
+
+async def stream_deepseek_response(messages: List[Dict[str, str]], user_id: str = None,
+                                   meta: dict = None) -> AsyncIterator[str]:
+    """
+    То же, что get_deepseek_response, но с stream=true: отдаёт куски текста по
+    мере генерации. Если потребитель прекращает чтение, выход из async with
+    закрывает ответ — DeepSeek перестаёт генерировать.
+    """
+    if not DEEPSEEK_API_KEY:
+        if meta is not None:
+            meta["error"] = True
+        yield NO_KEY_RESPONSE
+        return
 
+    headers, payload = _build_request(messages, stream=True)
+
+    try:
+        client = get_http_client()
+        async with admission.slot(user_id):
+            attempt = 0
+            while True:
+                await admission.bucket.acquire()
+                async with client.stream("POST", DEEPSEEK_API_URL, headers=headers, json=payload) as response:
+                    LLM_RESPONSES.inc("stream", response.status_code)
+                    try:
+                        response.raise_for_status()
+                    except httpx.HTTPStatusError as e:
+                        # повторяем только до первого токена
+                        if attempt >= admission.retries or not is_retryable(e):
+                            raise
+                        delay = backoff_delay(attempt, e)
+                    else:
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[5:].strip()
+                            if data == "[DONE]":
+                                break
+                            chunk = json.loads(data)
+                            if chunk.get("usage"):
+                                record_llm_usage("stream", chunk["usage"])
+                            if not chunk.get("choices"):
+                                continue
+                            delta = chunk["choices"][0].get("delta", {})
+                            if delta.get("content"):
+                                yield delta["content"]
+                        return
+                admission.retried += 1
+                await asyncio.sleep(delay)
+                attempt += 1
+    except Overloaded:
+        raise
+    except Exception as e:
+        if isinstance(e, httpx.TransportError):
+            LLM_RESPONSES.inc("stream", "error")
+        if meta is not None:
+            meta["error"] = True
+            meta["unavailable"] = is_retryable(e)
+        yield _format_llm_error(e)
 
-async def get_ai_response(player_state: PlayerState, user_action: str, events: list = None) -> str:
-    context = _build_context(player_state)
 
-    system_msg = SYSTEM_PROMPT + "\n\n=== КОНТЕКСТ ===\n" + context
+def _build_messages(player_state: PlayerState, user_action: str, events: list = None,
+                    world: Optional[WorldSnapshot] = None) -> List[Dict[str, str]]:
+    context = _build_context(player_state, world)
+
+    # SYSTEM_PROMPT уже первым сообщением добавляет _build_request — здесь контекст,
+    # затем память (летопись + последние ходы в пределах бюджета токенов)
+    system_msg = "=== КОНТЕКСТ ===\n" + context
 
     user_msg = f"Действие игрока: {user_action}"
     if events:
         user_msg += "\n\n=== СОБЫТИЯ ===\n" + "\n".join(events)
 
-    messages = [{"role": "user", "content": user_msg}]
-    raw_response = await get_deepseek_response([{"role": "system", "content": system_msg}] + messages)
-    return sanitize_ai_response(raw_response)
\ No newline at end of file
+    return ([{"role": "system", "content": system_msg}]
+            + history_messages(player_state)
+            + [{"role": "user", "content": user_msg}])
+
+
+def _prompt_tokens(messages: List[Dict[str, str]], meta: Optional[dict]) -> int:
+    tokens = count_prompt_tokens([{"role": "system", "content": SYSTEM_PROMPT}] + messages)
+    prompt_stats.record(tokens)
+    if meta is not None:
+        meta["prompt_tokens"] = tokens
+    return tokens
+
+
+async def get_ai_response(player_state: PlayerState, user_action: str, events: list = None, user_id: str = None,
+                          world: Optional[WorldSnapshot] = None, meta: dict = None,
+                          timer: Optional[StageTimer] = None) -> str:
+    timer = timer or StageTimer("get_ai_response")
+    with timer.stage("context_build"):
+        messages = _build_messages(player_state, user_action, events, world)
+        _prompt_tokens(messages, meta)
+        cache_key = None
+        if response_cache is not None:
+            # история входит в ключ: один и тот же ход в разных сюжетах — разные запросы
+            cache_key = response_cache.fingerprint("\x1f".join(m["content"] for m in messages[:-1]), user_action, events)
+    with timer.stage("llm_call"):
+        raw_response = await get_deepseek_response(messages, cache_key=cache_key, user_id=user_id, meta=meta)
+    with timer.stage("sanitize"):
+        return sanitize_ai_response(raw_response)
+
+
+async def stream_ai_response(player_state: PlayerState, user_action: str, events: list = None, user_id: str = None,
+                             world: Optional[WorldSnapshot] = None, meta: dict = None,
+                             timer: Optional[StageTimer] = None) -> AsyncIterator[str]:
+    """
+    Потоковая версия get_ai_response: чистит текст на лету и обрывает поток после 4 предложений.
+    Этапы: llm_first_token — до первого куска, llm_call — весь поток, sanitize — сумма по кускам.
+    """
+    timer = timer or StageTimer("stream_ai_response")
+    with timer.stage("context_build"):
+        messages = _build_messages(player_state, user_action, events, world)
+        _prompt_tokens(messages, meta)
+    sanitizer = ResponseSanitizer()
+    upstream = stream_deepseek_response(messages, user_id=user_id, meta=meta)
+    started = time.perf_counter()
+    first_token = True
+    sanitizing = 0.0
+    try:
+        async for chunk in upstream:
+            if first_token:
+                timer.record("llm_first_token", time.perf_counter() - started)
+                first_token = False
+            mark = time.perf_counter()
+            text = sanitizer.feed(chunk)
+            sanitizing += time.perf_counter() - mark
+            if text:
+                yield text
+            if sanitizer.done:
+                break
+        tail = sanitizer.finish()
+        if tail:
+            yield tail
+    finally:
+        await upstream.aclose()  # отменяет чтение из DeepSeek, если лимит достигнут раньше
+        timer.record("llm_call", time.perf_counter() - started - sanitizing)
+        timer.record("sanitize", sanitizing)
+
+
+async def summarize_history(summary: str, turns: List[Turn]) -> str:
+    """Новая летопись = прежняя + свёрнутые ходы. Вызывается в фоне, ошибки — вызывающему."""
+    if not DEEPSEEK_API_KEY:
+        return fold_locally(summary, turns)
+    lines = [f"Прежняя летопись: {summary or '—'}", "", "Новые ходы:"]
+    for action, response in turns:
+        lines.append(f"Игрок: {action}")
+        lines.append(f"Повествователь: {response}")
+    headers, payload = _build_request([{"role": "user", "content": "\n".join(lines)}], system=SUMMARY_PROMPT)
+    payload["temperature"] = 0.2
+    payload["max_tokens"] = 300
+    return await admission.call(lambda: _post_completion(headers, payload, kind="summary"))
@@ -1,38 +1,96 @@
 # utils.py
 import os
+import json
 import time
 import hashlib
 import hmac
-from urllib.parse import unquote
-from typing import Dict
+from urllib.parse import unquote, quote
+from typing import Dict, Optional
+from session_cache import SessionCache
 
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+INIT_DATA_MAX_AGE = 86400
+# Проверенные initData запоминаются: Mini App шлёт одну и ту же строку на каждом ходу
+INIT_DATA_CACHE_SIZE = int(os.getenv("INIT_DATA_CACHE_SIZE", "50000"))
+INIT_DATA_CACHE_TTL = float(os.getenv("INIT_DATA_CACHE_TTL", "3600"))
+
+
+def _derive_secret(bot_token: Optional[str]) -> Optional[bytes]:
+    if not bot_token:
+        return None
+    return hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+
+
+# Секрет зависит только от токена бота — считаем один раз при старте
+_SECRET = _derive_secret(BOT_TOKEN)
+_validated = SessionCache(max_entries=INIT_DATA_CACHE_SIZE, ttl=INIT_DATA_CACHE_TTL)
+
+
+def _parse(init_data: str) -> Dict[str, str]:
+    params = {}
+    for part in init_data.split("&"):
+        if "=" in part:
+            k, v = part.split("=", 1)
+            params[k] = unquote(v)
+    return params
+
+
+def _check_hash(params: Dict[str, str], secret: bytes) -> str:
+    data_check = "\n".join(f"{k}={v}" for k, v in sorted(params.items()) if k != "hash")
+    return hmac.new(secret, data_check.encode(), hashlib.sha256).hexdigest()
+
 
 def validate_init_data(init_data: str) -> Dict[str, str]:
     if not init_data or not BOT_TOKEN:
         raise ValueError("initData or BOT_TOKEN missing")
 
+    # Кэш: повторная проверка той же строки — без HMAC (но с учётом срока годности)
+    cached = _validated.get(init_data)
+    if cached is not None:
+        params, expires_at = cached
+        if time.time() <= expires_at:
+            return params
+        _validated.pop(init_data)
+
     try:
-        params = {}
-        for part in init_data.split("&"):
-            if "=" in part:
-                k, v = part.split("=", 1)
-                params[k] = unquote(v)
+        params = _parse(init_data)
 
         if "hash" not in params or "auth_date" not in params:
             raise ValueError("Required fields missing")
 
         auth_date = int(params["auth_date"])
-        if abs(time.time() - auth_date) > 86400:
+        if abs(time.time() - auth_date) > INIT_DATA_MAX_AGE:
             raise ValueError("initData expired")
 
-        data_check = "\n".join(f"{k}={v}" for k, v in sorted(params.items()) if k != "hash")
-        secret = hmac.new(b"WebAppData", BOT_TOKEN.encode(), hashlib.sha256).digest()
-        calc_hash = hmac.new(secret, data_check.encode(), hashlib.sha256).hexdigest()
+        calc_hash = _check_hash(params, _SECRET)
 
-        if calc_hash != params["hash"]:
+        if not hmac.compare_digest(calc_hash, params["hash"]):
             raise ValueError("Invalid hash")
 
+        _validated.set(init_data, (params, auth_date + INIT_DATA_MAX_AGE))
         return params
     except Exception as e:
-        raise ValueError(f"Validation failed: {e}")
\ No newline at end of file
+        raise ValueError(f"Validation failed: {e}")
+
+
+def init_data_cache_stats() -> Dict[str, object]:
+    return _validated.stats()
+
+
+def get_user_id(init_data: str) -> str:
+    """ID пользователя Telegram из проверенного initData"""
+    params = validate_init_data(init_data)
+    try:
+        return str(json.loads(params["user"])["id"])
+    except (KeyError, ValueError, TypeError):
+        raise ValueError("Validation failed: user missing")
+
+
+def sign_init_data(user: Dict[str, object], bot_token: str, auth_date: Optional[int] = None) -> str:
+    """Собирает подписанный initData — для нагрузочных тестов и локальной отладки без Telegram"""
+    params = {
+        "auth_date": str(auth_date or int(time.time())),
+        "user": json.dumps(user, ensure_ascii=False, separators=(",", ":")),
+    }
+    params["hash"] = _check_hash(params, _derive_secret(bot_token))
+    return "&".join(f"{k}={quote(v)}" for k, v in params.items())
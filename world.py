@@ -1,118 +1,361 @@
 # world.py
-from typing import Dict, List, Optional
-from enum import Enum
+import os
+import json
+import logging
+import argparse
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-class Region(str, Enum):
-    EBENGRAD = "Ебеньград"
-    LOGOVO_RYZHAYA = "Логово Рыжей"
+# Мир описан данными: data/world/index.json (манифест: регионы, граф выходов,
+# квест → регион, таблица символов) + по файлу на регион. Регионы читаются лениво,
+# при первом обращении. Таблица символов — имена регионов, предметов, врагов и id
+# квестов по порядку: номер в ней — компактный id в сохранённых состояниях игроков
+# (state_codec), поэтому она только дописывается и никогда не переупорядочивается.
+WORLD_DIR = os.getenv("WORLD_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "world"))
+MANIFEST = "index.json"
+# Заготовки запасного повествования (fallback.py) — рядом с регионами, но не регион
+FALLBACK_POOL = "fallback.json"
 
+
+# (mtime_ns, размер) файла на момент снимка: по нему видно, что файл правили после
+Fingerprint = Tuple[int, int]
+
+
+class WorldChanged(Exception):
+    """Файл мира изменён после снимка — в этом снимке его прежнего содержимого уже нет"""
+
+
+def _fingerprint(path: str) -> Optional[Fingerprint]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+@dataclass(frozen=True, slots=True)
 class NPC:
-    def __init__(self, name: str, role: str, description: str, dialogue: str):
-        self.name = name
-        self.role = role
-        self.description = description
-        self.dialogue = dialogue
+    name: str
+    role: str
+    description: str
+    dialogue: str
+
 
+@dataclass(frozen=True, slots=True)
 class Enemy:
-    def __init__(self, name: str, description: str, hp: int = 100):
-        self.name = name
-        self.description = description
-        self.hp = hp
+    name: str
+    description: str
+    hp: int = 100
 
+
+@dataclass(frozen=True, slots=True)
+class Item:
+    name: str
+    stems: Tuple[str, ...]  # основы слов, по которым предмет узнаётся в действии игрока
+    price: int
+    event: str              # событие для ИИ при покупке
+
+
+@dataclass(frozen=True, slots=True)
 class Quest:
-    def __init__(
-        self,
-        id: str,
-        name: str,
-        description: str,
-        trigger_condition: str,
-        completion_condition: str,
-        reward: str
-    ):
-        self.id = id
-        self.name = name
-        self.description = description
-        self.trigger_condition = trigger_condition  # например: "куплено 2 бутера и кофе"
-        self.completion_condition = completion_condition  # "Рыжая ведьма побеждена"
-        self.reward = reward
+    id: str
+    name: str
+    description: str
+    # Условия — данные, а не код: rules.compile_condition превращает их в предикаты
+    trigger_condition: Dict[str, Any]     # {"items": {"Бутерброд": 2, "Кофе": 1}}
+    completion_condition: Dict[str, Any]  # {"killed": ["Рыжая ведьма"]}
+    reward: str
+
 
+@dataclass(frozen=True, slots=True)
 class RegionData:
-    def __init__(
-        self,
-        name: Region,
-        description: str,
-        npcs: List[NPC],
-        enemies: List[Enemy],
-        quests: List[Quest],
-        exits: List[Region]
-    ):
-        self.name = name
-        self.description = description
-        self.npcs = npcs
-        self.enemies = enemies
-        self.quests = quests
-        self.exits = exits
-
-# ====== ОПИСАНИЕ МИРА ======
-REGIONS: Dict[Region, RegionData] = {}
-
-# NPC
-sanja = NPC(
-    name="Саня",
-    role="Бармен",
-    description="Полный, добродушный мужик в фартуке. Всегда с тряпкой и чашкой кофе.",
-    dialogue="«Эй, странник! Бутер с колбасой — 10 монет. Кофе — 5. А у той ведьмы в логове... эх, забыл, что собирался сказать»."
-)
-
-# Враги
-ryzhaya_witch = Enemy(
-    name="Рыжая ведьма",
-    description="Высокая женщина в лохмотьях, с огненно-рыжими волосами и пустыми глазницами. В руках — костяной посох, из которого сочится чёрная слизь.",
-    hp = 250
-)
-
-# Квесты
-quest_kill_witch = Quest(
-    id="kill_ryzhaya_witch",
-    name="Избавь Ебеньград от проклятия",
-    description="Саня шепнул, что ведьма похищает детей по ночам. Найди её логово и уничтожь.",
-    trigger_condition="player.inventory.get('Бутерброд') >= 2 and player.inventory.get('Кофе') >= 1",
-    completion_condition="player.killed_enemies.contains('Рыжая ведьма')",
-    reward="50 золотых, +репутация 'Защитник Ебеньграда'"
-)
-
-# Регионы
-REGIONS[Region.EBENGRAD] = RegionData(
-    name=Region.EBENGRAD,
-    description=(
-        "Городок на болоте. Кривые домишки на сваях, вонь тины и жареной колбасы. "
-        "В центре — таверна «Бутерброды у Сани», где за стойкой стоит бармен Саня. "
-        "Оттуда доносится гул голосов и звон кружек."
-    ),
-    npcs=[sanja],
-    enemies=[],
-    quests=[quest_kill_witch],
-    exits=[Region.LOGOVO_RYZHAYA]
-)
-
-REGIONS[Region.LOGOVO_RYZHAYA] = RegionData(
-    name=Region.LOGOVO_RYZHAYA,
-    description=(
-        "Тёмная пещера под корнями гнилого дуба. Стены покрыты слизью и рунами. "
-        "Воздух гудит от магии. В глубине — алтарь из черепов."
-    ),
-    npcs=[],
-    enemies=[ryzhaya_witch],
-    quests=[],
-    exits=[Region.EBENGRAD]
-)
+    name: str
+    description: str
+    npcs: Tuple[NPC, ...] = ()
+    enemies: Tuple[Enemy, ...] = ()
+    quests: Tuple[Quest, ...] = ()
+    exits: Tuple[str, ...] = ()
+    shop: Tuple[Item, ...] = ()
+    # Как игрок просится сюда: варианты, в каждом — основы, которые нужны все сразу
+    travel_keywords: Tuple[Tuple[str, ...], ...] = ()
 
-def get_region(name: str) -> Optional[RegionData]:
-    return REGIONS.get(Region(name), None)
+    @classmethod
+    def from_dict(cls, doc: Dict[str, Any]) -> "RegionData":
+        return cls(
+            name=doc["name"],
+            description=doc.get("description", ""),
+            npcs=tuple(NPC(**n) for n in doc.get("npcs", [])),
+            enemies=tuple(Enemy(**e) for e in doc.get("enemies", [])),
+            quests=tuple(Quest(**q) for q in doc.get("quests", [])),
+            exits=tuple(doc.get("exits", [])),
+            shop=tuple(Item(**{**i, "stems": tuple(i["stems"])}) for i in doc.get("shop", [])),
+            travel_keywords=tuple(tuple(group) for group in doc.get("travel_keywords", [])),
+        )
 
-def get_quest_by_id(quest_id: str) -> Optional[Quest]:
-    for region in REGIONS.values():
+
+class WorldSnapshot:
+    """
+    Неизменяемый снимок мира. Индексы (имя → файл, граф выходов, квест → регион)
+    берутся из манифеста; сами регионы читаются при первом обращении и остаются
+    в снимке. При создании снимка запоминаются отпечатки файлов: файл, который
+    правили после, снимок не прочтёт (WorldChanged), чтобы не смешать версии мира.
+    Запрос держит один снимок от начала до конца — перезагрузка мира подменяет
+    ссылку на новый снимок и не трогает старый.
+    """
+
+    def __init__(self, version: int, regions: Dict[str, Dict[str, Any]], quests: Dict[str, str],
+                 root: Optional[str] = None, loaded: Optional[Dict[str, RegionData]] = None,
+                 symbols: Tuple[str, ...] = (), fingerprints: Optional[Dict[str, Optional[Fingerprint]]] = None):
+        self.version = version
+        self.root = root
+        self._manifest = regions      # имя → {"file": ..., "exits": [...]}
+        self._quest_regions = quests  # id квеста → имя региона
+        self.symbols = tuple(symbols)
+        self._fingerprints = dict(fingerprints or {})  # файл → отпечаток на момент снимка
+        self._regions: Dict[str, RegionData] = dict(loaded or {})
+        self._derived: Dict[Any, Any] = {}
+
+    @classmethod
+    def load(cls, root: str = WORLD_DIR, version: int = 1) -> "WorldSnapshot":
+        with open(os.path.join(root, MANIFEST), encoding="utf-8") as f:
+            manifest = json.load(f)
+        files = [entry["file"] for entry in manifest["regions"].values()] + [FALLBACK_POOL]
+        return cls(version, manifest["regions"], manifest.get("quests", {}), root=root,
+                   symbols=manifest.get("symbols", ()),
+                   fingerprints={filename: _fingerprint(os.path.join(root, filename)) for filename in files})
+
+    @classmethod
+    def from_regions(cls, regions: List[RegionData], version: int = 1) -> "WorldSnapshot":
+        """Снимок из готовых объектов — для скриптов и бенчмарков без файлов"""
+        manifest = {r.name: {"exits": list(r.exits)} for r in regions}
+        quests = {q.id: r.name for r in regions for q in r.quests}
+        return cls(version, manifest, quests, loaded={r.name: r for r in regions},
+                   symbols=_extend_symbols((), (_region_symbols(r.name, r) for r in regions)))
+
+    def region_names(self) -> List[str]:
+        return list(self._manifest)
+
+    @property
+    def region_count(self) -> int:
+        return len(self._manifest)
+
+    def exits(self, name: str) -> Tuple[str, ...]:
+        entry = self._manifest.get(name)
+        return tuple(entry.get("exits", ())) if entry else ()
+
+    def get_region(self, name: str) -> Optional[RegionData]:
+        region = self._regions.get(name)
+        if region is None:
+            entry = self._manifest.get(name)
+            raw = self.read_file(entry["file"]) if entry is not None else None
+            if raw is None:
+                return None
+            region = self._regions[name] = RegionData.from_dict(json.loads(raw))
+        return region
+
+    def read_file(self, filename: str) -> Optional[bytes]:
+        """
+        Файл мира в той версии, что была при создании снимка (None — его не было).
+        Файл с тех пор правили — WorldChanged: прочесть старую версию уже нельзя.
+        """
+        if self.root is None:
+            return None
+        expected = self._fingerprints.get(filename)
+        try:
+            with open(os.path.join(self.root, filename), "rb") as f:
+                raw = f.read()
+                st = os.fstat(f.fileno())
+        except FileNotFoundError:
+            raw, fingerprint = None, None
+        else:
+            fingerprint = (st.st_mtime_ns, st.st_size)
+        if fingerprint != expected:
+            raise WorldChanged(f"{filename} изменён после снимка мира версии {self.version}")
+        return raw
+
+    def pin(self, names) -> None:
+        """Загружает регионы заранее: дальше запрос берёт их из снимка, не с диска"""
+        for name in names:
+            self.get_region(name)
+
+    def quest_region(self, quest_id: str) -> Optional[str]:
+        return self._quest_regions.get(quest_id)
+
+    def changed_files(self) -> List[str]:
+        """Уже прочитанные файлы (и манифест не в счёт), которые правили после снимка"""
+        if self.root is None:
+            return []
+        loaded = [self._manifest.get(name, {}).get("file") for name in self._regions]
+        return [filename for filename in loaded if filename is not None
+                if _fingerprint(os.path.join(self.root, filename)) != self._fingerprints.get(filename)]
+
+    def get_quest(self, quest_id: str) -> Optional[Quest]:
+        region = self.get_region(self._quest_regions.get(quest_id, ""))
+        if region is None:
+            return None
         for q in region.quests:
             if q.id == quest_id:
                 return q
-    return None
\ No newline at end of file
+        return None
+
+    def symbol_ids(self) -> Dict[str, int]:
+        """Имя → номер в таблице символов"""
+        return self.derived(("symbol_ids",), lambda: {name: i for i, name in enumerate(self.symbols)})
+
+    def loaded_regions(self) -> List[str]:
+        return list(self._regions)
+
+    def derived(self, key: Any, factory: Callable[[], Any]) -> Any:
+        """Производные данные (фрагменты промпта, правила) живут вместе со снимком"""
+        value = self._derived.get(key)
+        if value is None:
+            value = self._derived[key] = factory()
+        return value
+
+
+def _region_symbols(name: str, region: Any) -> List[str]:
+    """Имена из региона, которые попадают в состояние игрока (RegionData или dict из файла)"""
+    if isinstance(region, RegionData):
+        items = [i.name for i in region.shop]
+        enemies = [e.name for e in region.enemies]
+        quests = [q.id for q in region.quests]
+    else:
+        items = [i["name"] for i in region.get("shop", [])]
+        enemies = [e["name"] for e in region.get("enemies", [])]
+        quests = [q["id"] for q in region.get("quests", [])]
+    return [name] + items + enemies + quests
+
+
+def _extend_symbols(previous, groups) -> Tuple[str, ...]:
+    """Старые символы на своих местах, новые — в конец"""
+    symbols = list(previous)
+    known = set(symbols)
+    for group in groups:
+        for name in group:
+            if name not in known:
+                known.add(name)
+                symbols.append(name)
+    return tuple(symbols)
+
+
+def build_manifest(root: str = WORLD_DIR, previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Пересобирает index.json по файлам регионов (после правки данных мира).
+    previous — прежний манифест: его таблица символов сохраняется как есть.
+    """
+    regions, quests, found = {}, {}, []
+    for filename in sorted(os.listdir(root)):
+        if not filename.endswith(".json") or filename in (MANIFEST, FALLBACK_POOL):
+            continue
+        with open(os.path.join(root, filename), encoding="utf-8") as f:
+            doc = json.load(f)
+        regions[doc["name"]] = {"file": filename, "exits": doc.get("exits", [])}
+        for q in doc.get("quests", []):
+            quests[q["id"]] = doc["name"]
+        found.append(_region_symbols(doc["name"], doc))
+    for name, entry in regions.items():
+        unknown = [e for e in entry["exits"] if e not in regions]
+        if unknown:
+            raise ValueError(f"{name}: выходы в несуществующие регионы: {', '.join(unknown)}")
+    symbols = _extend_symbols((previous or {}).get("symbols", ()), found)
+    return {"regions": regions, "quests": quests, "symbols": list(symbols)}
+
+
+# ====== ТЕКУЩИЙ СНИМОК ======
+def _initial_world() -> WorldSnapshot:
+    if not os.path.exists(os.path.join(WORLD_DIR, MANIFEST)):
+        logging.warning(f"Нет {MANIFEST} в {WORLD_DIR} — мир пуст (python world.py соберёт манифест)")
+        return WorldSnapshot(0, {}, {})
+    return WorldSnapshot.load()
+
+
+def _manifest_mtime_of(root: str) -> Optional[float]:
+    try:
+        return os.path.getmtime(os.path.join(root, MANIFEST))
+    except OSError:
+        return None
+
+
+_manifest_mtime: Optional[float] = _manifest_mtime_of(WORLD_DIR)
+_world: WorldSnapshot = _initial_world()
+_reload_listeners: List[Callable[[WorldSnapshot], None]] = []
+_reload_lock = threading.RLock()  # опрос идёт в потоке, refresh_world — из запросов
+
+
+def current_world() -> WorldSnapshot:
+    return _world
+
+
+def on_reload(callback: Callable[[WorldSnapshot], None]):
+    _reload_listeners.append(callback)
+
+
+def set_world(snapshot: WorldSnapshot) -> WorldSnapshot:
+    """Атомарно подменяет снимок мира"""
+    global _world
+    _world = snapshot
+    for callback in _reload_listeners:
+        callback(snapshot)
+    return snapshot
+
+
+def reload_world(root: str = WORLD_DIR) -> WorldSnapshot:
+    """
+    Перечитывает мир без рестарта. Регионы, которые уже были загружены,
+    читаются заранее — горячая часть мира переключается целиком.
+    """
+    global _manifest_mtime
+    with _reload_lock:
+        old = _world
+        new = WorldSnapshot.load(root, version=old.version + 1)
+        new.pin(old.loaded_regions())
+        _manifest_mtime = _manifest_mtime_of(root)
+        logging.info(f"Мир перезагружен: версия {new.version}, регионов {len(new.region_names())}")
+        return set_world(new)
+
+
+def refresh_world(stale: WorldSnapshot) -> WorldSnapshot:
+    """Снимок устарел (WorldChanged): перезагрузка, если её ещё не сделал другой запрос"""
+    with _reload_lock:
+        if _world is stale:
+            reload_world(stale.root or WORLD_DIR)
+        return _world
+
+
+def reload_if_changed(root: str = WORLD_DIR) -> bool:
+    """
+    Для фонового опроса: перезагрузка, если изменился index.json или файл уже
+    загруженного региона. Правку ещё не прочитанного региона заметит первый
+    запрос к нему (WorldChanged → refresh_world).
+    """
+    mtime = _manifest_mtime_of(root)
+    if mtime is None:
+        return False
+    if mtime == _manifest_mtime and _world.root == root and not _world.changed_files():
+        return False
+    reload_world(root)
+    return True
+
+
+def get_region(name: str) -> Optional[RegionData]:
+    return _world.get_region(name)
+
+
+def get_quest_by_id(quest_id: str) -> Optional[Quest]:
+    return _world.get_quest(quest_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Пересобрать data/world/index.json по файлам регионов")
+    parser.add_argument("root", nargs="?", default=WORLD_DIR)
+    args = parser.parse_args()
+    path = os.path.join(args.root, MANIFEST)
+    previous = None
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            previous = json.load(f)
+    manifest = build_manifest(args.root, previous)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+        f.write("\n")